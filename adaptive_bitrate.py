@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+RTCP 驱动的自适应码率
+
+定期读取每个编码分支所有 RTSP media 的 RTCP 接收报告 (丢包率、抖动、RTT)，
+按最差的客户端在 [下限, 上限] 之间调整运行中编码器的 bitrate 属性:
+
+    丢包 >= loss_high 或 RTT >= rtt_high_ms 连续 down_after 次  ->  码率 x decrease
+    丢包 <= loss_low 且 RTT < rtt_high_ms 连续 up_after 次      ->  码率 + 上限 x increase
+    两者之间                                                  ->  保持 (滞回区)
+
+每次调整后至少 hold 秒不再调整，避免震荡。上限为配置的码率，下限默认为其 25%。
+决策结果以 abr_* 指标输出到 /metrics。
+
+配置 (multi_res 配置的 adaptive_bitrate，true 表示全部使用默认值):
+
+    "adaptive_bitrate": {
+      "min_kbps": 1000,          # 下限 (默认 上限 x min_ratio)
+      "min_ratio": 0.25,
+      "loss_high": 0.05,         # 丢包率 5% 以上降码率
+      "loss_low": 0.01,          # 丢包率 1% 以下才回升
+      "rtt_high_ms": 300,
+      "decrease": 0.7,
+      "increase": 0.1,
+      "down_after": 1,
+      "up_after": 3,
+      "hold": 4
+    }
+"""
+
+import time
+
+from gi.repository import GLib
+
+from metrics import rtcp_client_stats
+
+
+ABR_DEFAULTS = {
+    'min_kbps': None,
+    'min_ratio': 0.25,
+    'loss_high': 0.05,
+    'loss_low': 0.01,
+    'rtt_high_ms': 300,
+    'decrease': 0.7,
+    'increase': 0.1,
+    'down_after': 1,
+    'up_after': 3,
+    'hold': 4,
+}
+
+
+def abr_settings(*blocks):
+    """
+    合并自适应码率配置 (后面的覆盖前面的，如 全局 -> 单路)
+
+    Args:
+        blocks: true / false / dict / None
+
+    Returns:
+        合并后的配置 dict，未启用时返回 None
+    """
+    merged = None
+    for block in blocks:
+        if block is None:
+            continue
+        if block is False or (isinstance(block, dict) and block.get('enable') is False):
+            merged = None
+            continue
+        merged = dict(merged or ABR_DEFAULTS)
+        if isinstance(block, dict):
+            merged.update({k: v for k, v in block.items() if k != 'enable'})
+    return merged
+
+
+class BranchState:
+    """一个编码分支的码率状态"""
+
+    def __init__(self, name: str, encoder, ceiling_kbps: int, settings: dict, medias):
+        self.name = name
+        self.encoder = encoder
+        self.settings = settings
+        self.medias = medias  # 无参函数，返回该分支当前的 RTSP media 列表
+        self.ceiling = ceiling_kbps
+        self.floor = min(ceiling_kbps, settings['min_kbps'] or
+                         max(100, int(ceiling_kbps * settings['min_ratio'])))
+        self.current = ceiling_kbps
+        self.bad = 0  # 连续拥塞次数
+        self.good = 0  # 连续良好次数
+        self.changed_at = 0.0
+        self.decreases = 0
+        self.increases = 0
+        self.loss = 0.0
+        self.rtt = 0.0
+        self.jitter_ms = 0.0
+        self.reports = 0
+
+
+class AdaptiveBitrateController:
+    """所有编码分支的自适应码率 (在主循环中运行)"""
+
+    def __init__(self, backend, interval: int = 2, metrics=None):
+        """
+        Args:
+            backend: gst_backend.Backend (不同编码器的 bitrate 单位不同)
+            interval: 采样间隔 (秒)
+            metrics: ServerMetrics，输出 abr_* 指标
+        """
+        self.backend = backend
+        self.interval = interval
+        self.branches = {}  # name -> BranchState
+        self._timer = None
+        if metrics:
+            r = metrics.registry
+            r.describe('abr_bitrate_bps', 'gauge', 'Encoder bitrate chosen by the adaptive controller')
+            r.describe('abr_ceiling_bps', 'gauge', 'Configured (maximum) encoder bitrate')
+            r.describe('abr_floor_bps', 'gauge', 'Minimum encoder bitrate')
+            r.describe('abr_worst_fraction_lost', 'gauge', 'Worst RTCP fraction lost among clients')
+            r.describe('abr_worst_rtt_seconds', 'gauge', 'Worst RTCP round-trip time among clients')
+            r.describe('abr_adjustments_total', 'counter', 'Bitrate adjustments by direction')
+            r.add_collector(self._collect)
+
+    def add_branch(self, name: str, encoder, ceiling_kbps: int, settings: dict, medias):
+        """
+        开始调节一个编码分支
+
+        同名分支重建 (新的编码器) 后从上限开始；同一个编码器重新登记 (热加载) 时
+        保留当前码率，只按新的上下限收紧
+
+        Args:
+            name: 分支名称 (日志和指标标签)
+            encoder: 运行中的编码器元素
+            ceiling_kbps: 配置的码率，作为上限
+            settings: abr_settings() 的结果
+            medias: 无参函数，返回该分支当前的 RTSP media 列表
+        """
+        state = BranchState(name, encoder, ceiling_kbps, settings, medias)
+        old = self.branches.get(name)
+        if old is not None and old.encoder is encoder:
+            state.current = min(state.ceiling, max(state.floor, old.current))
+            state.decreases, state.increases = old.decreases, old.increases
+            if state.current != old.current:
+                self.backend.set_bitrate(encoder, state.current * 1000)
+        self.branches[name] = state
+        if self._timer is None:
+            self._timer = GLib.timeout_add_seconds(self.interval, self._on_tick)
+
+    def remove_branch(self, name: str, restore: bool = False):
+        """
+        停止调节一个编码分支
+
+        Args:
+            restore: 把编码器恢复到配置的码率 (关闭自适应码率但编码器继续运行时)
+        """
+        branch = self.branches.pop(name, None)
+        if restore and branch is not None and branch.current != branch.ceiling:
+            self.backend.set_bitrate(branch.encoder, branch.ceiling * 1000)
+
+    def _on_tick(self):
+        now = time.monotonic()
+        for branch in list(self.branches.values()):
+            self._update(branch, now)
+        return True
+
+    def _update(self, branch: BranchState, now: float):
+        reports = []
+        for media in branch.medias():
+            if media.get_element() is not None:
+                reports += rtcp_client_stats(media)
+        branch.reports = len(reports)
+        if not reports:
+            branch.bad = branch.good = 0
+            return
+
+        s = branch.settings
+        branch.loss = max(rb['fraction_lost'] for rb in reports)
+        branch.rtt = max(rb['rtt'] for rb in reports)
+        # jitter 为 90kHz RTP 时间戳单位
+        branch.jitter_ms = max(rb['jitter'] for rb in reports) / 90.0
+        rtt_ms = branch.rtt * 1000
+
+        if branch.loss >= s['loss_high'] or rtt_ms >= s['rtt_high_ms']:
+            branch.bad += 1
+            branch.good = 0
+        elif branch.loss <= s['loss_low']:
+            branch.good += 1
+            branch.bad = 0
+        else:
+            branch.bad = branch.good = 0
+            return
+
+        if now - branch.changed_at < s['hold']:
+            return
+        if branch.bad >= s['down_after'] and branch.current > branch.floor:
+            target = max(branch.floor, int(branch.current * s['decrease']))
+            branch.decreases += 1
+        elif branch.good >= s['up_after'] and branch.current < branch.ceiling:
+            target = min(branch.ceiling, branch.current + max(1, int(branch.ceiling * s['increase'])))
+            branch.increases += 1
+        else:
+            return
+
+        print(f"[码率] {branch.name}: {branch.current} -> {target} kbps "
+              f"(最差客户端丢包 {branch.loss * 100:.1f}%, RTT {rtt_ms:.0f}ms, "
+              f"抖动 {branch.jitter_ms:.1f}ms, {branch.reports} 个接收报告)")
+        self.backend.set_bitrate(branch.encoder, target * 1000)
+        branch.current = target
+        branch.changed_at = now
+        branch.bad = branch.good = 0
+
+    def _collect(self) -> list:
+        samples = []
+        for name, branch in sorted(self.branches.items()):
+            labels = {'branch': name}
+            samples.append(('abr_bitrate_bps', labels, branch.current * 1000))
+            samples.append(('abr_ceiling_bps', labels, branch.ceiling * 1000))
+            samples.append(('abr_floor_bps', labels, branch.floor * 1000))
+            samples.append(('abr_worst_fraction_lost', labels, round(branch.loss, 4)))
+            samples.append(('abr_worst_rtt_seconds', labels, round(branch.rtt, 4)))
+            samples.append(('abr_adjustments_total', dict(labels, direction='down'), branch.decreases))
+            samples.append(('abr_adjustments_total', dict(labels, direction='up'), branch.increases))
+        return samples
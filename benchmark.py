@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+流媒体 pipeline 吞吐量基准测试
+
+用 videotestsrc 测试源启动 MultiResolutionRTSPServer / MultiCameraRTSPServer 配置，
+对每路流拉起 N 个本地 RTSP 客户端，记录:
+  - 每路流实际 fps、实际比特率、丢帧数、RTP 丢包数
+  - 服务器进程和客户端进程的 CPU% 与 RSS
+
+按 流数 x 分辨率 x 比特率 扫描，输出 JSON 报告并给出饱和点
+(第一个有流达不到目标帧率 90% 的组合)，在配置上线前确认设备能力。
+"""
+
+import sys
+import os
+import argparse
+import json
+import platform
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import itertools
+
+import gi
+
+gi.require_version('Gst', '1.0')
+gi.require_version('GstRtp', '1.0')
+from gi.repository import Gst, GstRtp, GLib
+
+from pipeline_graph import PipelineBuildError, PipelineGraph, element
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 实际帧率低于目标帧率的该比例即视为饱和
+SATURATION_FPS_RATIO = 0.9
+
+
+class ProcessSampler:
+    """通过 /proc 采样一个进程的 CPU 时间和 RSS"""
+
+    _CLK_TCK = os.sysconf('SC_CLK_TCK')
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self._start_cpu = None
+        self._start_wall = None
+        self.rss_peak_kb = 0
+
+    def _cpu_seconds(self) -> float:
+        with open(f'/proc/{self.pid}/stat') as f:
+            # comm 字段可能含空格，从最后一个 ')' 之后开始切分
+            fields = f.read().rsplit(')', 1)[1].split()
+        utime, stime = int(fields[11]), int(fields[12])
+        return (utime + stime) / self._CLK_TCK
+
+    def _rss_kb(self) -> int:
+        with open(f'/proc/{self.pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+        return 0
+
+    def start(self):
+        self._start_cpu = self._cpu_seconds()
+        self._start_wall = time.monotonic()
+        self.rss_peak_kb = self._rss_kb()
+
+    def sample(self):
+        """更新 RSS 峰值 (定期调用)"""
+        try:
+            self.rss_peak_kb = max(self.rss_peak_kb, self._rss_kb())
+        except OSError:
+            pass
+
+    def result(self) -> dict:
+        try:
+            cpu = self._cpu_seconds() - self._start_cpu
+            rss = self._rss_kb()
+        except OSError:
+            return {'pid': self.pid, 'error': '进程已退出'}
+        wall = time.monotonic() - self._start_wall
+        return {
+            'pid': self.pid,
+            'cpu_percent': round(cpu / wall * 100, 1) if wall > 0 else 0.0,
+            'rss_mb': round(rss / 1024, 1),
+            'rss_peak_mb': round(max(self.rss_peak_kb, rss) / 1024, 1),
+        }
+
+
+class PullClient:
+    """一个本地 RTSP 拉流客户端: rtspsrc -> depay -> parse -> fakesink"""
+
+    def __init__(self, name: str, url: str, codec: str):
+        self.name = name
+        self.url = url
+        self.codec = codec
+        self.pipeline = None
+        self.error = None
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """清零计数 (预热结束时调用)"""
+        with self._lock:
+            self.frames = 0
+            self.bytes = 0
+            self.rtp_packets = 0
+            self.rtp_lost = 0
+            self._last_seq = None
+            self.started = time.monotonic()
+
+    def start(self):
+        depay = 'rtph264depay' if self.codec == 'h264' else 'rtph265depay'
+        parse = 'h264parse' if self.codec == 'h264' else 'h265parse'
+
+        graph = PipelineGraph()
+        graph.chain([
+            element('rtspsrc', name='src', location=self.url, latency=0),
+            element(depay, name='depay'),
+            element(parse),
+            element('fakesink', name='sink', sync=False),
+        ])
+        self.pipeline = graph.build()
+        graph['depay'].get_static_pad('sink').add_probe(Gst.PadProbeType.BUFFER, self._on_rtp)
+        graph['sink'].get_static_pad('sink').add_probe(Gst.PadProbeType.BUFFER, self._on_frame)
+
+        bus = self.pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect('message::error', self._on_error)
+        self.pipeline.set_state(Gst.State.PLAYING)
+
+    def stop(self):
+        if self.pipeline is not None:
+            self.pipeline.get_bus().remove_signal_watch()
+            self.pipeline.set_state(Gst.State.NULL)
+            self.pipeline = None
+
+    def _on_error(self, bus, message):
+        err, _ = message.parse_error()
+        self.error = err.message
+
+    def _on_rtp(self, pad, info):
+        buf = info.get_buffer()
+        ok, rtp = GstRtp.RTPBuffer.map(buf, Gst.MapFlags.READ)
+        if not ok:
+            return Gst.PadProbeReturn.OK
+        seq = rtp.get_seq()
+        rtp.unmap()
+        with self._lock:
+            self.rtp_packets += 1
+            if self._last_seq is not None:
+                gap = (seq - self._last_seq - 1) & 0xFFFF
+                if gap < 0x8000:  # 忽略乱序
+                    self.rtp_lost += gap
+            self._last_seq = seq
+        return Gst.PadProbeReturn.OK
+
+    def _on_frame(self, pad, info):
+        with self._lock:
+            self.frames += 1
+            self.bytes += info.get_buffer().get_size()
+        return Gst.PadProbeReturn.OK
+
+    def result(self, target_fps: int) -> dict:
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            fps = self.frames / elapsed if elapsed > 0 else 0.0
+            expected = int(target_fps * elapsed)
+            return {
+                'name': self.name,
+                'url': self.url,
+                'target_fps': target_fps,
+                'fps': round(fps, 2),
+                'bitrate_kbps': round(self.bytes * 8 / elapsed / 1000, 1) if elapsed > 0 else 0.0,
+                'frames': self.frames,
+                'dropped_frames': max(0, expected - self.frames),
+                'rtp_packets': self.rtp_packets,
+                'rtp_lost': self.rtp_lost,
+                'error': self.error,
+            }
+
+
+def build_multi_res_config(count: int, width: int, height: int, bitrate: int, framerate: int,
+                           codec: str, base_port: int, share_encoders: bool) -> dict:
+    """生成 MultiResolutionRTSPServer 测试配置 (videotestsrc 源)"""
+    streams = []
+    for i in range(count):
+        streams.append({
+            'name': f'bench{i}',
+            'port': base_port + i,
+            'mount': '/stream',
+            'width': width,
+            'height': height,
+            'framerate': framerate,
+            'codec': codec,
+            # 默认每路流略微错开比特率，使每路都有独立编码器，测量真实编码能力
+            'bitrate': bitrate if share_encoders else bitrate + i,
+        })
+    return {
+        'on_demand': False,
+        'camera': {
+            'source': 'test',
+            'input_width': width,
+            'input_height': height,
+            'framerate': framerate,
+        },
+        'streams': streams,
+    }
+
+
+def build_multi_camera_config(count: int, width: int, height: int, bitrate: int, framerate: int,
+                              codec: str, base_port: int) -> dict:
+    """生成 MultiCameraRTSPServer 测试配置 (每路独立 videotestsrc)"""
+    return {
+        'port': base_port,
+        'streams': [{
+            'name': f'bench{i}',
+            'port': base_port + i,
+            'mount': '/stream',
+            'source': 'test',
+            'input_width': width,
+            'input_height': height,
+            'output_width': width,
+            'output_height': height,
+            'codec': codec,
+            'bitrate': bitrate,
+            'framerate': framerate,
+        } for i in range(count)],
+    }
+
+
+def wait_for_port(port: int, timeout: float) -> bool:
+    """等待本地 TCP 端口可连接"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+class Benchmark:
+    """一次完整的扫描"""
+
+    def __init__(self, args):
+        self.args = args
+        self.loop = GLib.MainLoop()
+
+    def _run_loop_for(self, seconds: float, tick=None):
+        """运行 GLib 主循环指定秒数，期间每秒调用 tick"""
+        def on_tick():
+            if tick:
+                tick()
+            return True
+
+        tick_id = GLib.timeout_add_seconds(1, on_tick)
+        GLib.timeout_add(int(seconds * 1000), self.loop.quit)
+        self.loop.run()
+        GLib.source_remove(tick_id)
+
+    def run_point(self, count: int, width: int, height: int, bitrate: int) -> dict:
+        """运行一个扫描点"""
+        args = self.args
+        if args.mode == 'multi_res':
+            config = build_multi_res_config(count, width, height, bitrate, args.framerate,
+                                            args.codec, args.base_port, args.share_encoders)
+            cmd = [sys.executable, os.path.join(SCRIPT_DIR, 'multi_res_server.py'), '--config']
+        else:
+            config = build_multi_camera_config(count, width, height, bitrate, args.framerate,
+                                               args.codec, args.base_port)
+            cmd = [sys.executable, os.path.join(SCRIPT_DIR, 'camera_rtsp_server.py'), '--config']
+
+        point = {
+            'streams': count,
+            'resolution': f'{width}x{height}',
+            'bitrate_kbps': bitrate,
+            'framerate': args.framerate,
+            'clients_per_stream': args.clients,
+            'duration': args.duration,
+        }
+
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump(config, f)
+            config_path = f.name
+
+        cmd += [config_path, '--backend', args.backend]
+        log = open(os.path.join(tempfile.gettempdir(), 'benchmark_server.log'), 'a')
+        server = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+        clients = []
+        try:
+            ports = [s['port'] for s in config['streams']]
+            if not all(wait_for_port(p, args.startup_timeout) for p in ports):
+                point['error'] = '服务器启动超时'
+                return point
+
+            for s in config['streams']:
+                url = f"rtsp://127.0.0.1:{s['port']}{s['mount']}"
+                for c in range(args.clients):
+                    client = PullClient(f"{s['name']}#{c}", url, args.codec)
+                    try:
+                        client.start()
+                    except PipelineBuildError as e:
+                        client.error = str(e)
+                    clients.append(client)
+
+            # 预热: 等待所有客户端完成 DESCRIBE/SETUP 和首个 IDR
+            self._run_loop_for(args.warmup)
+            for client in clients:
+                client.reset()
+
+            server_sampler = ProcessSampler(server.pid)
+            client_sampler = ProcessSampler(os.getpid())
+            server_sampler.start()
+            client_sampler.start()
+
+            def tick():
+                server_sampler.sample()
+                client_sampler.sample()
+
+            self._run_loop_for(args.duration, tick)
+
+            point['server_process'] = server_sampler.result()
+            point['client_process'] = client_sampler.result()
+            point['per_stream'] = [c.result(args.framerate) for c in clients]
+            point['min_fps'] = min((r['fps'] for r in point['per_stream']), default=0.0)
+            point['saturated'] = any(
+                r['error'] or r['fps'] < args.framerate * SATURATION_FPS_RATIO
+                for r in point['per_stream'])
+            return point
+        finally:
+            for client in clients:
+                client.stop()
+            server.send_signal(2)  # SIGINT，让服务器正常退出
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+                server.wait()
+            log.close()
+            os.unlink(config_path)
+
+    def run(self) -> dict:
+        args = self.args
+        report = {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'host': platform.node(),
+            'machine': platform.machine(),
+            'mode': args.mode,
+            'backend': args.backend,
+            'codec': args.codec,
+            'runs': [],
+            'saturation_point': None,
+        }
+
+        points = list(itertools.product(args.streams, args.resolutions, args.bitrates))
+        for i, (count, (width, height), bitrate) in enumerate(points):
+            print(f"[{i + 1}/{len(points)}] {count} 路 {width}x{height} {bitrate} kbps ...", flush=True)
+            point = self.run_point(count, width, height, bitrate)
+            report['runs'].append(point)
+
+            if 'error' in point:
+                print(f"    错误: {point['error']}")
+                continue
+            srv = point['server_process']
+            print(f"    最低 fps: {point['min_fps']:.1f}/{args.framerate}  "
+                  f"服务器 CPU: {srv.get('cpu_percent')}%  RSS: {srv.get('rss_mb')} MB"
+                  f"{'  [饱和]' if point['saturated'] else ''}")
+            if point['saturated'] and report['saturation_point'] is None:
+                report['saturation_point'] = {k: point[k] for k in
+                                              ('streams', 'resolution', 'bitrate_kbps', 'min_fps')}
+
+        return report
+
+
+def _parse_int_list(value: str) -> list:
+    return [int(v) for v in value.split(',') if v]
+
+
+def _parse_resolutions(value: str) -> list:
+    result = []
+    for item in value.split(','):
+        w, h = item.lower().split('x')
+        result.append((int(w), int(h)))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="RTSP 流媒体 pipeline 吞吐量基准测试",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例:
+  # 多分辨率服务器: 1/2/4/8 路 1080p，每路 1 个客户端
+  python3 benchmark.py --streams 1,2,4,8 --resolutions 1920x1080
+
+  # 扫描分辨率和比特率，每路 3 个客户端，结果写入 report.json
+  python3 benchmark.py --streams 2,4 --resolutions 1280x720,1920x1080 \\
+      --bitrates 4000,8000,16000 --clients 3 --output report.json
+
+  # 多路相机服务器，软件编解码 (x86 开发机)
+  python3 benchmark.py --mode multi_camera --backend software --streams 1,2
+        """
+    )
+    parser.add_argument("--mode", choices=["multi_res", "multi_camera"], default="multi_res",
+                        help="被测服务器: multi_res (单源多流) / multi_camera (每路独立源) (默认: multi_res)")
+    parser.add_argument("--streams", type=_parse_int_list, default=[1, 2, 4],
+                        help="流数扫描列表，逗号分隔 (默认: 1,2,4)")
+    parser.add_argument("--resolutions", type=_parse_resolutions, default=[(1920, 1080)],
+                        help="分辨率扫描列表，如 1280x720,1920x1080 (默认: 1920x1080)")
+    parser.add_argument("--bitrates", type=_parse_int_list, default=[4000],
+                        help="比特率扫描列表 kbps，逗号分隔 (默认: 4000)")
+    parser.add_argument("--framerate", type=int, default=30, help="目标帧率 (默认: 30)")
+    parser.add_argument("--codec", choices=["h264", "h265"], default="h265", help="编码格式 (默认: h265)")
+    parser.add_argument("--clients", type=int, default=1, help="每路流的拉流客户端数 (默认: 1)")
+    parser.add_argument("--duration", type=float, default=20, help="每个扫描点的测量秒数 (默认: 20)")
+    parser.add_argument("--warmup", type=float, default=5, help="测量前预热秒数 (默认: 5)")
+    parser.add_argument("--startup-timeout", type=float, default=20,
+                        help="等待服务器端口就绪的秒数 (默认: 20)")
+    parser.add_argument("--base-port", type=int, default=18554,
+                        help="测试使用的起始 RTSP 端口 (默认: 18554，避开生产端口)")
+    parser.add_argument("--backend", choices=["auto", "jetson", "software"], default="auto",
+                        help="编解码后端 (默认: auto)")
+    parser.add_argument("--share-encoders", action="store_true",
+                        help="multi_res 模式下允许相同参数的流共享编码器 (默认每路独立编码)")
+    parser.add_argument("--output", "-o", default="benchmark_report.json",
+                        help="JSON 报告路径 (默认: benchmark_report.json)")
+
+    args = parser.parse_args()
+    Gst.init(None)
+
+    report = Benchmark(args).run()
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print("=" * 60)
+    sat = report['saturation_point']
+    if sat:
+        print(f"饱和点: {sat['streams']} 路 {sat['resolution']} {sat['bitrate_kbps']} kbps "
+              f"(最低 {sat['min_fps']} fps)")
+    else:
+        print("所有扫描点均未饱和")
+    print(f"报告已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
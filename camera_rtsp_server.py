@@ -10,11 +10,29 @@ import argparse
 import subprocess
 import re
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import gi
 
 gi.require_version('Gst', '1.0')
 gi.require_version('GstRtspServer', '1.0')
-from gi.repository import Gst, GstRtspServer, GLib
+gi.require_version('GstRtsp', '1.0')
+gi.require_version('GstVideo', '1.0')
+from gi.repository import Gst, GstRtsp, GstRtspServer, GstVideo, GLib
+
+from config_reload import ConfigWatcher, diff_keyed
+from control_api import ControlAPI, ControlError, control_port
+from gst_backend import BACKEND_CHOICES, select_backend
+from http_service import HTTPService
+from latency_stamp import CaptureStamper
+from media_probe import StreamInfo, probe_uri
+from metrics import QueueWatchdog, ServerMetrics
+from pipeline_graph import GraphMediaFactory, PipelineGraph, caps, element
+from recorder import SegmentRecorder, describe_record, record_settings, watch_recorders
+from rtsp_service import RTSPService, configure_multicast, describe_multicast, multicast_settings
+from snapshot import SnapshotService, SnapshotTap, describe_snapshot, snapshot_settings
+from source_recovery import RecoverableSource, RecoveryPolicy
+from v4l2_probe import list_resolutions, probe_device
 
 
 def list_camera_formats(device: str = "/dev/video0") -> bool:
@@ -135,6 +153,13 @@ def list_all_cameras() -> list:
     for i in range(10):
         device = f"/dev/video{i}"
         if os.path.exists(device):
+            # 优先直接 ioctl 查询 (带缓存)，跳过 UVC 元数据等非采集节点
+            info = probe_device(device)
+            if info is not None:
+                if info.capture:
+                    cameras.append((device, info.card or f"Video device {i}"))
+                continue
+
             name = f"Video device {i}"
 
             # 尝试获取设备名称
@@ -156,19 +181,27 @@ def list_all_cameras() -> list:
     return cameras
 
 
-def get_camera_resolutions(device: str = "/dev/video0") -> list:
+def get_camera_resolutions(device: str = "/dev/video0", input_format: str = None) -> list:
     """
     获取摄像头支持的所有分辨率
 
     Args:
         device: 摄像头设备路径
+        input_format: 只查询该输入格式 (mjpeg/yuyv/nv12)，None 表示所有格式
+                      (仅 ioctl 探测支持按格式过滤)
 
     Returns:
         分辨率列表 [(width, height, max_fps), ...] 按像素数降序排列
     """
+    # 方法1: 直接 ioctl 查询 (按 USB 设备缓存，毫秒级)
+    info = probe_device(device)
+    if info is not None and info.formats:
+        # 摄像头不支持该格式时退回所有格式 (与 v4l2-ctl 方式一致)
+        return list_resolutions(info, input_format) or list_resolutions(info)
+
     resolutions = []
 
-    # 方法1: 使用 v4l2-ctl 查询
+    # 方法2: 使用 v4l2-ctl 查询
     try:
         result = subprocess.run(
             ["v4l2-ctl", "--device", device, "--list-formats-ext"],
@@ -203,7 +236,7 @@ def get_camera_resolutions(device: str = "/dev/video0") -> list:
     except Exception:
         pass
 
-    # 方法2: 使用 GStreamer 查询作为备选
+    # 方法3: 使用 GStreamer 查询作为备选
     if not resolutions:
         try:
             Gst.init(None)
@@ -252,7 +285,7 @@ def get_camera_resolutions(device: str = "/dev/video0") -> list:
 
 
 def find_best_resolution(device: str, target_width: int, target_height: int,
-                         target_fps: int = 30) -> tuple:
+                         target_fps: int = 30, input_format: str = None) -> tuple:
     """
     查找最接近目标分辨率的摄像头分辨率
 
@@ -266,11 +299,12 @@ def find_best_resolution(device: str, target_width: int, target_height: int,
         target_width: 目标宽度
         target_height: 目标高度
         target_fps: 目标帧率
+        input_format: 输入格式 (mjpeg/yuyv/nv12)，None 表示不区分格式
 
     Returns:
         (width, height, fps) 或 None 如果查询失败
     """
-    resolutions = get_camera_resolutions(device)
+    resolutions = get_camera_resolutions(device, input_format)
 
     if not resolutions:
         return None
@@ -338,7 +372,16 @@ class CameraRTSPServer:
                  output_width: int = 1920,
                  output_height: int = 1080,
                  framerate: int = 30,
-                 flip_method: int = 0):
+                 flip_method: int = 0,
+                 backend: str = 'auto',
+                 latency_stamp: bool = False,
+                 metrics: ServerMetrics = None,
+                 queues: QueueWatchdog = None,
+                 recovery=None,
+                 passthrough='auto',
+                 multicast: dict = None,
+                 record: dict = None,
+                 snapshot: dict = None):
         """
         初始化相机 RTSP 服务器
 
@@ -349,7 +392,7 @@ class CameraRTSPServer:
             port: RTSP 服务端口
             mount_point: RTSP 挂载点
             codec: 输出编码格式 (h264 或 h265)
-            input_format: USB 摄像头输入格式 (mjpeg, yuyv, nv12)
+            input_format: USB 摄像头输入格式 (mjpeg, yuyv, nv12, h264)
             input_codec: RTSP 源输入编码格式 (h264 或 h265)
             bitrate: 编码比特率 (bps)
             input_width: 输入分辨率宽度 (None 表示自动检测)
@@ -358,6 +401,19 @@ class CameraRTSPServer:
             output_height: 输出分辨率高度
             framerate: 帧率
             flip_method: 图像翻转方式 (0-7, 仅 CSI 相机)
+            backend: 编解码后端 (auto/jetson/software)
+            latency_stamp: 在码流中嵌入采集时间戳 SEI (用于 latency.py 测量端到端延迟)
+            metrics: 运行指标 (None 表示不统计)，单路模式下由 start(metrics_port) 创建
+            queues: queue 丢帧监控 (多路模式下共用一个，None 表示新建)
+            recovery: 源故障恢复配置 (recovery 配置块，见 source_recovery.py)，
+                None 使用默认策略，False 关闭 (源出错时整个 media 结束，客户端需重连)
+            passthrough: 码流透传 (rtsp 源和 h264 USB 相机): auto 在输入编码、分辨率、码率都
+                满足输出要求时直接 parse ! pay，on 只要编码一致就透传，off 总是解码再编码
+            multicast: 组播配置 (见 rtsp_service.multicast_settings)，None 表示只用单播
+            record: 分段录像配置 (见 recorder.record_settings)，None 表示不录像；
+                录像时 media 在启动后即创建并常驻，没有客户端也持续写盘
+            snapshot: JPEG 快照配置 (见 snapshot.snapshot_settings)，None 表示不取快照；
+                从缩放后的帧取帧 (透传时没有解码帧，不支持)，media 同样常驻
         """
         self.source_type = source_type
         self.device = device
@@ -373,15 +429,43 @@ class CameraRTSPServer:
         self.output_width = output_width
         self.output_height = output_height
         self.framerate = framerate
+        self.output_framerate = None  # 运行时修改的输出帧率 (控制接口)，None 表示与采集帧率相同
         self.flip_method = flip_method
+        self.stamper = CaptureStamper() if latency_stamp else None
+        self.metrics = metrics
+        self.queues = queues or QueueWatchdog()
+        self.passthrough = {True: 'on', False: 'off'}.get(passthrough, passthrough)
+        self._passthrough = None  # 判定结果 (首次构建时确定)
+        self.multicast = multicast
+        self.recorder = None
+        if record:
+            label = mount_point.strip('/').replace('/', '_') or 'stream'
+            self.recorder = SegmentRecorder(label, self.codec, record)
+        self.snapshot_config = snapshot
+        self.snapshot = None  # SnapshotTap，backend 选定后创建
+        self.factory = None
+        self._graph = None  # 最近创建的 media 的 pipeline 图 (运行时修改参数)
+        self._held_media = None  # 为录像/快照常驻的 media
+        self._record_input = None  # 录像支路输入 (record_queue 的 sink pad)
+        # 测试源不会断流，不需要独立的 source pipeline
+        if recovery is False or source_type == CameraSource.TEST:
+            self.recovery = None
+        else:
+            self.recovery = RecoveryPolicy.from_config(recovery)
 
         Gst.init(None)
+        self.backend = select_backend(backend)
+        if snapshot:
+            self.snapshot = SnapshotTap(self.backend, snapshot)
 
     def _auto_detect_resolution(self):
-        """自动检测 USB 摄像头的最佳输入分辨率"""
+        """自动检测 USB 摄像头的最佳输入分辨率 (只检测一次)"""
         if self.source_type != CameraSource.USB:
             return
 
+        if hasattr(self, '_auto_detected'):
+            return  # 已检测过
+
         if self.input_width and self.input_height:
             # 用户已指定输入分辨率
             self._auto_detected = False
@@ -392,7 +476,8 @@ class CameraRTSPServer:
             self.device,
             self.output_width,
             self.output_height,
-            self.framerate
+            self.framerate,
+            self.input_format
         )
 
         if best:
@@ -404,171 +489,477 @@ class CameraRTSPServer:
         else:
             self._auto_detected = False
 
-    def _build_source_pipeline(self) -> str:
-        """构建视频源 pipeline"""
+    def _build_source_elements(self) -> list:
+        """构建视频源元素"""
+        backend = self.backend
+
         if self.source_type == CameraSource.USB:
             # USB 相机 (V4L2)
             # 自动检测分辨率（如果未指定）
             self._auto_detect_resolution()
 
-            source = f'v4l2src device="{self.device}"'
+            source = [element('v4l2src', device=self.device)]
+            size = ''
+            if self.input_width and self.input_height:
+                size = f'width={self.input_width},height={self.input_height},'
 
             # 根据输入格式构建不同的 pipeline
             if self.input_format == 'mjpeg':
                 # MJPEG 格式 - 使用 nvv4l2decoder 硬件解码 (Jetson)
                 # 这是推荐的 Jetson MJPEG 解码方案，输出直接到 NVMM 内存
-                if self.input_width and self.input_height:
-                    source += (
-                        f' ! image/jpeg,width={self.input_width},'
-                        f'height={self.input_height},framerate={self.framerate}/1'
-                    )
-                else:
-                    source += f' ! image/jpeg,framerate={self.framerate}/1'
-                # 使用 nvv4l2decoder 解码 MJPEG，添加 queue 防止缓冲区问题
-                source += ' ! nvv4l2decoder mjpeg=1 ! queue max-size-buffers=3 leaky=downstream'
+                source.append(caps(f'image/jpeg,{size}framerate={self.framerate}/1'))
+                # 使用 nvv4l2decoder (软件后端: jpegdec) 解码 MJPEG，添加 queue 防止缓冲区问题
+                source += backend.jpeg_decoder()
+                source.append(element('queue', name='queue_decode', max_size_buffers=3, leaky='downstream'))
+
+            elif self.input_format == 'h264':
+                # H.264 编码输出的 UVC 相机: parse 后硬件解码
+                source.append(caps(f'video/x-h264,{size}framerate={self.framerate}/1'))
+                source += [element('h264parse')] + backend.decoder('h264')
 
             elif self.input_format == 'nv12':
                 # NV12 格式
-                if self.input_width and self.input_height:
-                    source += (
-                        f' ! video/x-raw,format=NV12,width={self.input_width},'
-                        f'height={self.input_height},framerate={self.framerate}/1'
-                    )
-                else:
-                    source += f' ! video/x-raw,format=NV12,framerate={self.framerate}/1'
+                source.append(caps(f'video/x-raw,format=NV12,{size}framerate={self.framerate}/1'))
 
             else:
                 # YUYV 格式 (默认)
-                if self.input_width and self.input_height:
-                    source += (
-                        f' ! video/x-raw,format=YUY2,width={self.input_width},'
-                        f'height={self.input_height},framerate={self.framerate}/1'
-                    )
-                else:
-                    source += f' ! video/x-raw,format=YUY2,framerate={self.framerate}/1'
-                source += ' ! videoconvert'
+                source.append(caps(f'video/x-raw,format=YUY2,{size}framerate={self.framerate}/1'))
+                source.append(element('videoconvert'))
 
             return source
 
         elif self.source_type == CameraSource.CSI:
             # CSI 相机 (Jetson 原生)
+            if not backend.hardware:
+                raise ValueError("CSI 相机需要 Jetson 硬件后端")
             width = self.input_width or 1920
             height = self.input_height or 1080
-            source = (
-                f'nvarguscamerasrc ! '
-                f'video/x-raw(memory:NVMM),width={width},height={height},'
-                f'format=NV12,framerate={self.framerate}/1 ! '
-                f'nvvidconv flip-method={self.flip_method}'
-            )
-            return source
+            return [
+                element('nvarguscamerasrc'),
+                backend.raw_caps(width=width, height=height, format='NV12', framerate=self.framerate),
+                element('nvvidconv', flip_method=self.flip_method),
+            ]
 
         elif self.source_type == CameraSource.RTSP:
             # RTSP 源
             if not self.rtsp_url:
                 raise ValueError("RTSP 源需要提供 rtsp_url 参数")
 
+            source = [element('rtspsrc', location=self.rtsp_url, latency=100)]
             if self.input_codec == "h265":
                 # H.265/HEVC 输入
-                source = (
-                    f'rtspsrc location="{self.rtsp_url}" latency=100 ! '
-                    f'rtph265depay ! h265parse ! nvv4l2decoder'
-                )
+                source += [element('rtph265depay'), element('h265parse')]
             else:
                 # H.264/AVC 输入 (默认)
-                source = (
-                    f'rtspsrc location="{self.rtsp_url}" latency=100 ! '
-                    f'rtph264depay ! h264parse ! nvv4l2decoder'
-                )
-            return source
+                source += [element('rtph264depay'), element('h264parse')]
+            return source + backend.decoder(self.input_codec)
 
         elif self.source_type == CameraSource.TEST:
             # 测试源
             width = self.input_width or 640
             height = self.input_height or 480
-            source = (
-                f'videotestsrc is-live=true pattern=ball ! '
-                f'video/x-raw,width={width},height={height},'
-                f'framerate={self.framerate}/1'
-            )
-            return source
+            return [
+                element('videotestsrc', is_live=True, pattern='ball'),
+                caps(f'video/x-raw,width={width},height={height},framerate={self.framerate}/1'),
+            ]
 
         else:
             raise ValueError(f"不支持的相机源类型: {self.source_type}")
 
-    def _build_scale_pipeline(self) -> str:
-        """构建缩放 pipeline (使用 Jetson 硬件加速)"""
-        # 判断是否需要缩放
-        needs_scale = True
-
-        if self.source_type == CameraSource.CSI:
-            # CSI 相机已经在 NVMM 内存中
-            scale = (
-                f'nvvidconv ! '
-                f'video/x-raw(memory:NVMM),width={self.output_width},'
-                f'height={self.output_height},format=NV12'
-            )
-        elif self.source_type == CameraSource.RTSP:
-            # RTSP 解码后已在 NVMM 内存中
-            scale = (
-                f'nvvidconv ! '
-                f'video/x-raw(memory:NVMM),width={self.output_width},'
-                f'height={self.output_height},format=NV12'
-            )
-        else:
-            # USB 相机和测试源需要先上传到 NVMM
-            scale = (
-                f'nvvidconv ! '
-                f'video/x-raw(memory:NVMM),width={self.output_width},'
-                f'height={self.output_height},format=NV12'
-            )
+    def _input_stream(self) -> StreamInfo:
+        """
+        编码输入 (rtsp 源、h264 USB 相机) 的码流信息，原始帧输入返回 None
+
+        rtsp 源先用 Discoverer 探测上游，探测不到时使用配置的 input_codec / input_width / input_height
+        """
+        if self.source_type == CameraSource.USB and self.input_format == 'h264':
+            self._auto_detect_resolution()
+            return StreamInfo('h264', self.input_width, self.input_height, self.framerate, None)
+        if self.source_type == CameraSource.RTSP and self.rtsp_url:
+            info = probe_uri(self.rtsp_url)
+            if info is not None:
+                return info
+            return StreamInfo(self.input_codec, self.input_width, self.input_height, None, None)
+        return None
+
+    def _use_passthrough(self) -> bool:
+        """
+        是否透传上游码流 (只判定一次，可能阻塞在探测上游，在初始化线程中首次调用)
 
-        return scale
+        auto: 编码一致、分辨率等于输出分辨率、上游码率不超过配置码率 (未知时不限制)
+        """
+        if self._passthrough is not None:
+            return self._passthrough
+        self._passthrough = False
+        if self.passthrough == 'off':
+            return False
 
-    def _build_encoder_pipeline(self) -> str:
-        """构建编码器 pipeline (使用 Jetson 硬件加速)"""
+        info = self._input_stream()
+        if info is None:
+            return False
+
+        label = f":{self.port}{self.mount_point}"
+        if info.codec != self.codec:
+            reason = f"输入 {info.codec} 与输出 {self.codec} 编码不同"
+        elif self.passthrough == 'on':
+            reason = None
+        elif (info.width, info.height) != (self.output_width, self.output_height):
+            reason = f"输入 {info.width or '?'}x{info.height or '?'} 需要缩放到 {self.output_width}x{self.output_height}"
+        elif info.bitrate and info.bitrate > self.bitrate:
+            reason = f"输入码率 {info.bitrate // 1000} kbps 高于 {self.bitrate // 1000} kbps"
+        else:
+            reason = None
+
+        if reason is None:
+            self._passthrough = True
+            print(f"[透传] {label}: 输入已是 {self.codec.upper()} "
+                  f"{info.width or '?'}x{info.height or '?'}，不解码不重新编码")
+        elif self.passthrough == 'on':
+            print(f"[透传] {label}: {reason}，无法透传，改为转码")
+        return self._passthrough
+
+    def _build_passthrough_elements(self) -> list:
+        """透传: 源 ! (depay) ! parse ! pay，保留上游编码"""
+        if self.source_type == CameraSource.RTSP:
+            source = [element('rtspsrc', location=self.rtsp_url, latency=100),
+                      element(f'rtp{self.codec}depay')]
+        else:
+            self._auto_detect_resolution()
+            size = ''
+            if self.input_width and self.input_height:
+                size = f'width={self.input_width},height={self.input_height},'
+            source = [element('v4l2src', device=self.device),
+                      caps(f'video/x-h264,{size}framerate={self.framerate}/1')]
+        # config-interval=-1: 每个 IDR 前带上 SPS/PPS，客户端中途加入也能立即解码
+        return source + [element(f'{self.codec}parse', name='parse', config_interval=-1),
+                         element(f'rtp{self.codec}pay', name='pay0', pt=96, config_interval=1)]
+
+    @property
+    def _split_source(self) -> bool:
+        """是否使用独立的 source pipeline (源恢复开启且不透传)"""
+        return self.recovery is not None and not self._use_passthrough()
+
+    def _build_scale_elements(self) -> list:
+        """构建缩放元素 (Jetson 后端使用 nvvidconv 硬件加速)"""
+        # CSI/RTSP 解码后已在 NVMM 内存中，USB 相机和测试源由 nvvidconv 上传到 NVMM
+        return self.backend.scaler(self.output_width, self.output_height)
+
+    def _build_encoder_elements(self) -> list:
+        """构建编码器及 RTP 打包元素 (Jetson 后端使用硬件编码器)"""
+        # videorate 只丢帧，max-rate 可在运行时降低输出帧率 (见控制接口)
+        encoder = [element('videorate', name='rate', drop_only=True,
+                           max_rate=self.output_framerate or self.framerate)]
+        encoder += self.backend.encoder(self.codec, self.bitrate, iframeinterval=30, name='encoder')
         if self.codec == "h265":
-            encoder = (
-                f'nvv4l2h265enc bitrate={self.bitrate} '
-                f'preset-level=1 iframeinterval=30 ! '
-                f'h265parse ! '
-                f'rtph265pay name=pay0 pt=96 config-interval=1'
-            )
+            encoder += [element('h265parse', name='parse'),
+                        element('rtph265pay', name='pay0', pt=96, config_interval=1)]
         else:  # h264
-            encoder = (
-                f'nvv4l2h264enc bitrate={self.bitrate} '
-                f'preset-level=1 iframeinterval=30 ! '
-                f'h264parse ! '
-                f'rtph264pay name=pay0 pt=96 config-interval=1'
-            )
+            encoder += [element('h264parse', name='parse'),
+                        element('rtph264pay', name='pay0', pt=96, config_interval=1)]
 
         return encoder
 
+    def _build_source_graph(self) -> PipelineGraph:
+        """源 + 解码 + 缩放 (启用源恢复时作为独立的 source pipeline)"""
+        graph = PipelineGraph()
+        graph.chain(self._build_source_elements() + self._build_scale_elements())
+        return graph
+
+    def _build_handoff_elements(self) -> list:
+        """media 中接收 source pipeline 输出帧的 appsrc (caps 与缩放输出一致)"""
+        backend = self.backend
+        return [
+            element('appsrc', name='source_in', is_live=True, format='time',
+                    caps=f'{backend.raw_caps_prefix},format={backend.raw_format},'
+                         f'width={self.output_width},height={self.output_height},'
+                         f'framerate={self.framerate}/1'),
+            element('queue', name='queue_source', max_size_buffers=3, leaky='downstream'),
+        ]
+
+    def _build_placeholder_elements(self) -> list:
+        """只产生一帧黑帧、格式与缩放输出一致的元素 (源中断且还没有收到过帧时占位)"""
+        return ([element('videotestsrc', pattern='black', num_buffers=1),
+                 caps(f'video/x-raw,format=I420,width={self.output_width},height={self.output_height}')] +
+                self.backend.upload())
+
+    def _build_graph(self) -> PipelineGraph:
+        """
+        构建 media 的 pipeline 图 (透传时不含编解码，启用源恢复时从 appsrc 开始)
+
+        录像时在 parse 和 pay0 之间插入 tee，分出录像支路 (直接写编码后的码流):
+            ... parse ! record_tee ─┬─ queue_pay ! pay0
+                                    └─ record_queue ! parse ! splitmuxsink
+        快照时在编码器之前插入 tee，分出低频取帧的 JPEG 支路:
+            ... 缩放 ! snapshot_tee ─┬─ encoder ! ...
+                                     └─ snapshot_queue ! 缩放 ! jpegenc ! appsink
+        """
+        graph = PipelineGraph()
+        snapshot = self.snapshot is not None and not self._use_passthrough()
+        if self._use_passthrough():
+            elements = self._build_passthrough_elements()
+        else:
+            if self._split_source:
+                elements = self._build_handoff_elements()
+            else:
+                elements = self._build_source_elements() + self._build_scale_elements()
+            if snapshot:
+                elements.append(element('tee', name='snapshot_tee'))
+            elements += self._build_encoder_elements()
+        if self.recorder:
+            elements[-1:-1] = [element('tee', name='record_tee'),
+                               element('queue', name='queue_pay', max_size_buffers=30, leaky='downstream')]
+        graph.chain(elements)
+        if self.recorder:
+            first, _ = graph.chain(self.recorder.elements())
+            graph.link(graph.node('record_tee'), first)
+        if snapshot:
+            first, _ = graph.chain(self.snapshot.elements(self.output_width, self.output_height))
+            graph.link(graph.node('snapshot_tee'), first)
+        return graph
+
     def _build_pipeline(self) -> str:
-        """构建完整的 GStreamer pipeline"""
-        source = self._build_source_pipeline()
-        scale = self._build_scale_pipeline()
-        encoder = self._build_encoder_pipeline()
+        """完整 pipeline 的 launch 描述 (仅用于日志)"""
+        if not self._split_source:
+            return f"( {self._build_graph().to_launch()} )"
+        return (f"{self._build_source_graph().to_launch()} ! appsink  ->  "
+                f"( {self._build_graph().to_launch()} )")
+
+    def create_media_factory(self) -> GstRtspServer.RTSPMediaFactory:
+        """创建由 pipeline 图构建 media 的共享 MediaFactory"""
+        factory = GraphMediaFactory(self._build_graph, self._on_media_built)
+        factory.set_shared(True)
+        self.factory = factory
+        if self.multicast:
+            configure_multicast(factory, self.multicast)
+        if self._split_source:
+            factory.connect('media-configure', self._on_media_configure)
+        if self.metrics:
+            factory.connect('media-configure',
+                            lambda f, media: self.metrics.watch_media(self.metrics_label, media))
+        return factory
+
+    def _on_media_configure(self, factory, media):
+        """为新 media 启动可恢复的 source pipeline，media 释放时停止"""
+        appsrc = media.get_element().get_by_name('source_in')
+        source = RecoverableSource(self.metrics_label, self._build_source_graph, appsrc,
+                                   self.framerate, self.recovery,
+                                   placeholder_builder=self._build_placeholder_elements,
+                                   on_built=self._on_source_built, stamper=self.stamper)
+        # media-configure 可能在 RTSP 监听线程中发出，状态切换统一在主循环中进行
+        media.connect('unprepared', lambda m: GLib.idle_add(source.stop))
+        GLib.idle_add(source.start)
+
+    @property
+    def metrics_label(self) -> str:
+        """指标中的挂载点标签 (:端口/挂载点)"""
+        return f':{self.port}{self.mount_point}'
+
+    def _on_media_built(self, graph: PipelineGraph):
+        """media 元素创建后挂上采集时间戳、queue 丢帧和运行指标探针"""
+        self._graph = graph
+        parse_pad = graph['parse'].get_static_pad('src')
+
+        if self.stamper:
+            # 采集点记录墙上时间，parse 输出写入时间戳 SEI
+            if not self._split_source:
+                self._watch_capture(graph)
+            self.stamper.stamp_output(parse_pad, self.codec)
+
+        self._watch_queues(graph)
+
+        if self.metrics:
+            self.metrics.watch_flow(self.metrics_label, parse_pad)
+
+        if self.recorder:
+            self.recorder.attach(graph)
+            self._record_input = graph['record_queue'].get_static_pad('sink')
+        if 'snapshot_queue' in graph:
+            self.snapshot.attach(graph)
+
+    def set_bitrate(self, bitrate: int):
+        """
+        修改编码码率，运行中的 media 立即生效，之后新建的 media 也使用新码率
 
-        pipeline = f"( {source} ! {scale} ! {encoder} )"
-        return pipeline
+        Args:
+            bitrate: 比特率 (bps)
 
-    def start(self):
-        """启动 RTSP 服务器"""
+        Raises:
+            ControlError: 透传时没有编码器
+        """
+        if self._use_passthrough():
+            raise ControlError("透传的流没有编码器，无法修改码率")
+        self.bitrate = bitrate
+        if self._graph is not None:
+            self.backend.set_bitrate(self._graph['encoder'], bitrate)
+
+    def set_output_framerate(self, fps: int):
+        """
+        修改输出帧率 (videorate 丢帧，不超过采集帧率)
+
+        Raises:
+            ControlError: 透传，或高于采集帧率
+        """
+        if self._use_passthrough():
+            raise ControlError("透传的流不经过编码器，无法修改帧率")
+        if fps > self.framerate:
+            raise ControlError(f"帧率不能高于采集帧率 {self.framerate}", 400)
+        self.output_framerate = fps
+        if self._graph is not None:
+            self._graph['rate'].set_property('max-rate', fps)
+
+    def force_keyframe(self) -> bool:
+        """
+        向运行中的编码器发送 upstream force-key-unit
+
+        Returns:
+            是否发出了请求 (没有运行中的 media 时为 False)
+
+        Raises:
+            ControlError: 透传时没有编码器
+        """
+        if self._use_passthrough():
+            raise ControlError("透传的流没有编码器，关键帧由上游决定")
+        if self._graph is None:
+            return False
+        event = GstVideo.video_event_new_upstream_force_key_unit(Gst.CLOCK_TIME_NONE, True, 0)
+        return self._graph['encoder'].get_static_pad('src').send_event(event)
+
+    def live_params(self) -> dict:
+        """当前的编码参数 (控制接口)"""
+        passthrough = self._use_passthrough()
+        return {
+            'passthrough': passthrough,
+            'input_size': [self.input_width, self.input_height] if self.input_width else None,
+            'bitrate_kbps': None if passthrough else self.bitrate // 1000,
+            'framerate': self.output_framerate or self.framerate,
+            'capture_framerate': self.framerate,
+            'media_built': self._graph is not None,
+            'held': self._held_media is not None,
+        }
+
+    def hold_media(self, server: GstRtspServer.RTSPServer):
+        """
+        录像/快照: 在 factory 挂载后创建共享 media 并保持 PLAYING (没有客户端也持续运行)
+
+        客户端连接时使用同一个 media；media 由这里多持有一次 prepare，
+        最后一个客户端断开时不会暂停或释放
+        """
+        if not (self.recorder or self.snapshot) or self.factory is None or self._held_media is not None:
+            return
+        _, url = GstRtsp.RTSPUrl.parse(f'rtsp://127.0.0.1:{self.port}{self.mount_point}')
+        media = self.factory.construct(url)
+        if media is None:
+            print(f"错误: {self.metrics_label} 无法创建常驻 media")
+            return
+        # prepared 在 media 线程中发出，状态切换回到主循环
+        media.connect('prepared', lambda m: GLib.idle_add(self._play_held_media, m))
+        thread = server.get_thread_pool().get_thread(GstRtspServer.RTSPThreadType.MEDIA, None)
+        if not media.prepare(thread):
+            print(f"错误: {self.metrics_label} 常驻 media 启动失败")
+            return
+        self._held_media = media
+        if self.recorder:
+            print(f"[录像] {self.recorder.name}: -> {self.recorder.directory}")
+
+    def _play_held_media(self, media):
+        if media is self._held_media:
+            media.set_state(Gst.State.PLAYING, [])
+        return False
+
+    def release_media(self, on_done=None):
+        """
+        释放常驻的 media: 录像时先断开录像支路并发送 EOS，最后一段封装完成后再释放，然后调用 on_done()
+
+        on_done 在定时器线程中调用 (见 SegmentRecorder.finish)，主循环停止后也可以等待
+        """
+        media, self._held_media = self._held_media, None
+        sink_pad, self._record_input = self._record_input, None
+        if media is None:
+            if on_done:
+                on_done()
+            return
+
+        def finished():
+            media.unprepare()
+            if on_done:
+                on_done()
+
+        tee_pad = sink_pad.get_peer() if sink_pad is not None else None
+        if tee_pad is None:
+            finished()
+            return
+
+        def on_pad_idle(pad, info):
+            pad.unlink(sink_pad)
+            pad.get_parent_element().release_request_pad(pad)
+            self.recorder.finish(finished)
+            sink_pad.send_event(Gst.Event.new_eos())
+            return Gst.PadProbeReturn.REMOVE
+
+        tee_pad.add_probe(Gst.PadProbeType.IDLE, on_pad_idle)
+
+    def _on_source_built(self, graph: PipelineGraph):
+        """source pipeline (每次重建) 创建后挂上采集时间戳和 queue 丢帧探针"""
+        if self.stamper:
+            self._watch_capture(graph)
+        self._watch_queues(graph)
+
+    def _watch_capture(self, graph: PipelineGraph):
+        capture_pad = graph[graph.nodes[0].name].get_static_pad('src')
+        if capture_pad is None:
+            # rtspsrc 的 pad 是动态的，以 depay 输出作为采集点
+            capture_pad = graph[graph.nodes[1].name].get_static_pad('src')
+        self.stamper.watch_capture(capture_pad)
+
+    def _watch_queues(self, graph: PipelineGraph):
+        for queue in graph.elements_of('queue'):
+            self.queues.watch(queue, f'{self.metrics_label}/{queue.get_name()}')
+
+    def unwatch_queues(self):
+        """流被撤下后停止监控其 queue"""
+        prefix = f'{self.metrics_label}/'
+        for name in [n for n in self.queues.meters if n.startswith(prefix)]:
+            self.queues.unwatch(name)
+
+    def start(self, metrics_port: int = None):
+        """
+        启动 RTSP 服务器
+
+        Args:
+            metrics_port: /metrics HTTP 端口 (None 表示不启用)
+        """
         server = GstRtspServer.RTSPServer()
         server.set_service(str(self.port))
 
-        factory = GstRtspServer.RTSPMediaFactory()
+        if metrics_port and self.metrics is None:
+            self.metrics = ServerMetrics(self.queues)
+        if self.metrics:
+            self.metrics.watch_server(server, self.port)
 
         pipeline = self._build_pipeline()
         print(f"Pipeline: {pipeline}")
 
-        factory.set_launch(pipeline)
-        factory.set_shared(True)
+        factory = self.create_media_factory()
 
         mounts = server.get_mount_points()
         mounts.add_factory(self.mount_point, factory)
 
         server.attach(None)
+        self.hold_media(server)
+        if self.metrics and self.recorder:
+            watch_recorders(self.metrics, lambda: [self.recorder])
+
+        # /metrics 和 /snapshot 共用一个 HTTP 端口
+        http_port = metrics_port or (self.snapshot and self.snapshot.settings['port'])
+        if http_port:
+            http = HTTPService(http_port)
+            if metrics_port:
+                http.route('GET', '/metrics', self.metrics.handle)
+            if self.snapshot:
+                snapshots = SnapshotService()
+                snapshots.taps[self.mount_point.strip('/') or 'stream'] = self.snapshot
+                snapshots.register(http)
+            http.start()
 
         # 获取所有网卡 IP
         ips = self._get_all_ips()
@@ -577,6 +968,7 @@ class CameraRTSPServer:
         print(f"Camera RTSP 服务器已启动")
         print("-" * 60)
         print(f"相机源类型: {self.source_type.upper()}")
+        print(f"后端: {self.backend.name}")
         if self.source_type == CameraSource.USB:
             print(f"设备: {self.device}")
             if self.input_width and self.input_height:
@@ -593,6 +985,24 @@ class CameraRTSPServer:
         print(f"输出编码: {self.codec.upper()}")
         print(f"比特率: {self.bitrate // 1000} kbps")
         print(f"帧率: {self.framerate} fps")
+        if self.stamper:
+            print("采集时间戳: 已启用 (SEI)")
+        if self._use_passthrough():
+            print("码流透传: 是 (不解码不重新编码)")
+        elif self.recovery is not None:
+            print(f"源恢复: {self.recovery.describe()}")
+        if self.multicast:
+            print(f"组播: {describe_multicast(self.multicast)}")
+        if self.recorder:
+            print(f"录像: {describe_record(self.recorder.settings)}")
+        if self.snapshot and not self._use_passthrough():
+            print(f"快照: {describe_snapshot(self.snapshot.settings)}")
+            if http_port:
+                print(f"  http://<ip>:{http_port}/snapshot/{self.mount_point.strip('/') or 'stream'}")
+        elif self.snapshot:
+            print("快照: 透传时没有解码帧，不可用")
+        if metrics_port:
+            print(f"运行指标: http://<ip>:{metrics_port}/metrics")
         print("=" * 60)
         print("RTSP 地址:")
         for iface, ip in ips:
@@ -605,6 +1015,8 @@ class CameraRTSPServer:
             loop.run()
         except KeyboardInterrupt:
             print("\n服务器已停止")
+        finally:
+            release_held_media([self])
 
     def _get_all_ips(self) -> list:
         """获取所有网卡的 IP 地址"""
@@ -637,19 +1049,66 @@ class CameraRTSPServer:
         return ips
 
 
+def release_held_media(cam_servers):
+    """退出前: 释放各路常驻的 media，等待录像的最后一段封装完成 (主循环已停止)"""
+    waits = []
+    for cam_server in cam_servers:
+        if cam_server._held_media is not None:
+            done = threading.Event()
+            cam_server.release_media(done.set)
+            waits.append(done)
+    for done in waits:
+        done.wait(SegmentRecorder.FINISH_TIMEOUT + 1)
+
+
 class MultiCameraRTSPServer:
     """多路相机 RTSP 服务器"""
 
-    def __init__(self, port: int = 8554):
+    # 初始化失败后的重试间隔上限 (秒)
+    MAX_RETRY_INTERVAL = 120
+
+    def __init__(self, port: int = 8554, backend: str = 'auto', metrics_port: int = None,
+                 init_timeout: int = 15, retry_interval: int = 10, init_workers: int = 8,
+                 single_port: int = None, client_threads: int = None, thread_per_port: bool = True):
         """
         初始化多路相机 RTSP 服务器
 
         Args:
             port: RTSP 服务端口
+            backend: 编解码后端 (auto/jetson/software)
+            metrics_port: /metrics HTTP 端口 (None 表示不启用)
+            init_timeout: 单个设备探测/初始化的超时 (秒)，超时后不阻塞其他挂载点
+            retry_interval: 初始化失败后首次重试的间隔 (秒)，之后逐次加倍
+            init_workers: 并行初始化的线程数
+            single_port: 所有挂载点合并到这一个监听端口 (None 表示每个端口单独监听)
+            client_threads: 每个监听端口处理客户端请求的线程数 (RTSPThreadPool)
+            thread_per_port: 每个监听端口使用独立的 GMainContext 和线程
         """
         self.port = port
+        self.metrics_port = metrics_port
+        self.init_timeout = init_timeout
+        self.retry_interval = retry_interval
+        self.init_workers = init_workers
+        self._executor = None
+        self._pending = {}  # stream index -> (attempt, 超时定时器 id)
+        self._next_index = 0
+        self.config_path = None  # 由 from_config_file 设置，用于热加载
+        self.watch_config = True  # False 表示只响应 SIGHUP，不监视文件修改
+        self.recovery = None  # 全局 recovery 配置块，单路的 recovery 覆盖其中的字段
+        self.multicast = None  # 全局组播配置，单路的 multicast 覆盖其中的字段
+        self.record = None  # 全局录像配置，单路的 record 覆盖其中的字段
+        self.snapshot = None  # 全局快照配置，单路的 snapshot 覆盖其中的字段
+        self.snapshots = SnapshotService()  # /snapshot/<流名称>
+        self.control_api = None  # 控制接口配置 (true 或 {"port": N})，None 表示不启用
+        self.queues = QueueWatchdog()  # 所有相机共用的 queue 丢帧监控
+        self.metrics = ServerMetrics(self.queues) if metrics_port else None
+        self.rtsp = RTSPService(single_port, client_threads, thread_per_port, self.metrics)
         self.streams = []  # 存储所有流配置
+        if self.metrics:
+            watch_recorders(self.metrics, lambda: [s['_cam_server'].recorder for s in self.streams
+                                                   if s.get('_cam_server') and s['_cam_server'].recorder])
         Gst.init(None)
+        self.backend = select_backend(backend)
 
     def add_stream(self, config: dict):
         """
@@ -670,17 +1129,26 @@ class MultiCameraRTSPServer:
                 - output_width/output_height: 输出分辨率（可选，默认 1920x1080）
                 - framerate: 帧率（可选，默认 30）
                 - flip: 翻转方式（可选，默认 0）
+                - latency_stamp: 嵌入采集时间戳 SEI（可选，默认 false）
+                - recovery: 源故障恢复配置块（可选，覆盖全局 recovery，false 关闭）
+                - passthrough: 码流透传 auto/on/off（可选，默认 auto）
+                - multicast: 组播配置（可选，覆盖全局 multicast，true 使用默认值，false 关闭）
+                - record: 分段录像配置（可选，覆盖全局 record，true 使用默认值，false 关闭）
+                - snapshot: JPEG 快照配置（可选，覆盖全局 snapshot，true 使用默认值，false 关闭）
         """
-        # 设置默认值
-        stream_config = {
-            'name': config.get('name', f'Stream {len(self.streams) + 1}'),
+        self.streams.append(self._normalize_stream(config, len(self.streams)))
+
+    def _normalize_stream(self, config: dict, position: int) -> dict:
+        """补全流配置的默认值 (position 为流在配置中的序号，用于默认名称和挂载点)"""
+        return {
+            'name': config.get('name', f'Stream {position + 1}'),
             'enable': config.get('enable', True),  # 是否启用，默认启用
-            'mount': config.get('mount', f'/stream{len(self.streams) + 1}'),
+            'mount': config.get('mount', f'/stream{position + 1}'),
             'port': config.get('port', self.port),  # 支持单独配置端口
             'source': config.get('source', 'test'),
             'device': config.get('device', '/dev/video0'),
             'url': config.get('url'),
-            'input_format': config.get('input_format', 'mjpeg'),  # USB 摄像头输入格式: mjpeg, yuyv, nv12
+            'input_format': config.get('input_format', 'mjpeg'),  # USB 摄像头输入格式: mjpeg, yuyv, nv12, h264
             'input_codec': config.get('input_codec', 'h264'),
             'codec': config.get('codec', 'h265'),
             'bitrate': config.get('bitrate', 4000),
@@ -690,17 +1158,30 @@ class MultiCameraRTSPServer:
             'output_height': config.get('output_height', 1080),
             'framerate': config.get('framerate', 30),
             'flip': config.get('flip', 0),
+            'latency_stamp': config.get('latency_stamp', False),
+            'recovery': self._merge_recovery(config.get('recovery')),
+            'passthrough': config.get('passthrough', 'auto'),
+            'multicast': multicast_settings(self.multicast, config.get('multicast')),
+            'record': record_settings(self.record, config.get('record')),
+            'snapshot': snapshot_settings(self.snapshot, config.get('snapshot')),
         }
-        self.streams.append(stream_config)
+
+    def _merge_recovery(self, recovery):
+        """单路 recovery 配置与全局合并 (任一为 false 表示关闭)"""
+        if recovery is False or self.recovery is False:
+            return False
+        return dict(self.recovery or {}, **(recovery or {}))
 
     def _create_camera_server(self, config: dict) -> CameraRTSPServer:
         """根据配置创建 CameraRTSPServer 实例"""
+        # 合并监听端口时使用实际的端口和路径 (运行指标的挂载点标签与客户端统计一致)
+        port, mount = self.rtsp.endpoint(config['port'], config['mount'])
         return CameraRTSPServer(
             source_type=config['source'],
             device=config['device'],
             rtsp_url=config['url'],
-            port=self.port,
-            mount_point=config['mount'],
+            port=port,
+            mount_point=mount,
             codec=config['codec'],
             input_format=config.get('input_format', 'mjpeg'),
             input_codec=config['input_codec'],
@@ -710,7 +1191,16 @@ class MultiCameraRTSPServer:
             output_width=config['output_width'],
             output_height=config['output_height'],
             framerate=config['framerate'],
-            flip_method=config['flip']
+            flip_method=config['flip'],
+            backend=self.backend.name,
+            latency_stamp=config['latency_stamp'],
+            metrics=self.metrics,
+            queues=self.queues,
+            recovery=config['recovery'],
+            passthrough=config['passthrough'],
+            multicast=config['multicast'],
+            record=config['record'],
+            snapshot=config['snapshot']
         )
 
     def start(self):
@@ -736,57 +1226,47 @@ class MultiCameraRTSPServer:
             streams_by_port[port].append(config)
 
         print("=" * 60)
-        print(f"多路 Camera RTSP 服务器")
+        print(f"多路 Camera RTSP 服务器 (后端: {self.backend.name})")
         if disabled_count > 0:
             print(f"正在初始化 {len(enabled_streams)} 路视频流 ({disabled_count} 路已禁用)...")
         else:
             print(f"正在初始化 {len(enabled_streams)} 路视频流...")
         print("=" * 60)
 
-        # 为每个端口创建一个 RTSP 服务器
-        servers = {}
-        for port, port_streams in streams_by_port.items():
-            server = GstRtspServer.RTSPServer()
-            server.set_service(str(port))
-            servers[port] = server
-            mounts = server.get_mount_points()
+        # 为每个端口创建一个 RTSP 服务器 (或合并到单个端口)，挂载点在各路初始化完成后再添加
+        for port in streams_by_port:
+            self.rtsp.server(port)
+        self.rtsp.start()
+        print(f"RTSP 监听: {self.rtsp.describe()}")
+
+        # /metrics、/snapshot、/api 默认共用 metrics_port，单独指定端口时各自监听
+        http_services = {}
+
+        def http_on(port):
+            if port not in http_services:
+                http_services[port] = HTTPService(port)
+            return http_services[port]
+
+        if self.metrics:
+            http_on(self.metrics_port).route('GET', '/metrics', self.metrics.handle)
+        snapshot_port = (snapshot_settings(self.snapshot) or {}).get('port') or self.metrics_port
+        if snapshot_port:
+            self.snapshots.register(http_on(snapshot_port))
+        api_port = control_port(self.control_api, self.metrics_port)
+        if api_port:
+            ControlAPI(self).register(http_on(api_port))
+        elif self.control_api:
+            print("警告: control_api 需要 metrics_port 或单独指定 port", file=sys.stderr)
+        for http in http_services.values():
+            http.start()
+
+        # 并行探测设备并准备 factory: 慢设备不阻塞其他挂载点，失败的流在后台重试
+        self._executor = ThreadPoolExecutor(max_workers=max(1, min(self.init_workers, len(enabled_streams))))
+        for config in enabled_streams:
+            self._start_stream(config)
 
-            # 为该端口的每个流创建 factory
-            for config in port_streams:
-                try:
-                    cam_server = self._create_camera_server(config)
-                    pipeline = cam_server._build_pipeline()
-
-                    factory = GstRtspServer.RTSPMediaFactory()
-                    factory.set_launch(pipeline)
-                    factory.set_shared(True)
-
-                    mounts.add_factory(config['mount'], factory)
-
-                    # 记录自动检测的分辨率
-                    config['_cam_server'] = cam_server
-
-                except Exception as e:
-                    print(f"初始化失败 [{config['name']}]: {e}", file=sys.stderr)
-
-            server.attach(None)
-
-        # 打印流信息
-        for i, config in enumerate(enabled_streams):
-            print(f"\n[{i+1}] {config['name']}")
-            print(f"    类型: {config['source'].upper()}")
-            if config['source'] == 'usb':
-                print(f"    设备: {config['device']}")
-                cam_server = config.get('_cam_server')
-                if cam_server and cam_server.input_width and cam_server.input_height:
-                    auto_tag = " (自动)" if getattr(cam_server, '_auto_detected', False) else ""
-                    print(f"    输入: {cam_server.input_width}x{cam_server.input_height}{auto_tag}")
-            elif config['source'] == 'rtsp':
-                print(f"    源: {config['url']}")
-                print(f"    输入编码: {config['input_codec'].upper()}")
-            print(f"    输出: {config['output_width']}x{config['output_height']} {config['codec'].upper()}")
-            print(f"    端口: {config['port']}")
-            print(f"    挂载点: {config['mount']}")
+        if self.config_path:
+            ConfigWatcher(self.config_path, self.reload, watch_file=self.watch_config).start()
 
         # 获取 IP 地址
         ips = self._get_all_ips()
@@ -796,7 +1276,15 @@ class MultiCameraRTSPServer:
         for iface, ip in ips:
             print(f"\n  [{iface}] {ip}")
             for config in enabled_streams:
-                print(f"    - {config['name']}: rtsp://{ip}:{config['port']}{config['mount']}")
+                print(f"    - {config['name']}: {self.rtsp.url(ip, config['port'], config['mount'])}")
+        if self.metrics:
+            print(f"\n运行指标: http://<ip>:{self.metrics_port}/metrics")
+        if snapshot_port and any(s['snapshot'] for s in enabled_streams):
+            print(f"快照: http://<ip>:{snapshot_port}/snapshot/<流名称>")
+        if api_port:
+            print(f"控制接口: http://<ip>:{api_port}/api/streams")
+        if self.config_path:
+            print(f"\n修改 {self.config_path} 或发送 SIGHUP 即可热加载配置")
         print("\n" + "=" * 60)
         print("按 Ctrl+C 停止服务器")
 
@@ -805,6 +1293,265 @@ class MultiCameraRTSPServer:
             loop.run()
         except KeyboardInterrupt:
             print("\n服务器已停止")
+        finally:
+            # 卡住的设备查询线程不等待
+            self._executor.shutdown(wait=False)
+            release_held_media([s['_cam_server'] for s in self.streams if s.get('_cam_server')])
+
+    def _start_stream(self, config: dict):
+        """分配序号并开始初始化一路流"""
+        config['_index'] = self._next_index
+        config['_failures'] = 0
+        self._next_index += 1
+        self._submit_prepare(config)
+
+    def _stop_stream(self, config: dict):
+        """撤下一路流: 取消未完成的初始化，删除挂载点并断开其上的会话"""
+        config['_removed'] = True
+        pending = self._pending.pop(config.get('_index'), None)
+        if pending is not None and pending[1] is not None:
+            GLib.source_remove(pending[1])
+        if '_cam_server' in config:
+            config['_cam_server'].release_media()
+            config['_cam_server'].unwatch_queues()
+            if self.snapshots.taps.get(config['name']) is config['_cam_server'].snapshot:
+                self.snapshots.taps.pop(config['name'], None)
+            dropped = self.rtsp.remove_factory(config['port'], config['mount'])
+            print(f"[热加载] 已移除 {config['name']} "
+                  f"({self.rtsp.url('<ip>', config['port'], config['mount'])}，断开 {dropped} 个会话)")
+
+    def reload(self, config: dict):
+        """
+        热加载配置: 按 (端口, 挂载点) 对比新旧流配置
+
+        新增的流开始初始化，删除的流撤下挂载点，参数变化的流先撤下再重新初始化；
+        参数没有变化的挂载点不做任何操作，其上的客户端继续播放。
+        """
+        if self._executor is None:
+            return
+
+        for key, current in (('backend', self.backend.name), ('metrics_port', self.metrics_port),
+                             ('single_port', self.rtsp.single_port)):
+            value = config.get(key)
+            if value not in (None, 'auto', current):
+                print(f"[热加载] {key} 变化需要重启服务器才能生效，本次忽略")
+
+        self.port = config.get('port', self.port)
+        self.init_timeout = config.get('init_timeout', self.init_timeout)
+        self.retry_interval = config.get('init_retry_interval', self.retry_interval)
+        # 全局 recovery / multicast / record 合并进每路配置，变化时对应的流重建
+        self.recovery = config.get('recovery')
+        self.multicast = config.get('multicast')
+        self.record = config.get('record')
+        self.snapshot = config.get('snapshot')
+
+        new_streams = [self._normalize_stream(s, i) for i, s in enumerate(config.get('streams', []))]
+        old = {(s['port'], s['mount']): s for s in self.streams if s['enable']}
+        new = {(s['port'], s['mount']): s for s in new_streams if s['enable']}
+        added, removed, changed = diff_keyed(old, new)
+
+        for key in removed + changed:
+            self._stop_stream(old[key])
+
+        # 未变化的流沿用原来的配置对象 (保存着运行时状态)
+        self.streams = []
+        for stream in new_streams:
+            key = (stream['port'], stream['mount'])
+            if stream['enable'] and key in old and key not in changed:
+                stream = old[key]
+            self.streams.append(stream)
+
+        for key in added + changed:
+            self._start_stream(new[key])
+
+        print(f"[热加载] 新增 {len(added)} 路，移除 {len(removed)} 路，重建 {len(changed)} 路，"
+              f"{len(new) - len(added) - len(changed)} 路未变化")
+
+    def _prepare_stream(self, config: dict) -> CameraRTSPServer:
+        """工作线程: 探测设备分辨率并验证配置 (可能阻塞在 v4l2 查询上)"""
+        cam_server = self._create_camera_server(config)
+        cam_server._build_source_graph()  # 提前检测分辨率并验证配置
+        cam_server._build_graph()
+        return cam_server
+
+    def _submit_prepare(self, config: dict):
+        """提交一次初始化，超时或失败后由主循环安排重试"""
+        index = config['_index']
+        attempt = self._pending.get(index, (0, None))[0] + 1
+        timer = GLib.timeout_add_seconds(self.init_timeout, self._on_prepare_timeout, config, attempt)
+        self._pending[index] = (attempt, timer)
+
+        future = self._executor.submit(self._prepare_stream, config)
+        # 完成回调在工作线程中执行，切回主循环处理
+        future.add_done_callback(lambda f: GLib.idle_add(self._on_prepared, config, attempt, f))
+
+    def _on_prepare_timeout(self, config: dict, attempt: int):
+        pending = self._pending.get(config['_index'])
+        if pending is None or pending[0] != attempt:
+            return False
+        self._pending[config['_index']] = (attempt, None)
+        print(f"\n[初始化] {config['name']}: 超过 {self.init_timeout}s 未完成 "
+              f"(设备无响应?)，其他挂载点不受影响，完成后再挂载", file=sys.stderr)
+        return False
+
+    def _on_prepared(self, config: dict, attempt: int, future):
+        """主循环: 一次初始化结束"""
+        index = config['_index']
+        pending = self._pending.get(index)
+        if pending is None or pending[0] != attempt:
+            return False  # 已经挂载
+        if pending[1] is not None:
+            GLib.source_remove(pending[1])
+
+        error = future.exception()
+        if error is None:
+            del self._pending[index]
+            cam_server = future.result()
+            try:
+                factory = cam_server.create_media_factory()
+                self.rtsp.add_factory(config['port'], config['mount'], factory)
+                cam_server.hold_media(self.rtsp.server(config['port']))
+            except Exception as e:
+                error = e
+            else:
+                config['_cam_server'] = cam_server
+                config['_failures'] = 0
+                if cam_server.snapshot and not cam_server._use_passthrough():
+                    self.snapshots.taps[config['name']] = cam_server.snapshot
+                self._print_stream_ready(config)
+                return False
+
+        config['_failures'] += 1
+        delay = min(self.retry_interval * 2 ** (config['_failures'] - 1), self.MAX_RETRY_INTERVAL)
+        print(f"\n初始化失败 [{config['name']}]: {error}，{delay}s 后重试 "
+              f"(第 {config['_failures']} 次失败)", file=sys.stderr)
+        # 记录重试定时器，撤下流时 (_stop_stream) 一并取消
+        self._pending[index] = (attempt, GLib.timeout_add_seconds(delay, self._retry_prepare, config))
+        return False
+
+    def _retry_prepare(self, config: dict):
+        if not config.get('_removed'):
+            self._submit_prepare(config)
+        return False
+
+    def _print_stream_ready(self, config: dict):
+        """打印已挂载的流信息"""
+        print(f"\n[{config['_index'] + 1}] {config['name']} 已就绪")
+        print(f"    类型: {config['source'].upper()}")
+        if config['source'] == 'usb':
+            print(f"    设备: {config['device']}")
+            cam_server = config.get('_cam_server')
+            if cam_server and cam_server.input_width and cam_server.input_height:
+                auto_tag = " (自动)" if getattr(cam_server, '_auto_detected', False) else ""
+                print(f"    输入: {cam_server.input_width}x{cam_server.input_height}{auto_tag}")
+        elif config['source'] == 'rtsp':
+            print(f"    源: {config['url']}")
+            print(f"    输入编码: {config['input_codec'].upper()}")
+        print(f"    输出: {config['output_width']}x{config['output_height']} {config['codec'].upper()}")
+        cam_server = config.get('_cam_server')
+        if cam_server and cam_server._use_passthrough():
+            print("    透传: 是 (不解码不重新编码)")
+        if config['multicast']:
+            print(f"    组播: {describe_multicast(config['multicast'])}")
+        if config['record']:
+            print(f"    录像: {describe_record(config['record'])}")
+        if config['snapshot']:
+            print(f"    快照: {describe_snapshot(config['snapshot'])}")
+        print(f"    地址: {self.rtsp.url('<ip>', config['port'], config['mount'])}")
+
+    def _stream_by_name(self, name: str):
+        """按名称查找流配置 (含已禁用的流)"""
+        return next((s for s in self.streams if s['name'] == name), None)
+
+    @staticmethod
+    def _running(config: dict) -> CameraRTSPServer:
+        """已挂载的流的 CameraRTSPServer，未启用或还在初始化时抛出 ControlError"""
+        if not config['enable']:
+            raise ControlError(f"{config['name']} 已禁用")
+        if '_cam_server' not in config:
+            raise ControlError(f"{config['name']} 还在初始化", 503)
+        return config['_cam_server']
+
+    def _describe_stream(self, config: dict) -> dict:
+        """流的配置和运行时参数 (控制接口)"""
+        if not config['enable']:
+            state = 'disabled'
+        elif '_cam_server' in config:
+            state = 'running'
+        else:
+            state = 'initializing'
+        item = {
+            'name': config['name'],
+            'enabled': config['enable'],
+            'state': state,
+            'source': config['source'],
+            'url': self.rtsp.url('<ip>', config['port'], config['mount']),
+            'codec': config['codec'],
+            'output_size': [config['output_width'], config['output_height']],
+            'configured_bitrate_kbps': config['bitrate'],
+            'configured_framerate': config['framerate'],
+        }
+        if state == 'running':
+            item.update(config['_cam_server'].live_params())
+            item['sessions'] = len(self.rtsp.sessions(config['port'], config['mount']))
+        return item
+
+    def control_streams(self) -> list:
+        """控制接口: 所有流 (含已禁用的流)"""
+        return [self._describe_stream(config) for config in self.streams]
+
+    def control_set_bitrate(self, name: str, kbps: int):
+        """控制接口: 修改运行中编码器的码率"""
+        config = self._stream_by_name(name)
+        if config is None:
+            return None
+        self._running(config).set_bitrate(kbps * 1000)
+        print(f"[控制] {name}: 码率 -> {kbps} kbps")
+        return self._describe_stream(config)
+
+    def control_set_framerate(self, name: str, fps: int):
+        """控制接口: 降低输出帧率"""
+        config = self._stream_by_name(name)
+        if config is None:
+            return None
+        self._running(config).set_output_framerate(fps)
+        print(f"[控制] {name}: 帧率 -> {fps} fps")
+        return self._describe_stream(config)
+
+    def control_set_enabled(self, name: str, enabled: bool):
+        """控制接口: 启用 (开始初始化) 或禁用 (撤下挂载点，断开会话) 一路流"""
+        config = self._stream_by_name(name)
+        if config is None:
+            return None
+        if config['enable'] != enabled:
+            print(f"[控制] {'启用' if enabled else '禁用'} {name}")
+            if enabled:
+                config['enable'] = True
+                config.pop('_removed', None)
+                self._start_stream(config)
+            else:
+                self._stop_stream(config)
+                config['enable'] = False
+                config.pop('_cam_server', None)
+        return self._describe_stream(config)
+
+    def control_keyframe(self, name: str):
+        """控制接口: 让编码器立即出关键帧"""
+        config = self._stream_by_name(name)
+        if config is None:
+            return None
+        requested = self._running(config).force_keyframe()
+        return {'name': name, 'requested': requested,
+                'note': None if requested else '没有客户端，media 未创建'}
+
+    def control_sessions(self, name: str):
+        """控制接口: 挂载点上的 RTSP 会话"""
+        config = self._stream_by_name(name)
+        if config is None:
+            return None
+        if not config['enable']:
+            return []
+        return self.rtsp.sessions(config['port'], config['mount'])
 
     def _get_all_ips(self) -> list:
         """获取所有网卡的 IP 地址"""
@@ -837,12 +1584,17 @@ class MultiCameraRTSPServer:
         return ips
 
     @staticmethod
-    def from_config_file(config_path: str) -> 'MultiCameraRTSPServer':
+    def from_config_file(config_path: str, backend: str = None, metrics_port: int = None,
+                         single_port: int = None, client_threads: int = None) -> 'MultiCameraRTSPServer':
         """
         从配置文件创建多路服务器
 
         Args:
             config_path: JSON 配置文件路径
+            backend: 编解码后端，None 表示使用配置文件中的 backend (默认 auto)
+            metrics_port: /metrics HTTP 端口，None 表示使用配置文件中的 metrics_port (默认不启用)
+            single_port: 合并监听端口，None 表示使用配置文件中的 single_port (默认不合并)
+            client_threads: 客户端处理线程数，None 表示使用配置文件中的 rtsp_client_threads
 
         Returns:
             MultiCameraRTSPServer 实例
@@ -851,7 +1603,21 @@ class MultiCameraRTSPServer:
             config = json.load(f)
 
         port = config.get('port', 8554)
-        server = MultiCameraRTSPServer(port=port)
+        server = MultiCameraRTSPServer(port=port, backend=backend or config.get('backend', 'auto'),
+                                       metrics_port=metrics_port or config.get('metrics_port'),
+                                       init_timeout=config.get('init_timeout', 15),
+                                       retry_interval=config.get('init_retry_interval', 10),
+                                       init_workers=config.get('init_workers', 8),
+                                       single_port=single_port or config.get('single_port'),
+                                       client_threads=client_threads or config.get('rtsp_client_threads'),
+                                       thread_per_port=config.get('rtsp_thread_per_port', True))
+        server.config_path = config_path
+        server.watch_config = config.get('watch_config', True)
+        server.recovery = config.get('recovery')
+        server.multicast = config.get('multicast')
+        server.record = config.get('record')
+        server.snapshot = config.get('snapshot')
+        server.control_api = config.get('control_api')
 
         for stream in config.get('streams', []):
             server.add_stream(stream)
@@ -871,6 +1637,15 @@ class MultiCameraRTSPServer:
         """
         sample_config = {
             "port": 8554,
+            "init_timeout": 15,
+            "init_retry_interval": 10,
+            "recovery": {
+                "rtsp_max_retries": -1,
+                "decoder_max_retries": -1,
+                "rtsp_retry_interval_ms": 1000,
+                "decoder_retry_interval_ms": 1000,
+                "transition_timeout_ms": 10000
+            },
             "streams": [
                 {
                     "name": "USB 摄像头",
@@ -945,14 +1720,50 @@ def main():
   python3 camera_rtsp_server.py --source rtsp --url rtsp://192.168.1.100:554/stream \\
       --input-codec h265
 
+  # RTSP 源编码和分辨率与输出一致时自动透传 (parse ! pay，不占用解码器和编码器)
+  python3 camera_rtsp_server.py --source rtsp --url rtsp://192.168.1.100:554/stream \\
+      --codec h264 --output-width 1920 --output-height 1080
+
+  # H.264 UVC 相机透传
+  python3 camera_rtsp_server.py --source usb --input-format h264 --codec h264 --passthrough on
+
   # 测试模式
   python3 camera_rtsp_server.py --source test
 
+  # 无 Jetson 硬件时使用软件编解码 (jpegdec / videoscale / x264enc / x265enc)
+  python3 camera_rtsp_server.py --source test --backend software
+
+  # 嵌入采集时间戳，用 latency.py 测量端到端延迟
+  python3 camera_rtsp_server.py --source usb --latency-stamp
+  python3 latency.py rtsp://192.168.1.2:8554/stream
+
+  # 提供 Prometheus 运行指标 (客户端数、fps、比特率、丢帧、RTCP 丢包)
+  python3 camera_rtsp_server.py --source usb --metrics-port 9100
+  curl http://192.168.1.2:9100/metrics
+
+  # 源故障恢复 (默认开启): 上游 RTSP 断开或 USB 设备出错时只重建源和解码部分，
+  # 期间重复最后一帧，客户端不断开。多路模式在配置文件中用 recovery 块设置重试次数和间隔
+  python3 camera_rtsp_server.py --source rtsp --url rtsp://192.168.1.100:554/stream
+
   # 自定义分辨率和编码
   python3 camera_rtsp_server.py --source usb --device /dev/video0 \\
       --output-width 1024 --output-height 1024 \\
       --codec h264 --bitrate 8000
 
+  # 同一 VLAN 上多个客户端共用一路组播流 (239.255.42.x:5000-5999)
+  python3 camera_rtsp_server.py --source usb --multicast prefer
+  vlc --rtsp-mcast rtsp://192.168.1.2:8554/stream
+  ffplay -rtsp_transport udp_multicast rtsp://192.168.1.2:8554/stream
+
+  # 同时分段录像 (不重新编码，每 10 分钟一个 mp4，最多保留 144 个文件)
+  # 多路模式在配置文件中用 record 块设置 (全局或单路)
+  python3 camera_rtsp_server.py --source usb --record /data/recordings \\
+      --record-segment 600 --record-max-files 144
+
+  # JPEG 快照 (缩略图轮询不必建立 RTSP 会话)
+  python3 camera_rtsp_server.py --source usb --snapshot-port 9100
+  curl -o snap.jpg http://192.168.1.2:9100/snapshot/stream
+
 播放:
   vlc rtsp://192.168.1.2:8554/stream
   ffplay rtsp://192.168.1.2:8554/stream
@@ -963,6 +1774,13 @@ def main():
 
   # 使用配置文件启动多路服务器
   python3 camera_rtsp_server.py --config multi_camera.json
+
+  # 修改配置文件后自动热加载，也可以手动触发 (未变化的挂载点不断流)
+  kill -HUP <pid>
+
+  # 所有挂载点合并到 8554 一个端口 (其他端口的挂载点变为 /<端口>/<挂载点>)，
+  # 每个端口 4 个线程处理客户端请求
+  python3 camera_rtsp_server.py --config multi_camera.json --single-port 8554 --rtsp-threads 4
         """
     )
 
@@ -986,6 +1804,8 @@ def main():
                         help="RTSP 源地址 (用于 rtsp 类型)")
     parser.add_argument("--input-codec", choices=["h264", "h265"], default="h264",
                         help="RTSP 源输入编码格式 (默认: h264)")
+    parser.add_argument("--input-format", choices=["mjpeg", "yuyv", "nv12", "h264"], default="mjpeg",
+                        help="USB 摄像头输入格式 (默认: mjpeg)")
 
     parser.add_argument("--port", "-p", type=int, default=8554,
                         help="RTSP 端口号 (默认: 8554)")
@@ -1010,6 +1830,36 @@ def main():
                         help="帧率 (默认: 30)")
     parser.add_argument("--flip", type=int, default=0, choices=range(8),
                         help="图像翻转方式 0-7 (仅 CSI 相机, 默认: 0)")
+    parser.add_argument("--backend", choices=BACKEND_CHOICES, default=None,
+                        help="编解码后端: auto 自动探测 / jetson 硬件 / software 软件 (默认: auto)")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="在该端口提供 HTTP /metrics 运行指标 (Prometheus 格式，默认不启用)")
+    parser.add_argument("--single-port", type=int, default=None,
+                        help="多路模式: 所有挂载点合并到该监听端口 (默认: 配置文件中的 single_port)")
+    parser.add_argument("--rtsp-threads", type=int, default=None,
+                        help="多路模式: 每个监听端口处理客户端请求的线程数 (默认: 配置文件中的 rtsp_client_threads 或 1)")
+    parser.add_argument("--latency-stamp", action="store_true",
+                        help="在码流中嵌入采集时间戳 SEI，配合 latency.py 测量端到端延迟")
+    parser.add_argument("--passthrough", choices=["auto", "on", "off"], default="auto",
+                        help="码流透传: auto 编码/分辨率/码率满足输出时不转码, on 编码一致即透传, off 总是转码 (默认: auto)")
+    parser.add_argument("--multicast", choices=["prefer", "force"], default=None,
+                        help="启用 RTSP 组播: prefer 同时接受单播, force 只允许组播 (默认: 只用单播)")
+    parser.add_argument("--multicast-ttl", type=int, default=1,
+                        help="组播 TTL (默认: 1，只在本网段)")
+    parser.add_argument("--record", metavar="DIR", default=None,
+                        help="分段录像到该目录 (从编码输出直接写盘，不重新编码)")
+    parser.add_argument("--record-format", choices=["mp4", "mkv", "ts"], default="mp4",
+                        help="录像格式 (默认: mp4)")
+    parser.add_argument("--record-segment", type=int, default=300,
+                        help="每段录像时长，秒 (默认: 300)")
+    parser.add_argument("--record-max-files", type=int, default=0,
+                        help="最多保留的录像文件数，0 不限 (默认: 0)")
+    parser.add_argument("--snapshot-port", type=int, default=None,
+                        help="启用 JPEG 快照 GET /snapshot/<挂载点> (指定 --metrics-port 时与其共用端口)")
+    parser.add_argument("--snapshot-interval", type=float, default=2,
+                        help="快照取帧间隔，秒 (默认: 2)")
+    parser.add_argument("--no-recovery", action="store_true",
+                        help="关闭源故障恢复 (源断开时直接结束 media，客户端需重连)")
 
     args = parser.parse_args()
 
@@ -1039,7 +1889,10 @@ def main():
     # 多路相机模式
     if args.config:
         try:
-            server = MultiCameraRTSPServer.from_config_file(args.config)
+            server = MultiCameraRTSPServer.from_config_file(args.config, backend=args.backend,
+                                                            metrics_port=args.metrics_port,
+                                                            single_port=args.single_port,
+                                                            client_threads=args.rtsp_threads)
             server.start()
         except FileNotFoundError:
             print(f"错误: 配置文件不存在: {args.config}", file=sys.stderr)
@@ -1061,6 +1914,7 @@ def main():
             port=args.port,
             mount_point=args.mount,
             codec=args.codec,
+            input_format=args.input_format,
             input_codec=args.input_codec,
             bitrate=args.bitrate * 1000,
             input_width=args.input_width,
@@ -1068,9 +1922,21 @@ def main():
             output_width=args.output_width,
             output_height=args.output_height,
             framerate=args.framerate,
-            flip_method=args.flip
+            flip_method=args.flip,
+            backend=args.backend or 'auto',
+            latency_stamp=args.latency_stamp,
+            recovery=False if args.no_recovery else None,
+            passthrough=args.passthrough,
+            multicast=multicast_settings({'mode': args.multicast, 'ttl': args.multicast_ttl}
+                                         if args.multicast else None),
+            record=record_settings({'path': args.record, 'format': args.record_format,
+                                    'segment_seconds': args.record_segment,
+                                    'max_files': args.record_max_files}
+                                   if args.record else None),
+            snapshot=snapshot_settings({'port': args.snapshot_port, 'interval': args.snapshot_interval}
+                                       if args.snapshot_port else None)
         )
-        server.start()
+        server.start(metrics_port=args.metrics_port)
     except ValueError as e:
         print(f"配置错误: {e}", file=sys.stderr)
         sys.exit(1)
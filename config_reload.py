@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+配置文件热加载
+
+ConfigWatcher 在 GLib 主循环上监视配置文件 (修改时间轮询) 并响应 SIGHUP，
+读到新的合法配置后回调服务器的 reload(config)。由服务器自己对比新旧配置，
+只增删/重建变化的挂载点和分支，其余挂载点上的客户端不受影响。
+
+    kill -HUP <pid>       # 立即重新加载
+"""
+
+import hashlib
+import json
+import os
+import signal
+import traceback
+
+from gi.repository import GLib, GstRtspServer
+
+
+def public_config(config: dict) -> dict:
+    """去掉运行时附加的 _ 开头字段，用于比较配置是否变化"""
+    return {k: v for k, v in config.items() if not k.startswith('_')}
+
+
+def diff_keyed(old: dict, new: dict) -> tuple:
+    """
+    对比两组按键索引的配置
+
+    Args:
+        old: {key: config}
+        new: {key: config}
+
+    Returns:
+        (新增的 key 列表, 删除的 key 列表, 参数变化的 key 列表)
+    """
+    added = [k for k in new if k not in old]
+    removed = [k for k in old if k not in new]
+    changed = [k for k in new if k in old and public_config(old[k]) != public_config(new[k])]
+    return added, removed, changed
+
+
+def drop_mount_sessions(server, mount: str) -> int:
+    """
+    断开某个挂载点上的所有 RTSP 会话 (挂载点删除或重建时调用)
+
+    Returns:
+        断开的会话数
+    """
+    dropped = [0]
+
+    def session_filter(pool, session, user_data):
+        media, matched = session.get_media(mount)
+        if media is not None and matched == len(mount):
+            dropped[0] += 1
+            return GstRtspServer.RTSPFilterResult.REMOVE
+        return GstRtspServer.RTSPFilterResult.KEEP
+
+    server.get_session_pool().filter(session_filter, None)
+    return dropped[0]
+
+
+class ConfigWatcher:
+    """监视配置文件变化和 SIGHUP"""
+
+    def __init__(self, path: str, on_reload, interval: int = 2, watch_file: bool = True):
+        """
+        Args:
+            path: 配置文件路径
+            on_reload: on_reload(config dict)，在主循环中调用
+            interval: 文件修改时间轮询间隔 (秒)
+            watch_file: False 表示只响应 SIGHUP
+        """
+        self.path = path
+        self.on_reload = on_reload
+        self.interval = interval
+        self.watch_file = watch_file
+        self._mtime = self._stat()
+        self._digest = self._read_digest()
+
+    def start(self):
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGHUP, self._on_sighup)
+        if self.watch_file:
+            GLib.timeout_add_seconds(self.interval, self._poll)
+
+    def _stat(self):
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def _read_digest(self):
+        try:
+            with open(self.path, 'rb') as f:
+                return hashlib.sha1(f.read()).hexdigest()
+        except OSError:
+            return None
+
+    def _on_sighup(self):
+        print(f"\n[热加载] 收到 SIGHUP，重新加载 {self.path}")
+        self.reload(force=True)
+        return True
+
+    def _poll(self):
+        mtime = self._stat()
+        if mtime is not None and mtime != self._mtime:
+            self._mtime = mtime
+            self.reload()
+        return True
+
+    def reload(self, force: bool = False):
+        """读取配置并回调 (内容没有变化且非强制时跳过)"""
+        digest = self._read_digest()
+        if digest is None or (digest == self._digest and not force):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except (OSError, ValueError) as e:
+            # 编辑器保存到一半或格式错误: 保持当前配置运行
+            print(f"[热加载] 配置文件无效，忽略: {e}")
+            return
+        print(f"\n[热加载] 应用新配置: {self.path}")
+        try:
+            self.on_reload(config)
+        except Exception as e:
+            # 不记录摘要: 下次保存或 SIGHUP 时重试
+            print(f"[热加载] 应用配置失败: {e}")
+            traceback.print_exc()
+            return
+        self._digest = digest
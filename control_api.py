@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+HTTP 控制接口 (/api)
+
+运行在 HTTPService (GLib 主循环) 上，处理函数直接调用服务器方法，不需要加锁:
+
+    GET  /api/streams                      所有流及其运行参数 (含已禁用的流)
+    GET  /api/streams/<名称>               单个流
+    GET  /api/streams/<名称>/sessions      该流上的 RTSP 会话
+    POST /api/streams/<名称>/bitrate       {"kbps": 2000}  修改运行中编码器的码率
+    POST /api/streams/<名称>/framerate     {"fps": 15}     修改输出帧率 (只能低于采集帧率)
+    POST /api/streams/<名称>/enable        启用
+    POST /api/streams/<名称>/disable       禁用 (撤下挂载点，断开会话)
+    POST /api/streams/<名称>/keyframe      立即请求关键帧
+
+参数也可以放在 query 中 (如 POST /api/streams/cam1/bitrate?kbps=2000)。
+修改只在运行时生效，不写回配置文件；配置文件热加载后以文件为准。
+
+服务器实现以下方法 (流不存在时返回 None，操作不支持时抛出 ControlError):
+
+    control_streams() -> list[dict]            每项包含 name
+    control_set_bitrate(name, kbps) -> dict
+    control_set_framerate(name, fps) -> dict
+    control_set_enabled(name, enabled) -> dict
+    control_keyframe(name) -> dict
+    control_sessions(name) -> list[dict]       (见 RTSPService.sessions)
+
+配置: "control_api": true (与 /metrics 共用 HTTP 端口) 或 {"port": 9101}
+"""
+
+import json
+from urllib.parse import unquote
+
+from http_service import json_response
+
+
+class ControlError(Exception):
+    """控制操作失败 (status 为 HTTP 状态码)"""
+
+    def __init__(self, message: str, status: int = 409):
+        super().__init__(message)
+        self.status = status
+
+
+def control_port(setting, default: int = None):
+    """
+    控制接口的 HTTP 端口
+
+    Args:
+        setting: 配置中的 control_api (true / false / {"port": N} / None)
+        default: 共用的端口 (metrics_port)
+
+    Returns:
+        端口，未启用时返回 None
+    """
+    if not setting:
+        return None
+    if isinstance(setting, dict) and setting.get('port'):
+        return setting['port']
+    return default
+
+
+class ControlAPI:
+    """/api 路由"""
+
+    def __init__(self, server):
+        """
+        Args:
+            server: 实现 control_* 方法的服务器 (见模块说明)
+        """
+        self.server = server
+
+    def register(self, http):
+        """在 HTTPService 上注册 /api 路由"""
+        http.route('GET', '/api/streams', self.handle_get, prefix=True)
+        http.route('POST', '/api/streams', self.handle_post, prefix=True)
+
+    def handle_get(self, request) -> tuple:
+        streams = self.server.control_streams()
+        if not request.params:
+            return json_response({'streams': streams})
+        name = unquote(request.params[0])
+        if not any(s['name'] == name for s in streams):
+            return json_response({'error': f'unknown stream: {name}'}, 404)
+        action = request.params[1] if len(request.params) > 1 else None
+        if action is None:
+            return json_response(next(s for s in streams if s['name'] == name))
+        if action == 'sessions':
+            return self._call(self.server.control_sessions, name)
+        return json_response({'error': f'unknown resource: {action}'}, 404)
+
+    def handle_post(self, request) -> tuple:
+        if len(request.params) != 2:
+            return json_response({'error': 'expected /api/streams/<name>/<action>'}, 404)
+        name, action = unquote(request.params[0]), request.params[1]
+        try:
+            args = self._arguments(request)
+        except ValueError as e:
+            return json_response({'error': str(e)}, 400)
+
+        if action == 'bitrate':
+            value = self._positive(args, 'kbps')
+            if value is None:
+                return json_response({'error': 'kbps must be a positive integer'}, 400)
+            return self._call(self.server.control_set_bitrate, name, value)
+        if action == 'framerate':
+            value = self._positive(args, 'fps')
+            if value is None:
+                return json_response({'error': 'fps must be a positive integer'}, 400)
+            return self._call(self.server.control_set_framerate, name, value)
+        if action in ('enable', 'disable'):
+            return self._call(self.server.control_set_enabled, name, action == 'enable')
+        if action == 'keyframe':
+            return self._call(self.server.control_keyframe, name)
+        return json_response({'error': f'unknown action: {action}'}, 404)
+
+    @staticmethod
+    def _arguments(request) -> dict:
+        """POST 参数: JSON 请求体 + query"""
+        args = dict(request.query)
+        if request.body.strip():
+            try:
+                body = json.loads(request.body.decode('utf-8'))
+            except (UnicodeDecodeError, json.JSONDecodeError) as e:
+                raise ValueError(f'invalid JSON body: {e}')
+            if not isinstance(body, dict):
+                raise ValueError('JSON body must be an object')
+            args.update(body)
+        return args
+
+    @staticmethod
+    def _positive(args: dict, key: str):
+        try:
+            value = int(args.get(key))
+        except (TypeError, ValueError):
+            return None
+        return value if value > 0 else None
+
+    @staticmethod
+    def _call(method, name: str, *args) -> tuple:
+        try:
+            result = method(name, *args)
+        except ControlError as e:
+            return json_response({'error': str(e)}, e.status)
+        if result is None:
+            return json_response({'error': f'unknown stream: {name}'}, 404)
+        return json_response(result)
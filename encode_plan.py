@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+多路输出编码规划
+
+把一组输出流配置编译成最小的两级扇出图:
+  - 每个输出分辨率一个缩放器 (nvvidconv)
+  - 缩放器下每个不同的编码参数 (codec, bitrate, framerate, gop) 一个编码器
+  - 编码参数完全相同的流共享同一个编码器
+
+                         +-> encoder (h265, 16000kbps, 20fps) -> camera1, camera2
+decode -> tee -> scaler (1920x1080)
+                         +-> encoder (h265, 4000kbps, 30fps)  -> camera0, camera10
+"""
+
+from collections import namedtuple
+
+
+# 编码参数: bitrate 单位 kbps，gop 为 I 帧间隔 (帧)
+EncodeProfile = namedtuple('EncodeProfile', ['codec', 'bitrate', 'framerate', 'gop'])
+
+
+class EncoderNode:
+    """一个编码器: 某个分辨率下的一组相同编码参数"""
+
+    def __init__(self, index: int, scaler: 'ScalerNode', profile: EncodeProfile):
+        self.index = index
+        self.scaler = scaler
+        self.profile = profile
+        self.streams = []  # [(stream_idx, stream_config), ...]
+
+    @property
+    def key(self) -> tuple:
+        """(width, height, profile)，编码参数完全相同的编码器 key 相同"""
+        return self.scaler.width, self.scaler.height, self.profile
+
+    @property
+    def width(self) -> int:
+        return self.scaler.width
+
+    @property
+    def height(self) -> int:
+        return self.scaler.height
+
+    @property
+    def pixel_rate(self) -> int:
+        """估算的编码像素速率 (像素/秒)"""
+        return self.width * self.height * self.profile.framerate
+
+    @property
+    def stream_names(self) -> list:
+        return [config.get('name', f'stream{idx}') for idx, config in self.streams]
+
+
+class ScalerNode:
+    """一个缩放器: 一个输出分辨率"""
+
+    def __init__(self, index: int, width: int, height: int):
+        self.index = index
+        self.width = width
+        self.height = height
+        self.encoders = []  # [EncoderNode, ...]
+
+    @property
+    def key(self) -> tuple:
+        return self.width, self.height
+
+
+class EncodePlan:
+    """编译后的扇出规划"""
+
+    def __init__(self, input_framerate: int):
+        self.input_framerate = input_framerate
+        self.scalers = []  # [ScalerNode, ...]
+        self.encoders = []  # [EncoderNode, ...] (按创建顺序排列)
+        self.stream_encoders = {}  # stream_idx -> encoder index
+        # 下一个新节点的 index (热加载时新规划从这里继续编号，不复用旧分支的名称)
+        self.next_scaler_index = 0
+        self.next_encoder_index = 0
+
+    @property
+    def total_pixel_rate(self) -> int:
+        return sum(enc.pixel_rate for enc in self.encoders)
+
+    def encoder(self, index: int) -> EncoderNode:
+        return next(enc for enc in self.encoders if enc.index == index)
+
+    def scaler(self, index: int) -> ScalerNode:
+        return next(scaler for scaler in self.scalers if scaler.index == index)
+
+    def encoder_for_stream(self, stream_idx: int) -> EncoderNode:
+        return self.encoder(self.stream_encoders[stream_idx])
+
+    def describe(self) -> list:
+        """
+        规划的可读描述
+
+        Returns:
+            文本行列表
+        """
+        lines = [
+            f"缩放器: {len(self.scalers)} 个, 编码器: {len(self.encoders)} 个, "
+            f"输出流: {len(self.stream_encoders)} 路"
+        ]
+        for scaler in self.scalers:
+            lines.append(f"  [scaler {scaler.index}] {scaler.width}x{scaler.height}")
+            for enc in scaler.encoders:
+                p = enc.profile
+                lines.append(
+                    f"    [tee_{enc.index}] {p.codec.upper()} {p.bitrate} kbps @ {p.framerate}fps GOP {p.gop}"
+                    f"  ~{enc.pixel_rate / 1e6:.1f} Mpx/s"
+                    f"  -> {', '.join(enc.stream_names)}"
+                )
+        lines.append(f"  编码总像素速率: ~{self.total_pixel_rate / 1e6:.1f} Mpx/s")
+        return lines
+
+
+def compile_plan(stream_configs: list, input_framerate: int = 30,
+                 default_codec: str = 'h265', default_bitrate: int = 4000,
+                 default_gop: int = 60, previous: EncodePlan = None) -> EncodePlan:
+    """
+    把输出流配置编译成扇出规划
+
+    Args:
+        stream_configs: 已启用的输出流配置列表 (width, height, codec, bitrate, framerate, gop)
+        input_framerate: 摄像头输入帧率，输出帧率不会超过它
+        default_codec: 未配置 codec 时的编码格式
+        default_bitrate: 未配置 bitrate 时的比特率 (kbps)
+        default_gop: 未配置 gop 时的 I 帧间隔 (帧)
+        previous: 正在运行的规划 (热加载)。参数不变的缩放器/编码器沿用原来的 index，
+            新增的从 previous 的编号之后继续分配
+
+    Returns:
+        EncodePlan
+    """
+    plan = EncodePlan(input_framerate)
+    scalers = {}  # (width, height) -> ScalerNode
+    encoders = {}  # (width, height, profile) -> EncoderNode
+    old_scalers = {s.key: s.index for s in previous.scalers} if previous else {}
+    old_encoders = {e.key: e.index for e in previous.encoders} if previous else {}
+    if previous:
+        plan.next_scaler_index = previous.next_scaler_index
+        plan.next_encoder_index = previous.next_encoder_index
+
+    for stream_idx, config in enumerate(stream_configs):
+        width = config.get('width', 1920)
+        height = config.get('height', 1080)
+        # 只能丢帧不能凭空增加帧，输出帧率以输入帧率为上限
+        framerate = min(config.get('framerate', input_framerate), input_framerate)
+        profile = EncodeProfile(
+            codec=config.get('codec', default_codec).lower(),
+            bitrate=config.get('bitrate', default_bitrate),
+            framerate=framerate,
+            gop=config.get('gop', default_gop),
+        )
+
+        scaler = scalers.get((width, height))
+        if scaler is None:
+            index = old_scalers.get((width, height))
+            if index is None:
+                index = plan.next_scaler_index
+                plan.next_scaler_index += 1
+            scaler = ScalerNode(index, width, height)
+            scalers[(width, height)] = scaler
+            plan.scalers.append(scaler)
+
+        encoder = encoders.get((width, height, profile))
+        if encoder is None:
+            index = old_encoders.get((width, height, profile))
+            if index is None:
+                index = plan.next_encoder_index
+                plan.next_encoder_index += 1
+            encoder = EncoderNode(index, scaler, profile)
+            encoders[(width, height, profile)] = encoder
+            scaler.encoders.append(encoder)
+            plan.encoders.append(encoder)
+
+        encoder.streams.append((stream_idx, config))
+        plan.stream_encoders[stream_idx] = encoder.index
+
+    return plan
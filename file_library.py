@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+"""
+视频文件索引与回放 (rtsp_server.py)
+
+打开 MP4/MOV 时只解析一次 moov 中视频轨的 sample table，得到每个 access unit 的
+文件偏移、大小、DTS/PTS 和关键帧标记，之后回放直接按索引从 mmap 读取，不再经过 demux:
+
+    [SampleIndex]  mmap(file) + 偏移/大小/时间戳数组  (同一文件的所有 media 共用)
+          |
+    [IndexedFeeder]  appsrc ! h26xparse ! rtph26xpay   (每个 media 一个)
+
+循环播放时第 N 遍的时间戳整体加上 N x 文件时长，循环点前后 DTS/PTS 连续，
+客户端看到的是一条不间断的码流 (原 multifilesrc loop=true 在循环点重新打开并解析文件，
+时间戳跳回 0)。
+
+点播 (VOD) 模式下每个客户端一个 media、一个 IndexedFeeder，appsrc 可 seek:
+RTSP PLAY 的 Range 由 rtsp-media 转成 seek，这里定位到目标时间之前最近的关键帧，
+从关键帧开始推送并把时间戳平移到目标时间。所有会话共用同一个索引和 mmap (页缓存)，
+不重复 demux，也不重复从磁盘读取。
+
+FileLibrary 把目录中的所有视频文件挂载为 /files/<name>。
+
+只支持非分片 MP4 (moov 中带完整 sample table) 中的 H.264/H.265 视频轨，
+其他文件抛出 UnsupportedFileError，由调用方回退到 demux pipeline。
+"""
+
+import bisect
+import mmap
+import os
+import re
+import struct
+import threading
+from array import array
+
+import gi
+
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+
+class UnsupportedFileError(Exception):
+    """文件不能建立索引 (不是 MP4、分片 MP4、没有 H.264/H.265 视频轨等)"""
+    pass
+
+
+# 可建立索引的扩展名
+INDEXABLE_EXTENSIONS = ('.mp4', '.mov', '.m4v')
+
+# 目录挂载时收录的扩展名 (其余格式按 demux pipeline 回放)
+VIDEO_EXTENSIONS = INDEXABLE_EXTENSIONS + ('.mkv', '.webm', '.ts', '.flv', '.avi',
+                                           '.h264', '.264', '.h265', '.265', '.hevc')
+
+# sample entry 类型 -> (编码, stream-format)
+_SAMPLE_ENTRIES = {
+    b'avc1': ('h264', 'avc'),
+    b'avc3': ('h264', 'avc3'),
+    b'hvc1': ('h265', 'hvc1'),
+    b'hev1': ('h265', 'hev1'),
+}
+
+
+def _boxes(buf, start: int, end: int):
+    """遍历 [start, end) 内的 box，产生 (类型, 负载起点, 结束位置)"""
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', buf, pos)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', buf, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise UnsupportedFileError(f"box {kind!r} 越界 (文件不完整?)")
+        yield kind, pos + header, pos + size
+        pos += size
+
+
+def _child(buf, start: int, end: int, kind: bytes):
+    """第一个指定类型的子 box，返回 (负载起点, 结束位置)，没有时返回 None"""
+    for child_kind, payload, child_end in _boxes(buf, start, end):
+        if child_kind == kind:
+            return payload, child_end
+    return None
+
+
+def _path(buf, start: int, end: int, *kinds):
+    """按路径查找嵌套的 box，如 _path(buf, s, e, b'mdia', b'minf', b'stbl')"""
+    box = (start, end)
+    for kind in kinds:
+        box = _child(buf, box[0], box[1], kind)
+        if box is None:
+            return None
+    return box
+
+
+def _table(buf, box, fmt: str, fields: int = 1) -> tuple:
+    """读取 "version/flags + entry_count + 条目" 形式的表，返回展开的元组"""
+    payload = box[0] + 4
+    count = struct.unpack_from('>I', buf, payload)[0]
+    return struct.unpack_from('>%d%s' % (count * fields, fmt), buf, payload + 4)
+
+
+class SampleIndex:
+    """
+    一个视频文件的 access unit 索引
+
+    时间单位为轨道的 timescale，to_ns() 转换为纳秒。文件通过 mmap 只读映射，
+    多个 media 读取同一文件时共用页缓存。
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: MP4/MOV 文件路径
+
+        Raises:
+            UnsupportedFileError: 不能建立索引
+        """
+        self.path = os.path.abspath(path)
+        stat = os.stat(self.path)
+        self.mtime = stat.st_mtime
+        self.file_size = stat.st_size
+        if self.file_size == 0:
+            raise UnsupportedFileError("空文件")
+
+        with open(self.path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._parse(self._map)
+        except (struct.error, IndexError, StopIteration, ValueError):
+            # 截断或损坏: box 越界、stsc 引用不存在的 chunk、stsd 为空等
+            self._map.close()
+            raise UnsupportedFileError("sample table 不完整或损坏")
+        except UnsupportedFileError:
+            self._map.close()
+            raise
+
+    def _parse(self, buf):
+        moov = None
+        for kind, payload, end in _boxes(buf, 0, len(buf)):
+            if kind == b'moov':
+                moov = (payload, end)
+            elif kind == b'moof':
+                raise UnsupportedFileError("分片 MP4 (fMP4) 不支持建立索引")
+        if moov is None:
+            raise UnsupportedFileError("没有 moov (不是 MP4/MOV 文件?)")
+
+        for kind, payload, end in _boxes(buf, *moov):
+            if kind != b'trak':
+                continue
+            hdlr = _path(buf, payload, end, b'mdia', b'hdlr')
+            if hdlr is None or buf[hdlr[0] + 8:hdlr[0] + 12] != b'vide':
+                continue
+            self._parse_track(buf, payload, end)
+            return
+        raise UnsupportedFileError("没有视频轨")
+
+    def _parse_track(self, buf, start: int, end: int):
+        mdhd = _path(buf, start, end, b'mdia', b'mdhd')
+        stbl = _path(buf, start, end, b'mdia', b'minf', b'stbl')
+        if mdhd is None or stbl is None:
+            raise UnsupportedFileError("视频轨缺少 mdhd/stbl")
+        version = buf[mdhd[0]]
+        self.timescale = struct.unpack_from('>I', buf, mdhd[0] + (20 if version == 1 else 12))[0]
+
+        # stsd: 第一个 sample entry 的编码、分辨率和 avcC/hvcC
+        stsd = _child(buf, stbl[0], stbl[1], b'stsd')
+        if stsd is None:
+            raise UnsupportedFileError("缺少 stsd")
+        entry_kind, entry, entry_end = next(_boxes(buf, stsd[0] + 8, stsd[1]))
+        if entry_kind not in _SAMPLE_ENTRIES:
+            raise UnsupportedFileError(f"不支持的视频编码: {entry_kind.decode('latin-1')}")
+        self.codec, self.stream_format = _SAMPLE_ENTRIES[entry_kind]
+        self.width, self.height = struct.unpack_from('>HH', buf, entry + 24)
+        config = _child(buf, entry + 78, entry_end, b'avcC' if self.codec == 'h264' else b'hvcC')
+        if config is None:
+            raise UnsupportedFileError("缺少 avcC/hvcC")
+        self.codec_data = bytes(buf[config[0]:config[1]])
+
+        self._parse_sizes(buf, stbl)
+        self._parse_offsets(buf, stbl)
+        self._parse_times(buf, stbl)
+
+        stss = _child(buf, stbl[0], stbl[1], b'stss')
+        if stss is None:
+            self.keyframes = bytearray(b'\x01') * self.count  # 没有 stss 表示全是关键帧
+        else:
+            self.keyframes = bytearray(self.count)
+            for number in _table(buf, stss, 'I'):
+                if 0 < number <= self.count:
+                    self.keyframes[number - 1] = 1
+
+    def _parse_sizes(self, buf, stbl):
+        stsz = _child(buf, stbl[0], stbl[1], b'stsz')
+        if stsz is not None:
+            sample_size, count = struct.unpack_from('>II', buf, stsz[0] + 4)
+            if sample_size:
+                self.sizes = array('L', [sample_size]) * count
+            else:
+                self.sizes = array('L', struct.unpack_from('>%dI' % count, buf, stsz[0] + 12))
+        else:
+            stz2 = _child(buf, stbl[0], stbl[1], b'stz2')
+            if stz2 is None:
+                raise UnsupportedFileError("缺少 stsz/stz2")
+            field_size = buf[stz2[0] + 7]
+            count = struct.unpack_from('>I', buf, stz2[0] + 8)[0]
+            data = buf[stz2[0] + 12:stz2[1]]
+            if field_size == 16:
+                sizes = struct.unpack_from('>%dH' % count, data)
+            elif field_size == 8:
+                sizes = list(data[:count])
+            else:
+                sizes = [(data[i // 2] >> (4 if i % 2 == 0 else 0)) & 0x0F for i in range(count)]
+            self.sizes = array('L', sizes)
+        self.count = len(self.sizes)
+        if self.count == 0:
+            raise UnsupportedFileError("视频轨没有 sample (分片 MP4?)")
+
+    def _parse_offsets(self, buf, stbl):
+        stco = _child(buf, stbl[0], stbl[1], b'stco')
+        if stco is not None:
+            chunks = _table(buf, stco, 'I')
+        else:
+            co64 = _child(buf, stbl[0], stbl[1], b'co64')
+            if co64 is None:
+                raise UnsupportedFileError("缺少 stco/co64")
+            chunks = _table(buf, co64, 'Q')
+        stsc = _child(buf, stbl[0], stbl[1], b'stsc')
+        if stsc is None:
+            raise UnsupportedFileError("缺少 stsc")
+        runs = _table(buf, stsc, 'I', fields=3)  # (first_chunk, samples_per_chunk, 描述索引) ...
+
+        self.offsets = array('Q')
+        sample = 0
+        for run in range(0, len(runs), 3):
+            first_chunk, per_chunk = runs[run], runs[run + 1]
+            last_chunk = runs[run + 3] - 1 if run + 3 < len(runs) else len(chunks)
+            for chunk in range(first_chunk - 1, last_chunk):
+                offset = chunks[chunk]
+                for _ in range(per_chunk):
+                    if sample >= self.count:
+                        break
+                    self.offsets.append(offset)
+                    offset += self.sizes[sample]
+                    sample += 1
+        if sample != self.count:
+            raise UnsupportedFileError("stsc/stco 与 sample 数不一致")
+        if self.offsets[-1] + self.sizes[-1] > self.file_size:
+            raise UnsupportedFileError("sample 超出文件末尾 (文件不完整?)")
+
+    def _parse_times(self, buf, stbl):
+        stts = _child(buf, stbl[0], stbl[1], b'stts')
+        if stts is None:
+            raise UnsupportedFileError("缺少 stts")
+        entries = _table(buf, stts, 'I', fields=2)
+        self.dts = array('q')
+        t = 0
+        delta = 0
+        for i in range(0, len(entries), 2):
+            count, delta = entries[i], entries[i + 1]
+            for _ in range(count):
+                self.dts.append(t)
+                t += delta
+        del self.dts[self.count:]
+        while len(self.dts) < self.count:
+            self.dts.append(t)
+            t += delta
+        # 文件时长 = 最后一帧的 DTS + 其持续时间，也是循环播放时每一遍的时间戳偏移
+        self.duration = t
+        self.last_delta = delta
+
+        self.pts = array('q', self.dts)
+        ctts = _child(buf, stbl[0], stbl[1], b'ctts')
+        if ctts is not None:
+            signed = buf[ctts[0]] == 1
+            entries = _table(buf, ctts, 'i' if signed else 'I', fields=2)
+            sample = 0
+            for i in range(0, len(entries), 2):
+                count, offset = entries[i], entries[i + 1]
+                for _ in range(count):
+                    if sample >= self.count:
+                        break
+                    self.pts[sample] += offset
+                    sample += 1
+
+    @property
+    def duration_ns(self) -> int:
+        return self.to_ns(self.duration)
+
+    @property
+    def framerate(self) -> float:
+        return self.count * self.timescale / self.duration if self.duration else 0.0
+
+    @property
+    def bitrate(self) -> int:
+        """平均码率 (bps)"""
+        return int(sum(self.sizes) * 8 * self.timescale / self.duration) if self.duration else 0
+
+    def to_ns(self, t: int) -> int:
+        return t * Gst.SECOND // self.timescale
+
+    def keyframe_before(self, position_ns: int) -> int:
+        """解码顺序中时间 position_ns 之前 (含) 最近的关键帧序号"""
+        t = position_ns * self.timescale // Gst.SECOND
+        i = max(0, bisect.bisect_right(self.dts, t) - 1)
+        while i > 0 and not self.keyframes[i]:
+            i -= 1
+        return i
+
+    def caps(self) -> Gst.Caps:
+        """appsrc 的 caps (长度前缀格式，codec_data 为 avcC/hvcC)"""
+        media_type = 'video/x-h264' if self.codec == 'h264' else 'video/x-h265'
+        return Gst.Caps.from_string(
+            f'{media_type},stream-format=(string){self.stream_format},alignment=(string)au,'
+            f'width=(int){self.width},height=(int){self.height},'
+            f'codec_data=(buffer){self.codec_data.hex()}')
+
+    def read(self, i: int) -> bytes:
+        """第 i 个 access unit 的数据 (从 mmap 读取)"""
+        offset = self.offsets[i]
+        return self._map[offset:offset + self.sizes[i]]
+
+    def describe(self) -> str:
+        return (f"{self.codec.upper()} {self.width}x{self.height} {self.framerate:.2f}fps, "
+                f"{self.duration / self.timescale:.1f}s, {self.count} 帧, "
+                f"{sum(self.keyframes)} 个关键帧, {self.bitrate // 1000} kbps")
+
+
+_indexes = {}  # 绝对路径 -> SampleIndex
+_indexes_lock = threading.Lock()
+
+
+def load_index(path: str) -> SampleIndex:
+    """
+    取得文件的索引，同一文件只解析一次 (文件修改时间或大小变化后重新解析)
+
+    Raises:
+        UnsupportedFileError: 不能建立索引
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None or index.mtime != stat.st_mtime or index.file_size != stat.st_size:
+            index = SampleIndex(path)
+            _indexes[path] = index
+        return index
+
+
+class IndexedFeeder:
+    """
+    按索引把 access unit 推入 appsrc (每个 media 一个)
+
+    appsrc 为非 live、TIME 格式，时间戳来自文件，由下游 udpsink 按时钟同步发送。
+    """
+
+    # 每次 need-data 推送的帧数
+    BATCH = 8
+
+    def __init__(self, index: SampleIndex, appsrc: Gst.Element, loop: bool = True,
+                 seekable: bool = False):
+        """
+        Args:
+            index: 文件索引
+            appsrc: media 中的 appsrc
+            loop: 到文件末尾后从头继续 (时间戳连续)
+            seekable: 支持 seek (点播模式，不循环)
+        """
+        self.index = index
+        self.appsrc = appsrc
+        self.loop = loop and not seekable
+        self.position = 0  # 下一个要推送的 sample
+        self.loops = 0  # 已完成的遍数
+        self.shift = 0  # seek 后的时间戳平移 (纳秒)
+        self.seeks = 0
+        self._lock = threading.Lock()
+        appsrc.set_property('caps', index.caps())
+        appsrc.set_property('format', Gst.Format.TIME)
+        appsrc.set_property('is-live', False)
+        appsrc.connect('need-data', self._on_need_data)
+        if seekable:
+            appsrc.set_property('stream-type', 1)  # GST_APP_STREAM_TYPE_SEEKABLE
+            appsrc.set_property('duration', index.duration_ns)
+            appsrc.connect('seek-data', self._on_seek_data)
+
+    def _on_seek_data(self, appsrc, offset) -> bool:
+        """
+        seek 到 offset (纳秒): 从之前最近的关键帧开始推送
+
+        seek 后的 segment 从 offset 开始，关键帧原来的时间戳早于 offset 会被下游按 segment
+        裁掉，所以把之后的时间戳平移到从 offset 开始。
+        """
+        index = self.index
+        with self._lock:
+            if offset >= index.duration_ns:
+                self.position = index.count  # 下次 need-data 发送 EOS
+                return True
+            self.position = index.keyframe_before(offset)
+            self.loops = 0
+            self.shift = max(0, offset - index.to_ns(index.pts[self.position]))
+            self.seeks += 1
+        return True
+
+    def _on_need_data(self, appsrc, length):
+        with self._lock:
+            for _ in range(self.BATCH):
+                if self.position >= self.index.count:
+                    if not self.loop:
+                        appsrc.emit('end-of-stream')
+                        return
+                    self.position = 0
+                    self.loops += 1
+                if appsrc.emit('push-buffer', self._buffer(self.position)) != Gst.FlowReturn.OK:
+                    return
+                self.position += 1
+
+    def _buffer(self, i: int) -> Gst.Buffer:
+        index = self.index
+        base = self.loops * index.duration
+        buf = Gst.Buffer.new_wrapped(index.read(i))
+        buf.pts = index.to_ns(index.pts[i] + base) + self.shift
+        buf.dts = index.to_ns(index.dts[i] + base) + self.shift
+        next_dts = index.dts[i + 1] if i + 1 < index.count else index.duration
+        buf.duration = index.to_ns(next_dts - index.dts[i])
+        if not index.keyframes[i]:
+            buf.set_flags(Gst.BufferFlags.DELTA_UNIT)
+        return buf
+
+
+class FileLibrary:
+    """目录中的视频文件，按挂载名排列"""
+
+    MOUNT_PREFIX = '/files/'
+
+    def __init__(self, directory: str):
+        """
+        Args:
+            directory: 视频目录 (不递归子目录)
+
+        Raises:
+            FileNotFoundError: 目录不存在
+        """
+        self.directory = os.path.abspath(directory)
+        if not os.path.isdir(self.directory):
+            raise FileNotFoundError(f"视频目录不存在: {self.directory}")
+        self.files = {}  # 挂载名 -> 文件路径
+        self.scan()
+
+    @staticmethod
+    def mount_name(filename: str) -> str:
+        """文件名 -> 挂载名 (去掉扩展名，URL 不安全的字符替换为 _)"""
+        stem = os.path.splitext(filename)[0]
+        return re.sub(r'[^A-Za-z0-9_.-]', '_', stem) or '_'
+
+    def scan(self) -> dict:
+        """重新扫描目录，返回 {挂载名: 文件路径}"""
+        files = {}
+        for filename in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, filename)
+            if not os.path.isfile(path) or not filename.lower().endswith(VIDEO_EXTENSIONS):
+                continue
+            name = base = self.mount_name(filename)
+            n = 2
+            while name in files:
+                name = f'{base}_{n}'
+                n += 1
+            files[name] = path
+        self.files = files
+        return files
+
+    def mount(self, name: str) -> str:
+        return self.MOUNT_PREFIX + name
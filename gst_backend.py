@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+GStreamer 编解码后端
+
+启动时查询一次 Gst 注册表，选择 Jetson 硬件元素或软件等价元素:
+
+| 功能       | jetson                         | software                           |
+|------------|--------------------------------|------------------------------------|
+| MJPEG 解码 | nvv4l2decoder mjpeg=1          | jpegdec                            |
+| H.26x 解码 | nvv4l2decoder                  | avdec_h264 / avdec_h265            |
+| 缩放/转换  | nvvidconv                      | videoconvert ! videoscale          |
+| 编码       | nvv4l2h264enc / nvv4l2h265enc  | x264enc / x265enc (zerolatency)    |
+| JPEG 编码  | nvjpegenc                      | jpegenc                            |
+| 内存       | video/x-raw(memory:NVMM)       | video/x-raw                        |
+
+同一份配置可以在 Jetson 和普通 x86 主机 (CI、开发机) 上运行，
+便于在部署前用普通硬件验证 pipeline 拓扑。
+
+所有方法返回 ElementSpec 列表，交给 pipeline_graph.PipelineGraph 构建。
+"""
+
+import gi
+
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from pipeline_graph import ElementSpec, caps, element
+
+
+BACKEND_JETSON = 'jetson'
+BACKEND_SOFTWARE = 'software'
+BACKEND_CHOICES = ['auto', BACKEND_JETSON, BACKEND_SOFTWARE]
+
+
+class Backend:
+    """编解码元素选择"""
+
+    def __init__(self, name: str):
+        """
+        Args:
+            name: jetson 或 software
+        """
+        self.name = name
+        self.hardware = name == BACKEND_JETSON
+
+    @property
+    def raw_caps_prefix(self) -> str:
+        """解码后视频帧所在内存的 caps 前缀"""
+        return 'video/x-raw(memory:NVMM)' if self.hardware else 'video/x-raw'
+
+    @property
+    def raw_format(self) -> str:
+        """编码器输入像素格式"""
+        return 'NV12' if self.hardware else 'I420'
+
+    def raw_caps(self, **fields) -> ElementSpec:
+        """
+        解码后视频的 capsfilter
+
+        Args:
+            fields: width, height, format, framerate (int 表示 N/1) 等
+        """
+        parts = [self.raw_caps_prefix]
+        for key, value in fields.items():
+            if key == 'framerate' and isinstance(value, int):
+                value = f'{value}/1'
+            parts.append(f'{key}={value}')
+        return caps(','.join(parts))
+
+    def jpeg_decoder(self) -> list:
+        """MJPEG 解码"""
+        if self.hardware:
+            return [element('nvv4l2decoder', mjpeg=1)]
+        return [element('jpegdec')]
+
+    def decoder(self, codec: str) -> list:
+        """
+        已 parse 的 H.264/H.265 码流解码
+
+        Args:
+            codec: h264 或 h265
+        """
+        if self.hardware:
+            return [element('nvv4l2decoder')]
+        factory = 'avdec_h265' if codec == 'h265' else 'avdec_h264'
+        if Gst.ElementFactory.find(factory):
+            return [element(factory)]
+        return [element('decodebin')]
+
+    def upload(self) -> list:
+        """系统内存原始帧 (YUYV/NV12) 转为后端处理格式"""
+        if self.hardware:
+            return [element('nvvidconv'), self.raw_caps(format='NV12')]
+        return [element('videoconvert')]
+
+    def scaler(self, width: int, height: int, flip_method: int = 0, format: str = None) -> list:
+        """
+        缩放到输出分辨率
+
+        Args:
+            format: 输出像素格式，None 表示编码器输入格式 (raw_format)
+        """
+        format = format or self.raw_format
+        if self.hardware:
+            props = {'flip_method': flip_method} if flip_method else {}
+            return [element('nvvidconv', **props),
+                    self.raw_caps(width=width, height=height, format=format)]
+        specs = [element('videoconvert')]
+        if flip_method:
+            specs.append(element('videoflip', method=flip_method))
+        specs += [element('videoscale'),
+                  self.raw_caps(width=width, height=height, format=format)]
+        return specs
+
+    def encoder(self, codec: str, bitrate: int, iframeinterval: int = 30,
+                insert_sps_pps: bool = False, maxperf: bool = False, name: str = None) -> list:
+        """
+        视频编码器 (不含 parse)
+
+        Args:
+            codec: h264 或 h265
+            bitrate: 比特率 (bps)
+            iframeinterval: I 帧间隔 (帧)
+            insert_sps_pps: 每个 IDR 前插入 SPS/PPS (仅硬件编码器)
+            maxperf: 启用编码器最高性能模式 (仅硬件编码器)
+            name: 编码器元素名 (用于运行时取回句柄)
+        """
+        named = {'name': name} if name else {}
+        if self.hardware:
+            props = dict(named, bitrate=bitrate, preset_level=1, iframeinterval=iframeinterval)
+            if insert_sps_pps:
+                props['insert_sps_pps'] = True
+            if maxperf:
+                props['maxperf_enable'] = True
+            factory = 'nvv4l2h264enc' if codec == 'h264' else 'nvv4l2h265enc'
+            return [element(factory, **props)]
+
+        # x264enc/x265enc 的 bitrate 单位为 kbps
+        kbps = max(1, bitrate // 1000)
+        if codec == 'h264':
+            return [element('x264enc', bitrate=kbps, speed_preset='ultrafast',
+                            tune='zerolatency', key_int_max=iframeinterval, byte_stream=True, **named)]
+        return [element('x265enc', bitrate=kbps, speed_preset='ultrafast',
+                        tune='zerolatency', key_int_max=iframeinterval, **named)]
+
+    def jpeg_encoder(self, quality: int = 85) -> list:
+        """
+        JPEG 编码 (输入为 scaler(format='I420') 的输出)
+
+        Args:
+            quality: 1-100
+        """
+        if self.hardware and Gst.ElementFactory.find('nvjpegenc'):
+            return [element('nvjpegenc', quality=quality)]
+        if self.hardware:
+            # 没有 nvjpegenc 时拷回系统内存用软件编码
+            return [element('nvvidconv'), caps('video/x-raw,format=I420'), element('jpegenc', quality=quality)]
+        return [element('jpegenc', quality=quality)]
+
+    def set_bitrate(self, encoder: Gst.Element, bitrate: int):
+        """
+        修改运行中编码器的比特率
+
+        Args:
+            encoder: encoder() 创建的编码器元素
+            bitrate: 比特率 (bps)
+        """
+        if self.hardware:
+            encoder.set_property('bitrate', bitrate)
+        else:
+            encoder.set_property('bitrate', max(1, bitrate // 1000))
+
+
+# Jetson 后端依赖的元素，全部存在才选择 jetson
+_JETSON_ELEMENTS = ['nvv4l2decoder', 'nvvidconv', 'nvv4l2h264enc', 'nvv4l2h265enc']
+_SOFTWARE_ELEMENTS = ['jpegdec', 'videoconvert', 'videoscale']
+
+_backend = None
+
+
+def _missing(factories: list) -> list:
+    return [f for f in factories if Gst.ElementFactory.find(f) is None]
+
+
+def select_backend(preference: str = 'auto') -> Backend:
+    """
+    查询 Gst 注册表选择后端 (进程内只查询一次)
+
+    Args:
+        preference: auto / jetson / software
+
+    Returns:
+        Backend
+    """
+    global _backend
+    if _backend is not None and preference in ('auto', _backend.name):
+        return _backend
+
+    Gst.init(None)
+
+    if preference == 'auto':
+        name = BACKEND_JETSON if not _missing(_JETSON_ELEMENTS) else BACKEND_SOFTWARE
+    elif preference in (BACKEND_JETSON, BACKEND_SOFTWARE):
+        name = preference
+    else:
+        raise ValueError(f"不支持的后端: {preference}")
+
+    required = _JETSON_ELEMENTS if name == BACKEND_JETSON else _SOFTWARE_ELEMENTS
+    missing = _missing(required)
+    if missing:
+        print(f"警告: {name} 后端缺少元素: {', '.join(missing)}")
+    if name == BACKEND_SOFTWARE:
+        missing_enc = _missing(['x264enc', 'x265enc'])
+        if missing_enc:
+            print(f"警告: 软件编码器不可用: {', '.join(missing_enc)}")
+
+    _backend = Backend(name)
+    return _backend
+
+
+def get_backend() -> Backend:
+    """返回已选择的后端，尚未选择时自动探测"""
+    return _backend if _backend is not None else select_backend('auto')
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+运行在 GLib 主循环上的轻量 HTTP 服务
+
+与 RTSP 服务器共用同一个 GLib.MainLoop，不额外启动线程，处理函数可以直接
+访问 pipeline 和服务器状态。只支持短连接和小请求体，用于 /metrics 等运维接口。
+
+示例:
+    http = HTTPService(9100)
+    http.route('GET', '/metrics', lambda req: (200, 'text/plain', metrics.render()))
+    http.start()
+"""
+
+import json
+import socket
+from collections import namedtuple
+from urllib.parse import parse_qs, urlsplit
+
+from gi.repository import GLib
+
+
+# 一个 HTTP 请求: query 为 {key: value} (同名参数取最后一个)
+Request = namedtuple('Request', ['method', 'path', 'query', 'headers', 'body', 'params'])
+
+_REASONS = {
+    200: 'OK', 204: 'No Content', 400: 'Bad Request', 404: 'Not Found',
+    405: 'Method Not Allowed', 409: 'Conflict', 413: 'Payload Too Large', 500: 'Internal Server Error',
+    503: 'Service Unavailable',
+}
+
+# 请求头 + 请求体上限
+MAX_REQUEST_BYTES = 64 * 1024
+
+
+def json_response(data, status: int = 200) -> tuple:
+    """处理函数的 JSON 返回值"""
+    return status, 'application/json', json.dumps(data, ensure_ascii=False, indent=2)
+
+
+class HTTPService:
+    """GLib 主循环上的 HTTP 服务"""
+
+    def __init__(self, port: int, host: str = '0.0.0.0'):
+        """
+        Args:
+            port: 监听端口
+            host: 监听地址
+        """
+        self.port = port
+        self.host = host
+        self._routes = []  # [(method, path, handler, prefix)]
+        self._sock = None
+        self._watch_id = None
+
+    def route(self, method: str, path: str, handler, prefix: bool = False):
+        """
+        注册路由
+
+        Args:
+            method: GET / POST / PUT / DELETE
+            path: 路径，如 /metrics
+            handler: handler(Request) -> (status, content_type, body)
+            prefix: True 表示匹配以 path 开头的所有路径，剩余部分按 / 切分放入 Request.params
+        """
+        self._routes.append((method.upper(), path.rstrip('/') or '/', handler, prefix))
+
+    def start(self):
+        """开始监听 (需要 GLib 主循环运行)"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(16)
+        sock.setblocking(False)
+        self._sock = sock
+        self._watch_id = GLib.io_add_watch(sock.fileno(), GLib.PRIORITY_DEFAULT,
+                                           GLib.IO_IN, self._on_accept)
+
+    def stop(self):
+        if self._watch_id is not None:
+            GLib.source_remove(self._watch_id)
+            self._watch_id = None
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _on_accept(self, fd, condition):
+        try:
+            conn, _ = self._sock.accept()
+        except (BlockingIOError, InterruptedError):
+            return True
+        except OSError:
+            return self._sock is not None
+
+        conn.setblocking(False)
+        buf = bytearray()
+
+        def on_readable(fd, condition):
+            try:
+                data = conn.recv(8192)
+            except (BlockingIOError, InterruptedError):
+                return True
+            except OSError:
+                conn.close()
+                return False
+
+            if data:
+                buf.extend(data)
+            try:
+                request = self._parse(buf, complete=not data)
+            except ValueError as e:
+                self._send(conn, 400, 'text/plain', f'bad request: {e}')
+                return False
+            if request is None and data and len(buf) <= MAX_REQUEST_BYTES:
+                return True  # 等待更多数据
+
+            if request is None:
+                response = (413, 'text/plain', 'request too large') if len(buf) > MAX_REQUEST_BYTES \
+                    else (400, 'text/plain', 'bad request')
+            else:
+                response = self._dispatch(request)
+            self._send(conn, *response)
+            return False
+
+        GLib.io_add_watch(conn.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN | GLib.IO_HUP, on_readable)
+        return True
+
+    @staticmethod
+    def _parse(buf: bytearray, complete: bool):
+        """解析请求，数据不完整时返回 None，请求头非法时抛出 ValueError"""
+        head_end = buf.find(b'\r\n\r\n')
+        if head_end < 0:
+            return None
+
+        lines = bytes(buf[:head_end]).decode('latin-1').split('\r\n')
+        try:
+            method, target, _ = lines[0].split(' ', 2)
+        except ValueError:
+            return None
+
+        headers = {}
+        for line in lines[1:]:
+            key, _, value = line.partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get('content-length', 0) or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            raise ValueError(f"invalid Content-Length: {headers['content-length']}")
+        body = bytes(buf[head_end + 4:head_end + 4 + length])
+        if len(body) < length and not complete:
+            return None
+
+        url = urlsplit(target)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        return Request(method.upper(), url.path.rstrip('/') or '/', query, headers, body, [])
+
+    def _dispatch(self, request: Request) -> tuple:
+        path_matched = False
+        for method, path, handler, prefix in self._routes:
+            if prefix:
+                if request.path != path and not request.path.startswith(path.rstrip('/') + '/'):
+                    continue
+                params = [p for p in request.path[len(path):].split('/') if p]
+            elif request.path != path:
+                continue
+            else:
+                params = []
+
+            path_matched = True
+            if method != request.method:
+                continue
+            try:
+                return handler(request._replace(params=params))
+            except Exception as e:
+                print(f"[HTTP] {request.method} {request.path} 处理失败: {e}")
+                return 500, 'text/plain', f'internal error: {e}'
+
+        if path_matched:
+            return 405, 'text/plain', 'method not allowed'
+        return 404, 'text/plain', 'not found'
+
+    @staticmethod
+    def _send(conn, status: int, content_type: str, body):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        head = (f'HTTP/1.1 {status} {_REASONS.get(status, "")}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                f'Connection: close\r\n\r\n').encode('latin-1')
+        try:
+            # 响应很小，直接阻塞发送 (带超时，避免卡住主循环)
+            conn.settimeout(2)
+            conn.sendall(head + body)
+        except OSError:
+            pass
+        finally:
+            conn.close()
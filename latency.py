@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+端到端延迟测量
+
+拉取开启了采集时间戳 (latency_stamp) 的 RTSP 流，从每帧的 SEI 中取出
+采集时刻，与收到该帧 (depay + parse 之后) 的墙上时间相减，按挂载点输出
+p50/p95/p99 延迟。
+
+测量范围: 采集 -> 解码/缩放 -> 编码 -> RTP 打包 -> 网络 -> 客户端 jitterbuffer -> depay，
+不包含客户端解码和显示。跨主机测量要求两端时钟同步 (chrony/NTP/PTP)，
+或用 --clock-offset 补偿已知的时钟差。
+"""
+
+import sys
+import argparse
+import json
+import math
+import threading
+import time
+
+import gi
+
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+from latency_stamp import read_capture_timestamp
+from pipeline_graph import PipelineBuildError, PipelineGraph, caps, element
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    """最近秩百分位数"""
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, math.ceil(p / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+class LatencyProbe:
+    """一个挂载点的延迟采样: rtspsrc -> depay -> parse (Annex B) -> fakesink"""
+
+    def __init__(self, name: str, url: str, codec: str, latency: int = 0, clock_offset_ms: float = 0):
+        """
+        Args:
+            name: 显示名称
+            url: RTSP 地址
+            codec: h264 或 h265
+            latency: rtspsrc jitterbuffer 延迟 (ms)
+            clock_offset_ms: 接收端时钟减去服务器时钟的差值 (ms)，从测量结果中扣除
+        """
+        self.name = name
+        self.url = url
+        self.codec = codec
+        self.latency = latency
+        self.clock_offset_us = int(clock_offset_ms * 1000)
+        self.pipeline = None
+        self.error = None
+        self._lock = threading.Lock()
+        self.samples = []  # 延迟 (ms)
+        self.frames = 0
+        self.unstamped = 0
+        self.recording = False
+
+    def start(self):
+        depay = 'rtph264depay' if self.codec == 'h264' else 'rtph265depay'
+        parse = 'h264parse' if self.codec == 'h264' else 'h265parse'
+        media_type = 'video/x-h264' if self.codec == 'h264' else 'video/x-h265'
+
+        graph = PipelineGraph()
+        graph.chain([
+            element('rtspsrc', location=self.url, latency=self.latency),
+            element(depay),
+            element(parse),
+            caps(f'{media_type},stream-format=byte-stream,alignment=au'),
+            element('fakesink', name='sink', sync=False),
+        ])
+        self.pipeline = graph.build()
+        graph['sink'].get_static_pad('sink').add_probe(Gst.PadProbeType.BUFFER, self._on_frame)
+
+        bus = self.pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect('message::error', self._on_error)
+        self.pipeline.set_state(Gst.State.PLAYING)
+
+    def stop(self):
+        if self.pipeline is not None:
+            self.pipeline.get_bus().remove_signal_watch()
+            self.pipeline.set_state(Gst.State.NULL)
+            self.pipeline = None
+
+    def _on_error(self, bus, message):
+        err, _ = message.parse_error()
+        self.error = err.message
+        print(f"[{self.name}] 错误: {err.message}")
+
+    def _on_frame(self, pad, info):
+        now_us = int(time.time() * 1000000)
+        if not self.recording:
+            return Gst.PadProbeReturn.OK
+
+        buf = info.get_buffer()
+        ok, mapinfo = buf.map(Gst.MapFlags.READ)
+        if not ok:
+            return Gst.PadProbeReturn.OK
+        stamp = read_capture_timestamp(self.codec, bytes(mapinfo.data))
+        buf.unmap(mapinfo)
+
+        with self._lock:
+            self.frames += 1
+            if stamp is None:
+                self.unstamped += 1
+            else:
+                self.samples.append((now_us - self.clock_offset_us - stamp) / 1000.0)
+        return Gst.PadProbeReturn.OK
+
+    def result(self) -> dict:
+        with self._lock:
+            values = sorted(self.samples)
+            frames, unstamped = self.frames, self.unstamped
+        report = {
+            'name': self.name,
+            'url': self.url,
+            'frames': frames,
+            'stamped_frames': len(values),
+            'unstamped_frames': unstamped,
+            'error': self.error,
+        }
+        if values:
+            report.update({
+                'min_ms': round(values[0], 2),
+                'p50_ms': round(percentile(values, 50), 2),
+                'p95_ms': round(percentile(values, 95), 2),
+                'p99_ms': round(percentile(values, 99), 2),
+                'max_ms': round(values[-1], 2),
+                'mean_ms': round(sum(values) / len(values), 2),
+            })
+        return report
+
+
+def targets_from_config(config_path: str, host: str) -> list:
+    """
+    从 multi_res_server / camera_rtsp_server 配置文件生成测量目标
+
+    Returns:
+        [(name, url, codec), ...]
+    """
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+
+    default_port = config.get('port', 8554)
+    targets = []
+    for i, stream in enumerate(config.get('streams', [])):
+        if not stream.get('enable', True):
+            continue
+        port = stream.get('port', default_port)
+        mount = stream.get('mount', f'/stream{i + 1}')
+        targets.append((stream.get('name', f'stream{i}'), f'rtsp://{host}:{port}{mount}',
+                        stream.get('codec', 'h265').lower()))
+    return targets
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="RTSP 端到端延迟测量 (需服务器开启 latency_stamp)",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+服务器端开启采集时间戳:
+  python3 camera_rtsp_server.py --source usb --latency-stamp
+  multi_res_config.json / camera_config.json 中设置 "latency_stamp": true
+
+示例:
+  # 测量单个地址 30 秒
+  python3 latency.py rtsp://192.168.1.2:8554/stream
+
+  # 按配置文件测量所有挂载点，结果写入 JSON
+  python3 latency.py --config multi_res_config.json --host 192.168.1.2 -o latency.json
+
+  # 模拟客户端 jitterbuffer (与播放器的 latency=100 一致)
+  python3 latency.py rtsp://192.168.1.2:8554/stream --latency 100
+
+注意:
+  跨主机测量需要两端时钟同步 (chrony/NTP)，或用 --clock-offset 指定
+  接收端时钟减去服务器时钟的毫秒数
+        """
+    )
+    parser.add_argument("urls", nargs="*", help="RTSP 地址")
+    parser.add_argument("--config", type=str, default=None,
+                        help="服务器配置文件，测量其中所有启用的挂载点")
+    parser.add_argument("--host", default="127.0.0.1", help="配合 --config 使用的服务器地址 (默认: 127.0.0.1)")
+    parser.add_argument("--codec", choices=["h264", "h265"], default="h265",
+                        help="直接指定地址时的编码格式 (默认: h265)")
+    parser.add_argument("--duration", type=float, default=30, help="测量秒数 (默认: 30)")
+    parser.add_argument("--warmup", type=float, default=3, help="开始记录前的预热秒数 (默认: 3)")
+    parser.add_argument("--latency", type=int, default=0, help="rtspsrc jitterbuffer 延迟 ms (默认: 0)")
+    parser.add_argument("--clock-offset", type=float, default=0,
+                        help="接收端时钟减服务器时钟的差值 ms (默认: 0)")
+    parser.add_argument("--output", "-o", default=None, help="JSON 报告路径")
+
+    args = parser.parse_args()
+
+    targets = [(url, url, args.codec) for url in args.urls]
+    try:
+        if args.config:
+            targets += targets_from_config(args.config, args.host)
+    except (OSError, ValueError) as e:
+        print(f"错误: 无法读取配置文件: {e}", file=sys.stderr)
+        sys.exit(1)
+    if not targets:
+        parser.error("需要指定 RTSP 地址或 --config")
+
+    Gst.init(None)
+
+    probes = []
+    for name, url, codec in targets:
+        probe = LatencyProbe(name, url, codec, latency=args.latency, clock_offset_ms=args.clock_offset)
+        try:
+            probe.start()
+        except PipelineBuildError as e:
+            print(f"错误: [{name}] 无法创建 pipeline: {e}", file=sys.stderr)
+            continue
+        probes.append(probe)
+
+    if not probes:
+        sys.exit(1)
+
+    loop = GLib.MainLoop()
+
+    def start_recording():
+        for probe in probes:
+            probe.recording = True
+        print(f"开始记录 ({args.duration:.0f}s)...")
+        GLib.timeout_add(int(args.duration * 1000), loop.quit)
+        return False
+
+    print(f"连接 {len(probes)} 个挂载点，预热 {args.warmup:.0f}s...")
+    GLib.timeout_add(int(args.warmup * 1000), start_recording)
+    try:
+        loop.run()
+    except KeyboardInterrupt:
+        pass
+
+    for probe in probes:
+        probe.stop()
+
+    results = [probe.result() for probe in probes]
+
+    print("=" * 72)
+    print(f"{'挂载点':<28} {'帧数':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  (ms)")
+    print("-" * 72)
+    for r in results:
+        if 'p50_ms' in r:
+            print(f"{r['name'][:28]:<28} {r['stamped_frames']:>6} {r['p50_ms']:>8.1f} "
+                  f"{r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['max_ms']:>8.1f}")
+        elif r['frames']:
+            print(f"{r['name'][:28]:<28} {r['frames']:>6}  未找到时间戳 (服务器未开启 latency_stamp?)")
+        else:
+            print(f"{r['name'][:28]:<28} {0:>6}  未收到数据{': ' + r['error'] if r['error'] else ''}")
+    print("=" * 72)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'clock_offset_ms': args.clock_offset, 'jitterbuffer_ms': args.latency,
+                       'mounts': results}, f, indent=2, ensure_ascii=False)
+        print(f"报告已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+采集时间戳嵌入 (端到端延迟测量)
+
+在采集点记录每帧的墙上时间，编码后以 SEI user_data_unregistered
+(payloadType 5，固定 UUID) 写入该帧所在的 access unit:
+
+    source -> [采集探针: pts -> 墙上时间] -> ... -> enc -> parse -> [写入 SEI] -> pay/tee
+
+接收端 (latency.py) 从码流中取出时间戳，与收到该帧时的墙上时间相减即为
+采集到接收的延迟。跨主机测量需要两端时钟同步 (NTP/PTP)。
+
+SEI 负载: 16 字节 UUID + 8 字节大端整数 (Unix 时间，微秒)
+"""
+
+import struct
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import gi
+
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+
+# 本项目时间戳 SEI 的 UUID
+CAPTURE_TIME_UUID = uuid.uuid5(uuid.NAMESPACE_URL, 'jet_rtsp/capture-time').bytes
+
+_SEI_USER_DATA_UNREGISTERED = 5
+_START_CODE = b'\x00\x00\x00\x01'
+
+
+def _add_emulation_prevention(rbsp: bytes) -> bytes:
+    """RBSP -> NAL 负载: 00 00 后跟 00~03 时插入 03"""
+    out = bytearray()
+    zeros = 0
+    for b in rbsp:
+        if zeros >= 2 and b <= 3:
+            out.append(3)
+            zeros = 0
+        out.append(b)
+        zeros = zeros + 1 if b == 0 else 0
+    return bytes(out)
+
+
+def _remove_emulation_prevention(data: bytes) -> bytes:
+    """NAL 负载 -> RBSP"""
+    out = bytearray()
+    zeros = 0
+    for b in data:
+        if zeros >= 2 and b == 3:
+            zeros = 0
+            continue
+        out.append(b)
+        zeros = zeros + 1 if b == 0 else 0
+    return bytes(out)
+
+
+def build_sei_nal(codec: str, timestamp_us: int) -> bytes:
+    """
+    构建携带时间戳的 SEI NAL 单元 (不含起始码)
+
+    Args:
+        codec: h264 或 h265
+        timestamp_us: Unix 时间 (微秒)
+    """
+    payload = CAPTURE_TIME_UUID + struct.pack('>Q', timestamp_us)
+    rbsp = bytes([_SEI_USER_DATA_UNREGISTERED, len(payload)]) + payload + b'\x80'
+    if codec == 'h264':
+        header = b'\x06'  # nal_unit_type 6 (SEI)
+    else:
+        header = b'\x4e\x01'  # nal_unit_type 39 (PREFIX_SEI), layer 0, tid 1
+    return header + _add_emulation_prevention(rbsp)
+
+
+def _nal_type(codec: str, nal: bytes) -> int:
+    if codec == 'h264':
+        return nal[0] & 0x1F
+    return (nal[0] >> 1) & 0x3F
+
+
+def _is_vcl(codec: str, nal_type: int) -> bool:
+    if codec == 'h264':
+        return 1 <= nal_type <= 5
+    return nal_type < 32
+
+
+def split_annexb(data: bytes) -> list:
+    """
+    拆分 Annex B 字节流
+
+    Returns:
+        [(起始码偏移, NAL 单元), ...]
+    """
+    positions = []
+    i = data.find(b'\x00\x00\x01')
+    while i >= 0:
+        start = i - 1 if i > 0 and data[i - 1] == 0 else i
+        positions.append((start, i + 3))
+        i = data.find(b'\x00\x00\x01', i + 3)
+
+    nals = []
+    for n, (start, begin) in enumerate(positions):
+        end = positions[n + 1][0] if n + 1 < len(positions) else len(data)
+        nals.append((start, data[begin:end]))
+    return nals
+
+
+def split_length_prefixed(data: bytes, length_size: int = 4) -> list:
+    """
+    拆分 avc/hvc1 格式 (长度前缀) 的 access unit
+
+    Returns:
+        [(长度前缀偏移, NAL 单元), ...]
+    """
+    nals = []
+    pos = 0
+    while pos + length_size <= len(data):
+        size = int.from_bytes(data[pos:pos + length_size], 'big')
+        nals.append((pos, data[pos + length_size:pos + length_size + size]))
+        pos += length_size + size
+    return nals
+
+
+def find_capture_timestamps(codec: str, nal: bytes) -> list:
+    """
+    从一个 SEI NAL 单元中取出本项目的时间戳
+
+    Returns:
+        [timestamp_us, ...]
+    """
+    header_size = 1 if codec == 'h264' else 2
+    if len(nal) <= header_size or _nal_type(codec, nal) != (6 if codec == 'h264' else 39):
+        return []
+
+    rbsp = _remove_emulation_prevention(nal[header_size:])
+    result = []
+    pos = 0
+    # 每条 SEI 消息: payloadType, payloadSize (0xFF 续接) + 负载，最后是 rbsp_trailing_bits
+    while pos < len(rbsp) and rbsp[pos] != 0x80:
+        payload_type = 0
+        while pos < len(rbsp) and rbsp[pos] == 0xFF:
+            payload_type += 255
+            pos += 1
+        if pos >= len(rbsp):
+            break
+        payload_type += rbsp[pos]
+        pos += 1
+
+        payload_size = 0
+        while pos < len(rbsp) and rbsp[pos] == 0xFF:
+            payload_size += 255
+            pos += 1
+        if pos >= len(rbsp):
+            break
+        payload_size += rbsp[pos]
+        pos += 1
+
+        payload = rbsp[pos:pos + payload_size]
+        pos += payload_size
+        if payload_type == _SEI_USER_DATA_UNREGISTERED and len(payload) >= 24 \
+                and payload[:16] == CAPTURE_TIME_UUID:
+            result.append(struct.unpack('>Q', payload[16:24])[0])
+    return result
+
+
+def read_capture_timestamp(codec: str, data: bytes):
+    """
+    从一个 Annex B access unit 中读取采集时间戳
+
+    Returns:
+        timestamp_us 或 None
+    """
+    for _, nal in split_annexb(data):
+        if nal and _nal_type(codec, nal) == (6 if codec == 'h264' else 39):
+            stamps = find_capture_timestamps(codec, nal)
+            if stamps:
+                return stamps[0]
+    return None
+
+
+class CaptureStamper:
+    """
+    采集时间戳记录与 SEI 写入
+
+    一个采集点可对应多个编码输出 (多分辨率 tee 扇出)，按 buffer pts 关联。
+    编码器和 parse 会保留 pts，videorate 只丢帧不改 pts。
+    """
+
+    # 保留的采集记录数 (覆盖编码器内部延迟)
+    MAX_PENDING = 256
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._capture_times = OrderedDict()  # pts -> Unix 时间 (微秒)
+        self._local = threading.local()
+
+    def watch_capture(self, pad: Gst.Pad):
+        """在采集点 pad 上记录每帧的墙上时间"""
+        pad.add_probe(Gst.PadProbeType.BUFFER, self._on_capture)
+
+    def stamp_output(self, pad: Gst.Pad, codec: str):
+        """
+        在编码输出 (parse 的 src pad，每个 buffer 一个 access unit) 上写入 SEI
+
+        Args:
+            pad: parse 元素的 src pad
+            codec: h264 或 h265
+        """
+        pad.add_probe(Gst.PadProbeType.BUFFER, self._on_encoded, codec)
+
+    def carry(self, pts: int, new_pts: int):
+        """
+        帧交接到另一条 pipeline 并重新打时间戳时，把采集记录转到新的 pts
+
+        Args:
+            pts: 采集点记录时的 pts
+            new_pts: 交接后的 pts
+        """
+        with self._lock:
+            stamp = self._capture_times.pop(pts, None)
+            if stamp is not None:
+                self._capture_times[new_pts] = stamp
+
+    def _on_capture(self, pad, info):
+        buf = info.get_buffer()
+        if buf.pts == Gst.CLOCK_TIME_NONE:
+            return Gst.PadProbeReturn.OK
+        now_us = int(time.time() * 1000000)
+        with self._lock:
+            self._capture_times[buf.pts] = now_us
+            while len(self._capture_times) > self.MAX_PENDING:
+                self._capture_times.popitem(last=False)
+        return Gst.PadProbeReturn.OK
+
+    def _on_encoded(self, pad, info, codec):
+        if getattr(self._local, 'pushing', False):
+            return Gst.PadProbeReturn.OK  # 自己推送的带 SEI buffer
+
+        buf = info.get_buffer()
+        with self._lock:
+            # 多个编码分支共用同一条记录，不在这里删除，由 MAX_PENDING 淘汰
+            stamp = self._capture_times.get(buf.pts)
+        if stamp is None:
+            return Gst.PadProbeReturn.OK
+
+        ok, mapinfo = buf.map(Gst.MapFlags.READ)
+        if not ok:
+            return Gst.PadProbeReturn.OK
+        data = bytes(mapinfo.data)
+        buf.unmap(mapinfo)
+
+        data = self._insert_sei(pad, codec, data, stamp)
+        if data is None:
+            return Gst.PadProbeReturn.OK
+
+        # 上游 buffer 通常不可写，构造新 buffer 推出并丢弃原 buffer
+        out = Gst.Buffer.new_wrapped(data)
+        out.pts = buf.pts
+        out.dts = buf.dts
+        out.duration = buf.duration
+        out.set_flags(buf.get_flags())
+        self._local.pushing = True
+        try:
+            pad.push(out)
+        finally:
+            self._local.pushing = False
+        return Gst.PadProbeReturn.DROP
+
+    @staticmethod
+    def _insert_sei(pad, codec: str, data: bytes, stamp: int):
+        """在第一个 VCL NAL 之前插入 SEI，返回新的 access unit (无 VCL 时返回 None)"""
+        sei = build_sei_nal(codec, stamp)
+
+        stream_format = 'byte-stream'
+        pad_caps = pad.get_current_caps()
+        if pad_caps is not None and pad_caps.get_size() > 0:
+            stream_format = pad_caps.get_structure(0).get_string('stream-format') or stream_format
+
+        if stream_format == 'byte-stream':
+            nals = split_annexb(data)
+            prefix = _START_CODE
+        else:
+            nals = split_length_prefixed(data)
+            prefix = struct.pack('>I', len(sei))
+
+        for offset, nal in nals:
+            if nal and _is_vcl(codec, _nal_type(codec, nal)):
+                return data[:offset] + prefix + sei + data[offset:]
+        return None
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+上游码流探测
+
+用 GstPbutils.Discoverer 读取 RTSP 源 / 文件的容器、视频编码、分辨率和码率，
+用于判断能否直接透传 (parse ! pay) 而不必解码再编码。
+探测会阻塞到拿到 caps 或超时，应在初始化线程中调用。
+
+本地文件的探测结果按 (路径, 修改时间, 大小) 缓存，同一文件只探测一次。
+"""
+
+import os
+import threading
+from collections import namedtuple
+
+import gi
+
+gi.require_version('Gst', '1.0')
+gi.require_version('GstPbutils', '1.0')
+from gi.repository import Gst, GLib, GstPbutils
+
+
+# 视频流信息 (未知的字段为 None)，container 为 None 表示裸码流或 RTSP 源
+StreamInfo = namedtuple('StreamInfo', ['codec', 'width', 'height', 'framerate', 'bitrate', 'container'])
+StreamInfo.__new__.__defaults__ = (None,)
+
+_CODECS = {
+    'video/x-h264': 'h264',
+    'video/x-h265': 'h265',
+}
+
+_CONTAINERS = {
+    'video/quicktime': 'mp4',
+    'video/x-matroska': 'mkv',
+    'video/webm': 'mkv',
+    'video/mpegts': 'mpegts',
+    'video/x-flv': 'flv',
+    'video/x-msvideo': 'avi',
+}
+
+
+def codec_of(caps: Gst.Caps) -> str:
+    """caps 对应的编码名 (h264/h265)，其他格式返回 caps 名称"""
+    name = caps.get_structure(0).get_name()
+    return _CODECS.get(name, name)
+
+
+def container_of(caps: Gst.Caps) -> str:
+    """容器 caps 对应的容器名 (mp4/mkv/mpegts/flv/avi)，其他格式返回 caps 名称"""
+    name = caps.get_structure(0).get_name()
+    return _CONTAINERS.get(name, name)
+
+
+def probe_uri(uri: str, timeout: int = 5) -> StreamInfo:
+    """
+    探测 URI 的第一路视频流
+
+    Args:
+        uri: rtsp://... 或 file:///...
+        timeout: 超时 (秒)
+
+    Returns:
+        StreamInfo，探测失败或没有视频流时返回 None
+    """
+    Gst.init(None)
+    try:
+        discoverer = GstPbutils.Discoverer.new(timeout * Gst.SECOND)
+        info = discoverer.discover_uri(uri)
+    except GLib.Error as e:
+        print(f"[探测] {uri}: {e.message}")
+        return None
+
+    videos = info.get_video_streams()
+    if not videos:
+        return None
+    video = videos[0]
+    top = info.get_stream_info()
+    container = None
+    if isinstance(top, GstPbutils.DiscovererContainerInfo) and top.get_caps() is not None:
+        container = container_of(top.get_caps())
+    rate_num, rate_den = video.get_framerate_num(), video.get_framerate_denom()
+    bitrate = video.get_bitrate() or video.get_max_bitrate()
+    return StreamInfo(
+        codec=codec_of(video.get_caps()),
+        width=video.get_width() or None,
+        height=video.get_height() or None,
+        framerate=(rate_num / rate_den) if rate_num and rate_den else None,
+        bitrate=bitrate or None,
+        container=container,
+    )
+
+
+_file_cache = {}  # 绝对路径 -> ((mtime, size), StreamInfo)
+_file_cache_lock = threading.Lock()
+
+
+def probe_file(path: str, timeout: int = 5) -> StreamInfo:
+    """
+    探测本地文件的第一路视频流，结果按路径和修改时间缓存 (失败的结果也缓存)
+
+    Returns:
+        StreamInfo，探测失败或没有视频流时返回 None
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = (stat.st_mtime, stat.st_size)
+    with _file_cache_lock:
+        cached = _file_cache.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    info = probe_uri(Gst.filename_to_uri(path), timeout)
+    with _file_cache_lock:
+        _file_cache[path] = (key, info)
+    return info
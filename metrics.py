@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+"""
+运行指标 (Prometheus 文本格式)
+
+ServerMetrics 汇总各服务器的运行状态，由 http_service 在 /metrics 输出:
+  - 每个挂载点的 RTSP 客户端数
+  - 每个编码分支的实际 fps / 比特率 (编码输出 pad 探针)
+  - leaky queue 丢帧计数、丢帧速率、积压 (QueueWatchdog，不开启 /metrics 时也会打印持续丢帧日志)
+  - pipeline / media 状态
+  - 每个客户端 RTCP 接收报告中的丢包和抖动
+
+所有数值在抓取时计算，探针中只做计数。
+"""
+
+import re
+import threading
+import time
+
+import gi
+
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+
+METRIC_PREFIX = 'jet_rtsp'
+
+# 超过该秒数没有 buffer 时速率视为 0
+_STALE_SECONDS = 2.0
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+
+class MetricsRegistry:
+    """指标描述 + 抓取时调用的采集函数"""
+
+    def __init__(self, prefix: str = METRIC_PREFIX):
+        self.prefix = prefix
+        self._meta = {}  # name -> (type, help)
+        self._collectors = []
+
+    def describe(self, name: str, metric_type: str, help_text: str):
+        """登记一个指标 (gauge / counter)"""
+        self._meta[name] = (metric_type, help_text)
+
+    def add_collector(self, collector):
+        """
+        添加采集函数
+
+        Args:
+            collector: 无参函数，返回 [(name, labels dict, value), ...]
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """输出 Prometheus 文本格式"""
+        samples = {}
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                samples.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name, items in samples.items():
+            metric_type, help_text = self._meta.get(name, ('gauge', ''))
+            full = f'{self.prefix}_{name}'
+            lines.append(f'# HELP {full} {help_text}')
+            lines.append(f'# TYPE {full} {metric_type}')
+            for labels, value in items:
+                lines.append(f'{full}{_format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def merge_metrics(texts: dict, label: str = 'worker') -> str:
+    """
+    合并多个进程的 /metrics 输出
+
+    每个样本加上 {label="<进程名>"}，同名指标的 HELP/TYPE 只保留一次，
+    样本按指标分组输出 (Prometheus 要求同一指标的样本连续)
+
+    Args:
+        texts: {进程名: Prometheus 文本}
+    """
+    families = {}  # name -> ([HELP/TYPE 行], [样本行])，保持首次出现的顺序
+    for worker, text in texts.items():
+        current = None
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            if line.startswith('#'):
+                parts = line.split(' ', 3)
+                if len(parts) >= 3 and parts[1] in ('HELP', 'TYPE'):
+                    current = families.setdefault(parts[2], ([], []))
+                    if not any(m.split(' ', 3)[1] == parts[1] for m in current[0]):
+                        current[0].append(line)
+                continue
+
+            name = re.split(r'[{ ]', line, 1)[0]
+            # 没有 HELP/TYPE 的样本单独成组；_sum/_count 等后缀归入当前指标
+            family = families.get(name) or current or families.setdefault(name, ([], []))
+            tag = f'{label}="{_escape(worker)}"'
+            if line[len(name)] == '{':
+                family[1].append(f'{name}{{{tag},{line[len(name) + 1:]}')
+            else:
+                family[1].append(f'{name}{{{tag}}}{line[len(name):]}')
+
+    lines = []
+    for meta, samples in families.values():
+        lines.extend(meta)
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+class FlowMeter:
+    """
+    pad 上的 buffer 速率 (帧/秒、比特率)
+
+    可以先后挂到多个 pad 上 (分支重建后重新 attach)，累计计数不清零
+    """
+
+    def __init__(self, window: float = 1.0):
+        """
+        Args:
+            window: 速率统计窗口 (秒)
+        """
+        self.window = window
+        self.frames_total = 0
+        self.bytes_total = 0
+        self._lock = threading.Lock()
+        self._window_start = None
+        self._window_frames = 0
+        self._window_bytes = 0
+        self._last_buffer = 0.0
+        self._fps = 0.0
+        self._bitrate = 0.0
+
+    def attach(self, pad: Gst.Pad):
+        pad.add_probe(Gst.PadProbeType.BUFFER, self._on_buffer)
+
+    def _on_buffer(self, pad, info):
+        size = info.get_buffer().get_size()
+        now = time.monotonic()
+        with self._lock:
+            self.frames_total += 1
+            self.bytes_total += size
+            self._last_buffer = now
+            if self._window_start is None:
+                self._window_start = now
+            self._window_frames += 1
+            self._window_bytes += size
+            elapsed = now - self._window_start
+            if elapsed >= self.window:
+                self._fps = self._window_frames / elapsed
+                self._bitrate = self._window_bytes * 8 / elapsed
+                self._window_start = now
+                self._window_frames = 0
+                self._window_bytes = 0
+        return Gst.PadProbeReturn.OK
+
+    def _stale(self) -> bool:
+        return time.monotonic() - self._last_buffer > _STALE_SECONDS
+
+    @property
+    def fps(self) -> float:
+        with self._lock:
+            return 0.0 if self._stale() else self._fps
+
+    @property
+    def bitrate(self) -> float:
+        """比特率 (bps)"""
+        with self._lock:
+            return 0.0 if self._stale() else self._bitrate
+
+
+class QueueMeter:
+    """
+    queue 丢帧统计
+
+    丢帧数 = 进入 - 流出 - 当前积压: leaky queue 丢弃的 buffer 进入过 sink pad
+    但不会从 src pad 流出。另外记录 overrun 信号次数 (队列满)。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.overruns = 0
+        self.drop_rate = 0.0  # 最近一个统计周期的丢帧/秒
+        self._lock = threading.Lock()
+        self._queue = None
+        self._in = 0
+        self._out = 0
+        self._base_drops = 0  # 之前挂载的 queue 累计的丢帧
+        self._drops = 0
+        self._sample_drops = 0
+        self._sample_time = None
+
+    def attach(self, queue: Gst.Element):
+        """挂到一个 queue 上 (替换之前的 queue，丢帧累计保留)"""
+        with self._lock:
+            self._base_drops = self._count_drops()
+            self._in = self._out = 0
+            self._drops = self._base_drops
+            self._queue = queue
+        queue.get_static_pad('sink').add_probe(Gst.PadProbeType.BUFFER, self._on_in)
+        queue.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, self._on_out)
+        queue.connect('overrun', self._on_overrun)
+
+    def _on_in(self, pad, info):
+        with self._lock:
+            self._in += 1
+        return Gst.PadProbeReturn.OK
+
+    def _on_out(self, pad, info):
+        with self._lock:
+            self._out += 1
+        return Gst.PadProbeReturn.OK
+
+    def _on_overrun(self, queue):
+        if queue is self._queue:
+            self.overruns += 1
+
+    @property
+    def level(self) -> int:
+        """当前积压的 buffer 数"""
+        queue = self._queue
+        return queue.get_property('current-level-buffers') if queue is not None else 0
+
+    @property
+    def capacity(self) -> int:
+        """max-size-buffers (0 表示不限)"""
+        queue = self._queue
+        return queue.get_property('max-size-buffers') if queue is not None else 0
+
+    @property
+    def fill(self) -> float:
+        """积压比例 0~1 (不限 buffer 数时为 0)"""
+        capacity = self.capacity
+        return self.level / capacity if capacity else 0.0
+
+    def _count_drops(self) -> int:
+        if self._queue is None:
+            return self._drops
+        pending = self._in - self._out - self._queue.get_property('current-level-buffers')
+        # 读取期间可能有 buffer 正在进出，保持单调
+        self._drops = max(self._drops, self._base_drops + max(0, pending))
+        return self._drops
+
+    @property
+    def drops(self) -> int:
+        with self._lock:
+            return self._count_drops()
+
+    def sample(self) -> float:
+        """更新并返回自上次采样以来的丢帧/秒"""
+        now = time.monotonic()
+        drops = self.drops
+        if self._sample_time is not None and now > self._sample_time:
+            self.drop_rate = (drops - self._sample_drops) / (now - self._sample_time)
+        self._sample_time = now
+        self._sample_drops = drops
+        return self.drop_rate
+
+
+class QueueWatchdog:
+    """
+    所有 queue 的丢帧监控
+
+    每秒采样一次各 queue 的丢帧速率，连续丢帧达到 sustained 秒时打印一行日志
+    (指出哪个分支过载)，恢复后再打印一行汇总
+    """
+
+    def __init__(self, interval: int = 1, sustained: int = 5):
+        """
+        Args:
+            interval: 采样间隔 (秒)
+            sustained: 连续丢帧多少秒后报警
+        """
+        self.interval = interval
+        self.sustained = sustained
+        self.meters = {}  # name -> QueueMeter
+        self._dropping = {}  # name -> (连续丢帧秒数, 开始时的丢帧数)
+        self._timer = None
+
+    def watch(self, queue: Gst.Element, name: str = None) -> QueueMeter:
+        """
+        监控一个 queue (同名 queue 重建后累计，unwatch 之后重新计数)
+
+        Args:
+            queue: queue 元素
+            name: 显示名称，默认使用元素名
+        """
+        name = name or queue.get_name()
+        meter = self.meters.get(name)
+        if meter is None:
+            meter = self.meters[name] = QueueMeter(name)
+        meter.attach(queue)
+        if self._timer is None:
+            self._timer = GLib.timeout_add_seconds(self.interval, self._on_tick)
+        return meter
+
+    def unwatch(self, name: str):
+        """停止监控 (分支拆除后调用)，不再采样和导出该 queue"""
+        self.meters.pop(name, None)
+        self._dropping.pop(name, None)
+
+    def _on_tick(self):
+        for name, meter in list(self.meters.items()):
+            rate = meter.sample()
+            # 首次丢帧时回推本周期之前的累计丢帧数
+            seconds, start_drops = self._dropping.get(
+                name, (0, meter.drops - int(round(rate * self.interval))))
+            if rate > 0:
+                seconds += self.interval
+                self._dropping[name] = (seconds, start_drops)
+                if seconds == self.sustained:
+                    print(f"[丢帧] {name}: 持续 {seconds}s 丢帧, {rate:.1f} 帧/秒, "
+                          f"积压 {meter.level}/{meter.capacity or '-'} (下游处理不过来)")
+            elif name in self._dropping:
+                del self._dropping[name]
+                if seconds >= self.sustained:
+                    print(f"[丢帧] {name}: 已恢复, 持续 {seconds}s, "
+                          f"共丢弃 {meter.drops - start_drops} 帧")
+        return True
+
+
+class ClientTracker:
+    """按挂载点统计 RTSP 客户端 (PLAY 之后计入，TEARDOWN 或断开后移除)"""
+
+    _CONTROL_SUFFIX = re.compile(r'/stream=\d+$')
+
+    def __init__(self):
+        self._clients = {}  # client -> {(port, mount), ...}
+
+    def watch_server(self, server, port: int):
+        server.connect('client-connected', self._on_client_connected, port)
+
+    def _on_client_connected(self, server, client, port):
+        self._clients[client] = set()
+        client.connect('play-request', self._on_play, port)
+        client.connect('teardown-request', self._on_teardown, port)
+        client.connect('closed', self._on_closed)
+
+    def _mount(self, ctx) -> str:
+        return self._CONTROL_SUFFIX.sub('', ctx.uri.abspath) if ctx.uri else ''
+
+    def _on_play(self, client, ctx, port):
+        self._clients.setdefault(client, set()).add((port, self._mount(ctx)))
+
+    def _on_teardown(self, client, ctx, port):
+        self._clients.get(client, set()).discard((port, self._mount(ctx)))
+
+    def _on_closed(self, client):
+        self._clients.pop(client, None)
+
+    def counts(self) -> dict:
+        """(port, mount) -> 客户端数"""
+        result = {}
+        # 信号在 RTSP 客户端线程中发出，遍历副本
+        for mounts in list(self._clients.values()):
+            for key in list(mounts):
+                result[key] = result.get(key, 0) + 1
+        return result
+
+    @property
+    def connections(self) -> int:
+        return len(self._clients)
+
+
+def rtcp_client_stats(media) -> list:
+    """
+    从 RTSP media 的 RTP session 中读取各客户端的 RTCP 接收报告
+
+    Returns:
+        [{'client', 'ssrc', 'fraction_lost', 'packets_lost', 'jitter', 'rtt'}, ...]
+        jitter 为 RTP 时间戳单位，rtt 为秒 (客户端还没有回报 DLSR 时为 0)
+    """
+    result = []
+    for i in range(media.n_streams()):
+        session = media.get_stream(i).get_rtpsession()
+        if session is None:
+            continue
+        stats = session.get_property('stats')
+        for source in stats.get_value('source-stats') or []:
+            if source.get_value('internal') or not source.get_value('have-rb'):
+                continue
+            result.append({
+                'client': source.get_value('rtcp-from') or source.get_value('rtp-from') or '',
+                'ssrc': source.get_value('ssrc'),
+                'stream': i,
+                'fraction_lost': source.get_value('rb-fractionlost') / 256.0,
+                'packets_lost': source.get_value('rb-packetslost'),
+                'jitter': source.get_value('rb-jitter'),
+                # rb-round-trip 为 1/65536 秒
+                'rtt': (source.get_value('rb-round-trip') or 0) / 65536.0,
+            })
+    return result
+
+
+class ServerMetrics:
+    """一个服务器进程的全部运行指标"""
+
+    def __init__(self, queues: QueueWatchdog = None):
+        """
+        Args:
+            queues: 服务器的 queue 丢帧监控 (None 表示不输出 queue 指标)
+        """
+        self.registry = MetricsRegistry()
+        self.clients = ClientTracker()
+        self.flows = {}  # branch -> FlowMeter
+        self.queues = queues
+        self._pipelines = {}  # name -> pipeline
+        self._medias = {}  # id -> (mount, media)
+
+        r = self.registry
+        r.describe('rtsp_clients', 'gauge', 'RTSP clients playing each mount')
+        r.describe('rtsp_connections', 'gauge', 'Open RTSP connections')
+        r.describe('branch_fps', 'gauge', 'Frames per second after the encoder')
+        r.describe('branch_bitrate_bps', 'gauge', 'Encoded bitrate in bits per second')
+        r.describe('branch_frames_total', 'counter', 'Encoded frames')
+        r.describe('branch_bytes_total', 'counter', 'Encoded bytes')
+        r.describe('queue_dropped_buffers_total', 'counter', 'Buffers dropped by a leaky queue')
+        r.describe('queue_drop_rate', 'gauge', 'Buffers dropped per second over the last sample interval')
+        r.describe('queue_overruns_total', 'counter', 'Times the queue was full (overrun signal)')
+        r.describe('queue_level_buffers', 'gauge', 'Buffers currently queued')
+        r.describe('queue_fill_ratio', 'gauge', 'Queued buffers / max-size-buffers')
+        r.describe('pipeline_state', 'gauge', 'Current GstState (0 pending, 1 null, 2 ready, 3 paused, 4 playing)')
+        r.describe('media_state', 'gauge', 'Current GstState of each RTSP media pipeline')
+        r.describe('rtcp_fraction_lost', 'gauge', 'Fraction lost from the last RTCP receiver report')
+        r.describe('rtcp_packets_lost', 'gauge', 'Cumulative packets lost from RTCP receiver reports')
+        r.describe('rtcp_jitter', 'gauge', 'Interarrival jitter from RTCP receiver reports (RTP clock units)')
+        r.add_collector(self._collect)
+
+    # ------------------------------------------------------------------
+    # 注册
+    # ------------------------------------------------------------------
+
+    def watch_server(self, server, port: int):
+        """统计 RTSPServer 上各挂载点的客户端"""
+        self.clients.watch_server(server, port)
+
+    def watch_flow(self, branch: str, pad: Gst.Pad) -> FlowMeter:
+        """在编码输出 pad 上统计 fps/比特率 (同名分支重建后累计)"""
+        meter = self.flows.setdefault(branch, FlowMeter())
+        meter.attach(pad)
+        return meter
+
+    def watch_pipeline(self, name: str, pipeline: Gst.Element):
+        """跟踪 pipeline 状态，pipeline 为 None 表示移除"""
+        if pipeline is None:
+            self._pipelines.pop(name, None)
+        else:
+            self._pipelines[name] = pipeline
+
+    def watch_media(self, mount: str, media):
+        """跟踪 RTSP media 的状态和 RTCP 统计，media 释放后自动移除"""
+        key = id(media)
+        self._medias[key] = (mount, media)
+        media.connect('unprepared', lambda m: self._medias.pop(key, None))
+
+    def render(self) -> str:
+        return self.registry.render()
+
+    def handle(self, request) -> tuple:
+        """HTTP /metrics 处理函数"""
+        return 200, 'text/plain; version=0.0.4', self.render()
+
+    # ------------------------------------------------------------------
+    # 采集
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _state(element) -> int:
+        _, state, _ = element.get_state(0)
+        return int(state)
+
+    def _collect(self) -> list:
+        samples = []
+        for (port, mount), count in sorted(self.clients.counts().items()):
+            samples.append(('rtsp_clients', {'port': port, 'mount': mount}, count))
+        samples.append(('rtsp_connections', {}, self.clients.connections))
+
+        for branch, meter in sorted(self.flows.items()):
+            labels = {'branch': branch}
+            samples.append(('branch_fps', labels, round(meter.fps, 2)))
+            samples.append(('branch_bitrate_bps', labels, int(meter.bitrate)))
+            samples.append(('branch_frames_total', labels, meter.frames_total))
+            samples.append(('branch_bytes_total', labels, meter.bytes_total))
+
+        if self.queues:
+            for name, meter in sorted(self.queues.meters.items()):
+                labels = {'queue': name}
+                samples.append(('queue_dropped_buffers_total', labels, meter.drops))
+                samples.append(('queue_drop_rate', labels, round(meter.drop_rate, 2)))
+                samples.append(('queue_overruns_total', labels, meter.overruns))
+                samples.append(('queue_level_buffers', labels, meter.level))
+                samples.append(('queue_fill_ratio', labels, round(meter.fill, 3)))
+
+        for name, pipeline in sorted(self._pipelines.items()):
+            samples.append(('pipeline_state', {'pipeline': name}, self._state(pipeline)))
+
+        for mount, media in list(self._medias.values()):
+            if media.get_element() is None:
+                continue
+            samples.append(('media_state', {'mount': mount}, self._state(media.get_element())))
+            for rb in rtcp_client_stats(media):
+                labels = {'mount': mount, 'client': rb['client'], 'ssrc': rb['ssrc']}
+                samples.append(('rtcp_fraction_lost', labels, round(rb['fraction_lost'], 4)))
+                samples.append(('rtcp_packets_lost', labels, rb['packets_lost']))
+                samples.append(('rtcp_jitter', labels, rb['jitter']))
+        return samples
+
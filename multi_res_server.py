@@ -4,18 +4,22 @@ Jetson 多分辨率 RTSP 服务器
 一路摄像头输出多个不同分辨率的 H.265 RTSP 流，每个分辨率使用独立端口
 使用 GStreamer tee 元素实现真正的单源多流
 
-优化架构 (相同分辨率共享编码器):
-                      +-> nvvidconv (1080p) -> encoder -> tee_0 -> rtph265pay -> udpsink :15000 (stream0)
-                      |                                       |-> rtph265pay -> udpsink :15001 (stream1)
-                      |                                       +-> rtph265pay -> udpsink :15002 (stream2)
+优化架构 (两级扇出: 每个分辨率一个缩放器，每个编码参数一个编码器):
+                                            +-> encoder (16M@20) -> tee_0 -> appsink_0 ==> appsrc (stream1)
+                                            |                                          +==> appsrc (stream2)
+                      +-> nvvidconv (1080p) -> stee_0
+                      |                     +-> encoder (4M@30)  -> tee_1 -> appsink_1 ==> appsrc (stream0)
 v4l2src -> decode -> tee
                       |
-                      +-> nvvidconv (720p) -> encoder -> tee_1 -> rtph265pay -> udpsink :15003 (stream3)
-                                                             +-> rtph265pay -> udpsink :15004 (stream4)
+                      +-> nvvidconv (720p)  -> stee_1 -> encoder -> tee_2 -> appsink_2 ==> appsrc (stream3)
+                                                                                       +==> appsrc (stream4)
 
-优势: 13路输出只需要 4 个编码器 (按分辨率分组)，大幅降低 CPU/NVENC 负载
+优势: 编码参数 (codec, bitrate, framerate) 完全相同的流共享编码器，
+      同分辨率的编码器共享缩放器，只为实际配置的编码付出 NVENC 负载
 
-RTSP Server: udpsrc -> rtph265depay -> rtph265pay -> client
+RTSP Server: appsrc -> rtph265pay -> client
+编码后的 H.265 buffer 在进程内直接交给各挂载点 (==>)，不再经过 localhost UDP，
+只打包一次 RTP，也不占用固定的内部端口
 """
 
 import sys
@@ -23,6 +27,9 @@ import os
 import argparse
 import json
 import ctypes
+import threading
+import time
+from urllib.parse import quote
 
 # 抑制 GStreamer CRITICAL 警告 (gst_buffer_resize_range)
 os.environ['GST_DEBUG'] = '0'
@@ -53,21 +60,243 @@ import gi
 
 gi.require_version('Gst', '1.0')
 gi.require_version('GstRtspServer', '1.0')
-from gi.repository import Gst, GstRtspServer, GLib
+gi.require_version('GstVideo', '1.0')
+from gi.repository import Gst, GstRtspServer, GstVideo, GLib
+
+from adaptive_bitrate import AdaptiveBitrateController, abr_settings
+from control_api import ControlAPI, ControlError, control_port
+from config_reload import ConfigWatcher, diff_keyed
+from encode_plan import compile_plan
+from gst_backend import BACKEND_CHOICES, select_backend
+from http_service import HTTPService
+from latency_stamp import CaptureStamper
+from metrics import QueueWatchdog, ServerMetrics
+from pipeline_graph import (GraphMediaFactory, PipelineBuildError, PipelineGraph,
+                            caps, element)
+from recorder import SegmentRecorder, describe_record, record_settings, watch_recorders
+from rtsp_service import RTSPService, configure_multicast, describe_multicast, multicast_settings
+from snapshot import SnapshotService, SnapshotTap, describe_snapshot, snapshot_settings
+
+
+class EncodedStreamRelay:
+    """
+    编码分支到 RTSP 挂载点的进程内转发
+
+    主 pipeline 中每个编码分支末尾是一个 appsink，RTSP media 中是 appsrc。
+    appsink 收到的 buffer 只做浅拷贝 (共享内存，不复制码流数据) 后推给所有
+    已连接的 appsrc，时间戳由 appsrc 按自己 pipeline 的时钟重新打上。
+
+    GOP 缓存: 保留最近一个 IDR 及其后的所有帧。新的 media (挂载点的第一个客户端)
+    注册时立即推送整个缓存，不必等下一个 IDR；缓存为空 (刚启动、超出上限) 时
+    向编码器发送 force-key-unit。已在播放的共享 media 上新加入的客户端同样请求关键帧。
+    这样 GOP 可以设得较长 (60~120 帧) 以节省码率，客户端仍能立即开始播放。
+    """
+
+    # appsrc 内部积压超过该字节数时丢弃新 buffer，避免慢客户端拖住编码分支
+    MAX_QUEUED_BYTES = 4 * 1024 * 1024
+    # GOP 缓存上限 (字节)，超过时丢弃缓存直到下一个 IDR
+    MAX_GOP_BYTES = 16 * 1024 * 1024
+    # 两次 force-key-unit 请求的最小间隔 (秒)，多个客户端同时加入时只请求一次
+    KEYFRAME_REQUEST_INTERVAL = 1.0
+
+    # request_keyframe() 的结果
+    KEYFRAME_SENT = 'sent'  # 已发往编码器
+    KEYFRAME_RATE_LIMITED = 'rate_limited'  # KEYFRAME_REQUEST_INTERVAL 内已请求过
+    KEYFRAME_REJECTED = 'rejected'  # 上游没有处理该事件
+    KEYFRAME_DETACHED = 'detached'  # 编码分支未运行
+
+    def __init__(self, name: str, gop_cache: bool = True):
+        """
+        Args:
+            name: 分支名称 (用于日志)
+            gop_cache: 是否缓存最近的 GOP
+        """
+        self.name = name
+        self.gop_cache = gop_cache
+        self._lock = threading.Lock()
+        self._appsrcs = {}  # appsrc -> 已设置的 caps
+        self._appsink = None
+        self._sample_handler = None  # appsink new-sample 信号的 handler id
+        self._caps = None  # 最近的码流 caps
+        self._gop = None  # 最近一个 IDR 起的 buffer 列表，None 表示等待 IDR
+        self._gop_bytes = 0
+        self._flushed_at = {}  # appsrc -> 推送 GOP 缓存的时间
+        self._keyframe_requested_at = 0
+        self.cache_starts = 0  # 由 GOP 缓存立即起播的 media 数
+        self.keyframe_requests = 0  # 发出的 force-key-unit 请求数
+        self.keyframe_rejections = 0  # 上游未处理的请求数
+
+    def attach_appsink(self, appsink):
+        """连接主 pipeline 中编码分支末尾的 appsink (分支重建后缓存作废)"""
+        self.detach()
+        with self._lock:
+            self._appsink = appsink
+            self._gop = None
+            self._gop_bytes = 0
+            self._sample_handler = appsink.connect("new-sample", self._on_new_sample)
+
+    def detach(self):
+        """编码分支拆除: 断开 appsink 并丢弃 GOP 缓存 (之后注册的 appsrc 等分支重建后的新码流)"""
+        with self._lock:
+            appsink, handler = self._appsink, self._sample_handler
+            self._appsink = None
+            self._sample_handler = None
+            self._gop = None
+            self._gop_bytes = 0
+        if appsink is not None and handler is not None:
+            appsink.disconnect(handler)
+
+    def add_appsrc(self, appsrc) -> int:
+        """
+        注册一个 RTSP media 的 appsrc，先推送 GOP 缓存
+
+        Returns:
+            推送的缓存帧数 (0 表示缓存为空，已请求关键帧)
+        """
+        with self._lock:
+            cached = list(self._gop or []) if self.gop_cache else []
+            caps = self._caps if cached else None
+            if cached:
+                # 在锁内推送: 保证缓存帧在之后的实时帧之前，且不重复
+                appsrc.set_property("caps", caps)
+                for buf in cached:
+                    appsrc.emit("push-buffer", self._retimed(buf))
+                self._flushed_at[appsrc] = time.monotonic()
+                self.cache_starts += 1
+            self._appsrcs[appsrc] = caps
+        if not cached:
+            self.request_keyframe()
+        return len(cached)
+
+    def remove_appsrc(self, appsrc):
+        """注销 RTSP media 的 appsrc"""
+        with self._lock:
+            self._appsrcs.pop(appsrc, None)
+            self._flushed_at.pop(appsrc, None)
+
+    def on_client_play(self, appsrc):
+        """
+        有客户端开始播放该 appsrc 所在的 media
+
+        刚推送过 GOP 缓存的 media (第一个客户端) 不需要关键帧；
+        已在播放的共享 media 上新加入的客户端请求一个关键帧
+        """
+        with self._lock:
+            flushed_at = self._flushed_at.pop(appsrc, None)
+        if flushed_at is None or time.monotonic() - flushed_at > self.KEYFRAME_REQUEST_INTERVAL:
+            self.request_keyframe()
+
+    def request_keyframe(self) -> str:
+        """
+        向编码器发送 upstream force-key-unit (限制频率，可在任意线程调用)
+
+        事件从 appsink 的 sink pad 向上游推送 (push_event)，经 queue、tee_N、parse 到达编码器
+
+        Returns:
+            KEYFRAME_SENT / KEYFRAME_RATE_LIMITED / KEYFRAME_REJECTED / KEYFRAME_DETACHED
+        """
+        now = time.monotonic()
+        with self._lock:
+            appsink = self._appsink
+            if appsink is None:
+                return self.KEYFRAME_DETACHED
+            if now - self._keyframe_requested_at < self.KEYFRAME_REQUEST_INTERVAL:
+                return self.KEYFRAME_RATE_LIMITED
+            self._keyframe_requested_at = now
+            self.keyframe_requests += 1
+        event = GstVideo.video_event_new_upstream_force_key_unit(Gst.CLOCK_TIME_NONE, True, 0)
+        if appsink.get_static_pad("sink").push_event(event):
+            return self.KEYFRAME_SENT
+        with self._lock:
+            self.keyframe_rejections += 1
+            # 没有送达，下次请求不受频率限制
+            self._keyframe_requested_at = 0
+        print(f"[GOP 缓存] {self.name}: 警告: force-key-unit 未被上游处理")
+        return self.KEYFRAME_REJECTED
+
+    @property
+    def consumer_count(self) -> int:
+        """当前连接的 appsrc 数量"""
+        with self._lock:
+            return len(self._appsrcs)
+
+    @property
+    def cached_frames(self) -> int:
+        """GOP 缓存中的帧数"""
+        with self._lock:
+            return len(self._gop or [])
+
+    @staticmethod
+    def _retimed(buf: Gst.Buffer) -> Gst.Buffer:
+        # 浅拷贝: 只复制 buffer 元数据，码流内存共享
+        out = buf.copy()
+        out.pts = Gst.CLOCK_TIME_NONE
+        out.dts = Gst.CLOCK_TIME_NONE
+        return out
+
+    def _cache(self, buf: Gst.Buffer):
+        """更新 GOP 缓存 (持有 _lock)"""
+        if not self.gop_cache:
+            return
+        if not buf.has_flags(Gst.BufferFlags.DELTA_UNIT):
+            self._gop = [buf]
+            self._gop_bytes = buf.get_size()
+        elif self._gop is not None:
+            self._gop.append(buf)
+            self._gop_bytes += buf.get_size()
+            if self._gop_bytes > self.MAX_GOP_BYTES:
+                self._gop = None
+                self._gop_bytes = 0
+
+    def _on_new_sample(self, appsink):
+        """appsink 回调 (streaming 线程)"""
+        sample = appsink.emit("pull-sample")
+        if sample is None:
+            return Gst.FlowReturn.OK
+
+        buf = sample.get_buffer()
+        caps = sample.get_caps()
+
+        with self._lock:
+            if appsink is not self._appsink:
+                return Gst.FlowReturn.OK  # 已拆除的分支上还在途的 buffer
+            self._caps = caps
+            self._cache(buf)
+            targets = list(self._appsrcs.items())
+
+        for appsrc, current_caps in targets:
+            if current_caps is None or not current_caps.is_equal(caps):
+                appsrc.set_property("caps", caps)
+                with self._lock:
+                    if appsrc in self._appsrcs:
+                        self._appsrcs[appsrc] = caps
+
+            if appsrc.get_property("current-level-bytes") >= self.MAX_QUEUED_BYTES:
+                continue
+
+            appsrc.emit("push-buffer", self._retimed(buf))
+
+        return Gst.FlowReturn.OK
 
 
 class MultiResolutionRTSPServer:
     """多分辨率 RTSP 服务器 - 真正的单源多流"""
 
-    def __init__(self, config_path: str):
+    def __init__(self, config_path: str, backend: str = None, metrics_port: int = None,
+                 single_port: int = None, client_threads: int = None):
         """
         初始化服务器
 
         Args:
             config_path: 配置文件路径
+            backend: 编解码后端 (auto/jetson/software)，None 表示使用配置文件中的 backend
+            metrics_port: /metrics HTTP 端口，None 表示使用配置文件中的 metrics_port (默认不启用)
+            single_port: 所有挂载点合并到该监听端口，None 表示使用配置文件中的 single_port (默认不合并)
+            client_threads: 每个监听端口处理客户端请求的线程数，None 表示使用配置文件中的 rtsp_client_threads
         """
         Gst.init(None)
 
+        self.config_path = config_path
         with open(config_path, 'r', encoding='utf-8') as f:
             self.config = json.load(f)
 
@@ -78,72 +307,426 @@ class MultiResolutionRTSPServer:
         if not self.stream_configs:
             raise ValueError("没有启用任何输出流")
 
+        self.backend = select_backend(backend or self.config.get('backend', 'auto'))
+
         self.main_pipeline = None
-        self.servers = {}  # port -> RTSPServer
         self.loop = None
-        self.client_count = 0  # 当前连接的客户端数量
-        self.pipeline_str = None  # 缓存的 pipeline 字符串
-
-        # UDP 基础端口（内部使用，用于 pipeline 到 RTSP 的连接）
-        self.udp_base_port = 15000
-
-    def _start_pipeline(self):
-        """启动主 pipeline"""
+        self.main_graph = None  # 主 pipeline 的 PipelineGraph (保留所有元素句柄)
+        self.encoder_elements = {}  # encoder_idx -> 运行中的编码器元素 (用于运行时调整参数)
+
+        # 扇出规划: 每个分辨率一个缩放器，每个编码参数一个编码器
+        self.plan = compile_plan(self.stream_configs,
+                                 input_framerate=self.camera_config.get('framerate', 30),
+                                 default_gop=self.config.get('gop', 60))
+
+        # 编码分支 -> RTSP 挂载点的进程内转发 (GOP 缓存让新客户端不必等下一个 IDR)
+        self.gop_cache = self.config.get('gop_cache', True)
+        self.relays = {enc.index: EncodedStreamRelay(f'tee_{enc.index}', self.gop_cache)
+                       for enc in self.plan.encoders}
+        self.media_relays = {}  # RTSP media -> (EncodedStreamRelay, appsrc)
+
+        # 按需编码: 每个编码器独立启停，缩放器随其下第一个/最后一个编码器启停
+        self.on_demand_grace = self.config.get('on_demand_grace', 5)  # 最后一个客户端断开后的保留秒数
+        self.encoder_clients = {enc.index: 0 for enc in self.plan.encoders}  # 当前活动的 RTSP media 数量
+        self.encoder_branches = {}  # encoder_idx -> (branch bin, tee request pad, EncoderNode)
+        self.scaler_branches = {}  # scaler_idx -> (branch bin, tee request pad)
+        self.release_timers = {}  # encoder_idx -> GLib timeout id
+
+        # 采集时间戳 SEI (端到端延迟测量)
+        self.stamper = CaptureStamper() if self.config.get('latency_stamp', False) else None
+
+        # 运行指标 (/metrics)
+        self.metrics_port = metrics_port or self.config.get('metrics_port')
+        self.queues = QueueWatchdog()  # 各分支 queue 丢帧监控 (持续丢帧时打印日志)
+        self.metrics = ServerMetrics(self.queues) if self.metrics_port else None
+
+        # RTSP 监听: 每个端口一个 RTSPServer 或合并到单个端口，各自独立的线程
+        self.rtsp = RTSPService.from_config(self.config, single_port, client_threads, self.metrics)
+        self.rtsp.on_play(self._on_client_play)
+
+        # RTCP 驱动的自适应码率 (按编码分支调节，配置的码率为上限)
+        self.abr_settings = abr_settings(self.config.get('adaptive_bitrate'))
+        self.abr = AdaptiveBitrateController(self.backend, metrics=self.metrics)
+
+        # 分段录像: 从 tee_N 分出录像支路，录像的编码分支在按需模式下也常驻
+        self.recorders = {}  # 流名称 -> (SegmentRecorder, encoder_idx)
+        self.record_branches = {}  # 流名称 -> (SegmentRecorder, branch bin, tee request pad, encoder_idx)
+        self.recorders = self._plan_recorders()
+        self.finishing_recorders = 0  # 已发送 EOS、最后一段还在封装的录像支路数
+        self.rebuilding_source = False  # 相机配置变化，等待录像支路收尾后重建源 pipeline
+        self.deferred_reload = None  # 重建期间收到的配置，重建完成后应用
+        if self.metrics:
+            watch_recorders(self.metrics, lambda: [r for r, _ in self.recorders.values()])
+
+        # JPEG 快照: 主 tee 上的低频取帧支路，所有输出流共用 (源 pipeline 在按需模式下也常驻)
+        settings = snapshot_settings(self.config.get('snapshot'))
+        self.snapshot = SnapshotTap(self.backend, settings) if settings else None
+        self.snapshots = SnapshotService()
+        self._register_snapshots()
+
+        # 控制接口 (/api) 的运行时修改: encoder_idx -> kbps / fps，编码分支重建时沿用，不写回配置文件
+        self.bitrate_overrides = {}
+        self.framerate_overrides = {}
+
+    @property
+    def _tag(self) -> str:
+        """分支启停日志的前缀"""
+        return '[按需启动]' if self.on_demand else '[分支]'
+
+    def _start_pipeline(self) -> bool:
+        """启动主 pipeline (只包含源部分，缩放器和编码器分支由 _activate_encoder 挂载)"""
         if self.main_pipeline is not None:
-            return  # 已经在运行
+            return True  # 已经在运行
 
-        print("\n[按需启动] 启动编码 pipeline...")
+        print(f"\n{self._tag} 启动源 pipeline...")
         try:
-            self.main_pipeline = Gst.parse_launch(self.pipeline_str)
+            self.main_graph = self._build_main_graph()
+            self.main_pipeline = self.main_graph.build()
+            if self.snapshot:
+                self.snapshot.attach(self.main_graph)
+            self._instrument_source()
             bus = self.main_pipeline.get_bus()
             bus.add_signal_watch()
             bus.connect("message", self._on_bus_message)
             ret = self.main_pipeline.set_state(Gst.State.PLAYING)
             if ret == Gst.StateChangeReturn.FAILURE:
-                print("[按需启动] 错误: 无法启动 pipeline")
+                print(f"{self._tag} 错误: 无法启动 pipeline")
+                self.main_pipeline.set_state(Gst.State.NULL)
                 self.main_pipeline = None
-            else:
-                print("[按需启动] Pipeline 已启动")
-        except GLib.Error as e:
-            print(f"[按需启动] 错误: {e.message}")
+                return False
+            print(f"{self._tag} Pipeline 已启动")
+            return True
+        except PipelineBuildError as e:
+            print(f"{self._tag} 错误: {e}")
             self.main_pipeline = None
+            return False
 
     def _stop_pipeline(self):
         """停止主 pipeline"""
         if self.main_pipeline is None:
             return  # 没有在运行
 
-        print("\n[按需启动] 停止编码 pipeline...")
+        print(f"\n{self._tag} 停止源 pipeline...")
+        self.main_pipeline.get_bus().remove_signal_watch()
         self.main_pipeline.set_state(Gst.State.NULL)
         self.main_pipeline = None
-        print("[按需启动] Pipeline 已停止")
+        self.main_graph = None
+        if self.metrics:
+            self.metrics.watch_pipeline('main', None)
+        print(f"{self._tag} Pipeline 已停止")
 
-    def _on_client_connected(self, client, media):
-        """客户端连接回调"""
-        self.client_count += 1
-        print(f"\n[客户端] 连接 (当前: {self.client_count})")
-        if self.on_demand and self.client_count == 1:
-            self._start_pipeline()
+    def _attach_branch(self, tee, graph: PipelineGraph, prepare=None):
+        """
+        把一个分支图构建为子 bin 挂到 tee 的新 request pad 上
+
+        Args:
+            prepare: 可选，元素创建后、状态切换前调用 prepare(graph)
+
+        Returns:
+            (branch bin, tee request pad)
+        """
+        branch = graph.build_bin()
+        if prepare:
+            prepare(graph)
+        self.main_pipeline.add(branch)
+        branch.sync_state_with_parent()
+
+        tee_pad = tee.get_request_pad('src_%u')
+        tee_pad.link(branch.get_static_pad('sink'))
+        return branch, tee_pad
 
-    def _on_client_disconnected(self, client):
-        """客户端断开回调"""
-        self.client_count = max(0, self.client_count - 1)
-        print(f"\n[客户端] 断开 (当前: {self.client_count})")
-        if self.on_demand and self.client_count == 0:
-            # 延迟停止，避免频繁启停
-            GLib.timeout_add_seconds(5, self._check_and_stop_pipeline)
-
-    def _check_and_stop_pipeline(self):
-        """检查并停止 pipeline（延迟执行）"""
-        if self.client_count == 0:
-            self._stop_pipeline()
+    def _detach_branch(self, branch, tee_pad, on_done=None):
+        """
+        在 tee pad 空闲时断开子 bin，随后在主循环中置为 NULL 并移除
+
+        Args:
+            on_done: 移除完成后在主循环中调用
+        """
+        tee = tee_pad.get_parent_element()
+        pipeline = self.main_pipeline
+
+        def finalize():
+            branch.set_state(Gst.State.NULL)
+            pipeline.remove(branch)
+            if on_done:
+                on_done()
+            return False
+
+        def on_pad_idle(pad, info):
+            pad.unlink(branch.get_static_pad('sink'))
+            tee.release_request_pad(pad)
+            GLib.idle_add(finalize)
+            return Gst.PadProbeReturn.REMOVE
+
+        tee_pad.add_probe(Gst.PadProbeType.IDLE, on_pad_idle)
+
+    def _activate_encoder(self, encoder_idx: int):
+        """
+        启动一个编码器分支
+
+        需要时先启动源 pipeline 和对应分辨率的缩放器，再挂上
+        编码 -> tee_N -> appsink 子 bin
+        """
+        timer = self.release_timers.pop(encoder_idx, None)
+        if timer is not None:
+            GLib.source_remove(timer)
+
+        if encoder_idx in self.encoder_branches:
+            return  # 已经在运行
+
+        if not self._start_pipeline():
+            return
+
+        encoder = self.plan.encoder(encoder_idx)
+        scaler = encoder.scaler
+        try:
+            if scaler.index not in self.scaler_branches:
+                scaler_graph = PipelineGraph()
+                self._add_scaler_branch(scaler_graph, scaler.index)
+                self.scaler_branches[scaler.index] = self._attach_branch(
+                    self.main_graph['t'], scaler_graph)
+                self._instrument_scaler_branch(scaler_graph, scaler.index)
+                print(f"{self._tag} 缩放器 {scaler.width}x{scaler.height} 已启动")
+
+            scaler_bin = self.scaler_branches[scaler.index][0]
+            encoder_graph = PipelineGraph()
+            self._add_encoder_branch(encoder_graph, encoder_idx)
+            branch, tee_pad = self._attach_branch(
+                scaler_bin.get_by_name(f'stee_{scaler.index}'), encoder_graph)
+        except PipelineBuildError as e:
+            print(f"{self._tag} 错误: 无法创建编码分支 tee_{encoder_idx}: {e}")
+            return
+
+        self.relays[encoder_idx].attach_appsink(encoder_graph[f'appsink_{encoder_idx}'])
+        self.encoder_elements[encoder_idx] = encoder_graph[f'enc_{encoder_idx}']
+        self.encoder_branches[encoder_idx] = (branch, tee_pad, encoder)
+        self._instrument_encoder_branch(encoder_graph, encoder_idx)
+        self._watch_bitrate(encoder_idx)
+
+        print(f"{self._tag} 编码分支 tee_{encoder_idx} ({', '.join(encoder.stream_names)}) 已启动")
+        for name, (_, idx) in self.recorders.items():
+            if idx == encoder_idx:
+                self._start_recorder(name)
+
+    def _release_encoder(self, encoder_idx: int):
+        """释放一个没有客户端的编码器分支 (按需模式宽限期到期后执行)"""
+        self.release_timers.pop(encoder_idx, None)
+        if self.encoder_clients.get(encoder_idx, 0) == 0 and encoder_idx not in self._recording_encoders():
+            self._teardown_encoder(encoder_idx)
         return False  # 不重复执行
 
-    def _build_main_pipeline(self) -> str:
+    def _teardown_encoder(self, encoder_idx: int):
         """
-        构建主 pipeline 字符串 (优化版：相同分辨率共享编码器)
+        拆除一个编码器分支
 
-        摄像头 -> 解码 -> tee -> 多个分支 (缩放 -> 编码 -> tee2 -> 多个 UDP)
+        编码器全部拆除的缩放器随之释放，没有任何分支时停止源 pipeline，
+        其他编码器不受影响
+        """
+        if encoder_idx not in self.encoder_branches:
+            return
+
+        # 分支记录的是启动时的规划节点，热加载后该编码器可能已不在当前规划中
+        branch, tee_pad, encoder = self.encoder_branches.pop(encoder_idx)
+        scaler = encoder.scaler
+        self.encoder_elements.pop(encoder_idx, None)
+        self._uninstrument_encoder_branch(encoder_idx)
+        self.relays[encoder_idx].detach()
+        self.abr.remove_branch(f'tee_{encoder_idx}')
+        pipeline = self.main_pipeline
+
+        def on_scaler_released():
+            print(f"{self._tag} 缩放器 {scaler.width}x{scaler.height} 已释放")
+            if not self.scaler_branches and pipeline is self.main_pipeline and not self.snapshot:
+                self._stop_pipeline()
+
+        def on_encoder_released():
+            print(f"{self._tag} 编码分支 tee_{encoder_idx} ({', '.join(encoder.stream_names)}) 已释放")
+            if scaler.index in self.scaler_branches and \
+                    not any(enc.scaler.index == scaler.index for _, _, enc in self.encoder_branches.values()):
+                scaler_bin, scaler_pad = self.scaler_branches.pop(scaler.index)
+                self._uninstrument_scaler_branch(scaler.index)
+                self._detach_branch(scaler_bin, scaler_pad, on_scaler_released)
+
+        # 先断开 tee_N 上的录像支路 (最后一段在后台封装完成)，再拆除编码分支
+        recording = [name for name, (_, _, _, idx) in self.record_branches.items() if idx == encoder_idx]
+        remaining = [len(recording)]
+
+        def on_recorder_unlinked():
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                self._detach_branch(branch, tee_pad, on_encoder_released)
+            return False
+
+        for name in recording:
+            self._stop_recorder(name, on_recorder_unlinked)
+        if not recording:
+            self._detach_branch(branch, tee_pad, on_encoder_released)
+
+    def _plan_recorders(self) -> dict:
+        """
+        按当前配置 (全局 record + 单路 record) 生成 {流名称: (SegmentRecorder, encoder_idx)}，
+        配置和编码不变的录像沿用原来的实例
+        """
+        recorders = {}
+        for i, stream_config in enumerate(self.stream_configs):
+            settings = record_settings(self.config.get('record'), stream_config.get('record'))
+            if not settings:
+                continue
+            name = stream_config['name']
+            encoder = self.plan.encoder_for_stream(i)
+            old = self.recorders.get(name)
+            if old is not None and old[0].settings == settings and old[0].codec == encoder.profile.codec:
+                recorder = old[0]
+            else:
+                recorder = SegmentRecorder(name, encoder.profile.codec, settings)
+            recorders[name] = (recorder, encoder.index)
+        return recorders
+
+    def _recording_encoders(self) -> set:
+        """有录像的编码分支 (按需模式下不释放)"""
+        return {idx for _, idx in self.recorders.values()}
+
+    def _start_recorder(self, name: str):
+        """在运行中的编码分支 tee_N 上挂录像支路"""
+        recorder, encoder_idx = self.recorders[name]
+        if name in self.record_branches or encoder_idx not in self.encoder_branches or self.rebuilding_source:
+            return
+        encoder_bin = self.encoder_branches[encoder_idx][0]
+        graph = PipelineGraph()
+        graph.chain(recorder.elements())
+        try:
+            branch, tee_pad = self._attach_branch(encoder_bin.get_by_name(f'tee_{encoder_idx}'),
+                                                  graph, prepare=recorder.attach)
+        except PipelineBuildError as e:
+            print(f"[录像] {name}: 错误: 无法创建录像支路: {e}")
+            return
+        self.queues.watch(graph['record_queue'], f'record_{recorder.label}')
+        self.record_branches[name] = (recorder, branch, tee_pad, encoder_idx)
+        # 分段从关键帧开始，不必等下一个 GOP (1 秒内已请求过时关键帧已在路上)
+        if self.relays[encoder_idx].request_keyframe() == EncodedStreamRelay.KEYFRAME_REJECTED:
+            print(f"[录像] {name}: 关键帧请求未送达，第一段从下一个自然关键帧开始")
+        print(f"[录像] {name}: tee_{encoder_idx} -> {recorder.directory}")
+
+    def _stop_recorder(self, name: str, on_unlinked=None):
+        """
+        断开录像支路: 向支路发送 EOS，最后一段封装完成后在主循环中移除
+
+        Args:
+            on_unlinked: 支路已从 tee 断开后在主循环中调用
+        """
+        recorder, branch, tee_pad, _ = self.record_branches.pop(name)
+        self.finishing_recorders += 1
+        self.queues.unwatch(f'record_{recorder.label}')
+        tee = tee_pad.get_parent_element()
+        pipeline = self.main_pipeline
+        sink_pad = branch.get_static_pad('sink')
+
+        def finalize():
+            branch.set_state(Gst.State.NULL)
+            pipeline.remove(branch)
+            self.finishing_recorders -= 1
+            if self.rebuilding_source and self.finishing_recorders == 0:
+                self._restart_source()
+            return False
+
+        def on_pad_idle(pad, info):
+            pad.unlink(sink_pad)
+            tee.release_request_pad(pad)
+            recorder.finish(lambda: GLib.idle_add(finalize))
+            sink_pad.send_event(Gst.Event.new_eos())
+            if on_unlinked:
+                GLib.idle_add(on_unlinked)
+            return Gst.PadProbeReturn.REMOVE
+
+        tee_pad.add_probe(Gst.PadProbeType.IDLE, on_pad_idle)
+
+    def _finish_recordings(self):
+        """退出前: 向所有录像支路发送 EOS 并等待最后一段封装完成 (主循环已停止)"""
+        waits = []
+        for recorder, branch, _, _ in self.record_branches.values():
+            done = threading.Event()
+            recorder.finish(done.set)
+            branch.get_static_pad('sink').send_event(Gst.Event.new_eos())
+            waits.append(done)
+        for done in waits:
+            done.wait(SegmentRecorder.FINISH_TIMEOUT + 1)
+        self.record_branches.clear()
+
+    def _watch_bitrate(self, encoder_idx: int):
+        """开启自适应码率时把运行中的编码器交给控制器"""
+        if not self.abr_settings or encoder_idx not in self.encoder_elements:
+            return
+        encoder = self.encoder_branches[encoder_idx][2]
+        self.abr.add_branch(f'tee_{encoder_idx}', self.encoder_elements[encoder_idx],
+                            self.bitrate_overrides.get(encoder_idx, encoder.profile.bitrate), self.abr_settings,
+                            lambda: self._branch_medias(encoder_idx))
+
+    def _branch_medias(self, encoder_idx: int) -> list:
+        """共享某个编码分支的所有 RTSP media"""
+        relay = self.relays.get(encoder_idx)
+        return [media for media, (r, _) in list(self.media_relays.items()) if r is relay]
+
+    def _instrument_source(self):
+        """主 pipeline 创建后: 源输出记录采集时间，登记 pipeline 状态"""
+        if self.stamper:
+            source = self.main_graph[self.main_graph.nodes[0].name]
+            self.stamper.watch_capture(source.get_static_pad('src'))
+        if self.metrics:
+            self.metrics.watch_pipeline('main', self.main_pipeline)
+
+    def _instrument_scaler_branch(self, graph: PipelineGraph, scaler_idx: int):
+        """缩放器分支: 统计 queue 丢帧"""
+        self.queues.watch(graph[f'queue_scale_{scaler_idx}'])
+
+    def _instrument_encoder_branch(self, graph: PipelineGraph, encoder_idx: int):
+        """编码分支: parse 输出写入采集时间戳 SEI，统计 fps/比特率和 queue 丢帧"""
+        parse_pad = graph[f'parse_{encoder_idx}'].get_static_pad('src')
+        if self.stamper:
+            codec = self.plan.encoder(encoder_idx).profile.codec
+            self.stamper.stamp_output(parse_pad, codec)
+        self.queues.watch(graph[f'queue_enc_{encoder_idx}'])
+        self.queues.watch(graph[f'queue_relay_{encoder_idx}'])
+        if self.metrics:
+            self.metrics.watch_flow(f'tee_{encoder_idx}', parse_pad)
+
+    def _uninstrument_scaler_branch(self, scaler_idx: int):
+        """缩放器分支拆除: 停止 queue 监控"""
+        self.queues.unwatch(f'queue_scale_{scaler_idx}')
+
+    def _uninstrument_encoder_branch(self, encoder_idx: int):
+        """编码分支拆除: 停止 queue 监控"""
+        self.queues.unwatch(f'queue_enc_{encoder_idx}')
+        self.queues.unwatch(f'queue_relay_{encoder_idx}')
+
+    def _on_encoder_media_prepared(self, encoder_idx: int):
+        """某个挂载点的 RTSP media 创建 (该挂载点第一个客户端连接)"""
+        if encoder_idx not in self.encoder_clients:
+            return False  # 编码器已在热加载中移除
+        self.encoder_clients[encoder_idx] += 1
+        print(f"\n[客户端] tee_{encoder_idx} 活动挂载点: {self.encoder_clients[encoder_idx]}")
+        if self.on_demand:
+            self._activate_encoder(encoder_idx)
+        return False
+
+    def _on_encoder_media_unprepared(self, encoder_idx: int):
+        """某个挂载点的 RTSP media 释放 (该挂载点最后一个客户端断开)"""
+        if encoder_idx not in self.encoder_clients:
+            return False  # 编码器已在热加载中移除
+        self.encoder_clients[encoder_idx] = max(0, self.encoder_clients[encoder_idx] - 1)
+        print(f"\n[客户端] tee_{encoder_idx} 活动挂载点: {self.encoder_clients[encoder_idx]}")
+        if self.on_demand and self.encoder_clients[encoder_idx] == 0 \
+                and encoder_idx not in self.release_timers and encoder_idx not in self._recording_encoders():
+            # 延迟释放，避免频繁启停
+            self.release_timers[encoder_idx] = GLib.timeout_add_seconds(
+                self.on_demand_grace, self._release_encoder, encoder_idx)
+        return False
+
+    def _add_source(self, graph: PipelineGraph):
+        """
+        源部分: 摄像头 -> 解码 -> 主 tee
+
+        Returns:
+            主 tee 节点
         """
         cam = self.camera_config
         device = cam.get('device', '/dev/video0')
@@ -151,108 +734,170 @@ class MultiResolutionRTSPServer:
         width = cam.get('input_width', 1920)
         height = cam.get('input_height', 1080)
         framerate = cam.get('framerate', 30)
+        backend = self.backend
 
         # 源和解码
-        pipeline = f'v4l2src device="{device}"'
-
-        if input_format == 'mjpeg':
-            pipeline += (
-                f' ! image/jpeg,width={width},height={height},'
-                f'framerate={framerate}/1'
-                f' ! nvv4l2decoder mjpeg=1'
-            )
+        specs = [element('v4l2src', device=device)]
+
+        if cam.get('source', 'usb') == 'test':
+            # 测试源 (基准测试/无摄像头环境)
+            specs = [element('videotestsrc', is_live=True, pattern='ball'),
+                     caps(f'video/x-raw,width={width},height={height},framerate={framerate}/1')]
+            specs += backend.upload()
+        elif input_format == 'mjpeg':
+            specs.append(caps(f'image/jpeg,width={width},height={height},framerate={framerate}/1'))
+            specs += backend.jpeg_decoder()
         elif input_format == 'h264':
-            pipeline += (
-                f' ! video/x-h264,width={width},height={height},'
-                f'framerate={framerate}/1'
-                f' ! h264parse ! nvv4l2decoder'
-            )
+            specs.append(caps(f'video/x-h264,width={width},height={height},framerate={framerate}/1'))
+            specs.append(element('h264parse'))
+            specs += backend.decoder('h264')
         elif input_format == 'nv12':
-            pipeline += (
-                f' ! video/x-raw,format=NV12,width={width},height={height},'
-                f'framerate={framerate}/1'
-                f' ! nvvidconv ! video/x-raw(memory:NVMM),format=NV12'
-            )
+            specs.append(caps(f'video/x-raw,format=NV12,width={width},height={height},'
+                              f'framerate={framerate}/1'))
+            specs += backend.upload()
         else:
             # YUYV or other raw formats
-            pipeline += (
-                f' ! video/x-raw,width={width},height={height},'
-                f'framerate={framerate}/1'
-                f' ! nvvidconv ! video/x-raw(memory:NVMM),format=NV12'
-            )
+            specs.append(caps(f'video/x-raw,width={width},height={height},framerate={framerate}/1'))
+            specs += backend.upload()
 
-        # 添加主 tee
-        pipeline += ' ! tee name=t'
+        # 添加主 tee (按需模式下可能暂时没有任何分支)
+        specs.append(element('tee', name='t', allow_not_linked=True))
+        _, tee = graph.chain(specs)
+        return tee
 
-        # 按分辨率分组流配置
-        resolution_groups = {}
-        for i, stream_config in enumerate(self.stream_configs):
-            out_width = stream_config.get('width', 1920)
-            out_height = stream_config.get('height', 1080)
-            key = (out_width, out_height)
-            if key not in resolution_groups:
-                resolution_groups[key] = []
-            resolution_groups[key].append((i, stream_config))
-
-        # 记录分组信息用于显示
-        self.resolution_groups = resolution_groups
-
-        # 为每个分辨率组创建一个编码分支
-        for group_idx, ((out_width, out_height), streams) in enumerate(resolution_groups.items()):
-            # 使用组内第一个流的比特率
-            first_stream = streams[0][1]
-            bitrate = first_stream.get('bitrate', 4000) * 1000
-            out_framerate = first_stream.get('framerate', cam.get('framerate', 30))
-
-            # 分辨率组的 tee 名称
-            tee_name = f'tee_{group_idx}'
-
-            # 编码分支：源 tee -> 缩放 -> 编码 -> 组内 tee
-            branch = (
-                f' t. ! queue max-size-buffers=10 max-size-time=0 max-size-bytes=0 leaky=downstream'
-                f' ! nvvidconv'
-                f' ! video/x-raw(memory:NVMM),width={out_width},height={out_height},format=NV12'
-                f' ! nvv4l2h265enc bitrate={bitrate} preset-level=1 iframeinterval=10 insert-sps-pps=true maxperf-enable=true'
-                f' ! h265parse config-interval=1'
-                f' ! tee name={tee_name}'
-            )
-            pipeline += branch
-
-            # 为组内每个流添加 UDP 输出
-            for stream_idx, stream_config in streams:
-                udp_port = self.udp_base_port + stream_idx
-                udp_branch = (
-                    f' {tee_name}. ! queue max-size-buffers=10 max-size-time=0 max-size-bytes=0'
-                    f' ! rtph265pay pt=96 config-interval=1 mtu=1400'
-                    f' ! udpsink host=127.0.0.1 port={udp_port} sync=false async=false buffer-size=4194304'
-                )
-                pipeline += udp_branch
-
-        return pipeline
+    def _add_scaler_branch(self, graph: PipelineGraph, scaler_idx: int) -> tuple:
+        """
+        缩放器分支: queue -> 缩放 -> stee_S (该分辨率下所有编码器共用)
 
-    def _create_rtsp_factory(self, stream_index: int) -> GstRtspServer.RTSPMediaFactory:
+        Returns:
+            (入口 queue 节点, stee 节点)
         """
-        创建 RTSP MediaFactory
+        scaler = self.plan.scaler(scaler_idx)
+        specs = [element('queue', name=f'queue_scale_{scaler_idx}', max_size_buffers=10,
+                         max_size_time=0, max_size_bytes=0, leaky='downstream')]
+        specs += self.backend.scaler(scaler.width, scaler.height)
+        specs.append(element('tee', name=f'stee_{scaler_idx}', allow_not_linked=True))
+        return graph.chain(specs)
+
+    def _add_encoder_branch(self, graph: PipelineGraph, encoder_idx: int):
+        """
+        编码器分支: queue -> [videorate] -> enc_N -> parse -> tee_N -> queue -> appsink_N
+
+        Returns:
+            入口 queue 节点
+        """
+        encoder = self.plan.encoder(encoder_idx)
+        profile = encoder.profile
+
+        specs = [element('queue', name=f'queue_enc_{encoder_idx}', max_size_buffers=10,
+                         max_size_time=0, max_size_bytes=0, leaky='downstream')]
+
+        # 输出帧率低于输入时只丢帧降频 (max-rate 可在运行时修改，见控制接口)
+        framerate = self.framerate_overrides.get(encoder_idx, profile.framerate)
+        specs.append(element('videorate', name=f'rate_{encoder_idx}', drop_only=True, max_rate=framerate))
+
+        bitrate = self.bitrate_overrides.get(encoder_idx, profile.bitrate)
+        specs += self.backend.encoder(profile.codec, bitrate * 1000, iframeinterval=profile.gop,
+                                      insert_sps_pps=True, maxperf=True, name=f'enc_{encoder_idx}')
+        specs.append(element('h264parse' if profile.codec == 'h264' else 'h265parse',
+                             name=f'parse_{encoder_idx}', config_interval=1))
+
+        # 编码后的 buffer 交给 appsink，由 EncodedStreamRelay 转发给共享该编码器的所有挂载点
+        specs.append(element('tee', name=f'tee_{encoder_idx}'))
+        specs.append(element('queue', name=f'queue_relay_{encoder_idx}', max_size_buffers=10,
+                             max_size_time=0, max_size_bytes=0))
+        specs.append(element('appsink', name=f'appsink_{encoder_idx}', emit_signals=True,
+                             sync=False, async_=False, max_buffers=10, drop=True))
+        first, _ = graph.chain(specs)
+        return first
+
+    def _build_main_graph(self) -> PipelineGraph:
+        """
+        构建主 pipeline 图的源部分: 摄像头 -> 解码 -> tee
 
-        从 UDP 接收已编码的 RTP 流，直接转发给 RTSP 客户端
+        缩放器 (-> stee) 和编码器 (编码 -> tee_N -> appsink) 作为子 bin 动态挂载:
+        常驻模式在启动时全部挂上，按需模式在客户端连接时挂上；
+        热加载时只增删参数变化的分支
         """
-        udp_port = self.udp_base_port + stream_index
+        graph = PipelineGraph()
+        tee = self._add_source(graph)
+        if self.snapshot:
+            cam = self.camera_config
+            first, _ = graph.chain(self.snapshot.elements(cam.get('input_width', 1920),
+                                                          cam.get('input_height', 1080)))
+            graph.link(tee, first)
+        return graph
+
+    def _register_snapshots(self):
+        """/snapshot/<流名称>: 所有输出流都返回主 tee 上的同一张快照"""
+        self.snapshots.taps = {c['name']: self.snapshot for c in self.stream_configs} if self.snapshot else {}
 
-        # 从 UDP 接收 RTP 包，解包后重新打包发送
-        pipeline = (
-            f'( udpsrc port={udp_port} buffer-size=4194304 caps="application/x-rtp,media=video,'
-            f'encoding-name=H265,payload=96,clock-rate=90000"'
-            f' ! queue max-size-buffers=10 max-size-time=0 max-size-bytes=0'
-            f' ! rtph265depay ! h265parse config-interval=1'
-            f' ! rtph265pay name=pay0 pt=96 config-interval=1 mtu=1400 )'
-        )
+    def _create_rtsp_factory(self, stream_index: int) -> GstRtspServer.RTSPMediaFactory:
+        """
+        创建 RTSP MediaFactory
 
-        factory = GstRtspServer.RTSPMediaFactory()
-        factory.set_launch(pipeline)
+        media 由 appsrc 接收编码分支转发来的 H.265/H.264 buffer，只做一次 RTP 打包
+        """
+        encoder = self.plan.encoder_for_stream(stream_index)
+        codec = encoder.profile.codec
+        media_type = 'video/x-h264' if codec == 'h264' else 'video/x-h265'
+        payloader = 'rtph264pay' if codec == 'h264' else 'rtph265pay'
+
+        def build_graph():
+            graph = PipelineGraph()
+            graph.chain([
+                element('appsrc', name='relaysrc', is_live=True, format='time', do_timestamp=True,
+                        caps=f'{media_type},stream-format=(string)byte-stream,alignment=(string)au'),
+                element(payloader, name='pay0', pt=96, config_interval=1, mtu=1400),
+            ])
+            return graph
+
+        factory = GraphMediaFactory(build_graph)
         factory.set_shared(True)
+        stream_config = self.stream_configs[stream_index]
+        multicast = self._multicast_of(stream_config)
+        if multicast:
+            configure_multicast(factory, multicast)
+        factory.connect("media-configure", self._on_media_configure, encoder.index)
+        if self.metrics:
+            label = ':%d%s' % self.rtsp.endpoint(stream_config['port'], stream_config['mount'])
+            factory.connect("media-configure", lambda f, media: self.metrics.watch_media(label, media))
 
         return factory
 
+    def _multicast_of(self, stream_config: dict, config: dict = None):
+        """一路输出流的组播配置 (全局 multicast 与单路 multicast 合并)，None 表示只用单播"""
+        config = config or self.config
+        return multicast_settings(config.get('multicast'), stream_config.get('multicast'))
+
+    def _on_media_configure(self, factory, media, encoder_idx):
+        """新建 RTSP media 时把其 appsrc 注册到对应编码分支"""
+        relay = self.relays.get(encoder_idx)
+        if relay is None:
+            return  # 挂载点正在热加载中被替换
+        appsrc = media.get_element().get_by_name("relaysrc")
+        cached = relay.add_appsrc(appsrc)
+        if cached:
+            print(f"\n[GOP 缓存] tee_{encoder_idx}: 新 media 立即推送 {cached} 帧 (从最近的 IDR 开始)")
+        self.media_relays[media] = (relay, appsrc)
+
+        def on_unprepared(m):
+            relay.remove_appsrc(appsrc)
+            self.media_relays.pop(m, None)
+            # unprepared 可能在非主线程发出，切回主循环处理分支释放
+            GLib.idle_add(self._on_encoder_media_unprepared, encoder_idx)
+
+        media.connect("unprepared", on_unprepared)
+        # media-configure 在 RTSP 客户端线程中发出，分支启停统一在主循环处理
+        GLib.idle_add(self._on_encoder_media_prepared, encoder_idx)
+
+    def _on_client_play(self, ctx):
+        """RTSP 监听线程: 客户端 PLAY 时让其所在分支尽快出关键帧 (刚推送过 GOP 缓存的除外)"""
+        entry = self.media_relays.get(ctx.media) if ctx.media is not None else None
+        if entry is not None:
+            relay, appsrc = entry
+            relay.on_client_play(appsrc)
+
     def _on_bus_message(self, bus, message):
         """处理 pipeline 消息"""
         t = message.type
@@ -281,75 +926,82 @@ class MultiResolutionRTSPServer:
         cam = self.camera_config
         print(f"\n相机配置:")
         print(f"  设备: {cam.get('device', '/dev/video0')}")
+        print(f"  后端: {self.backend.name}")
+        if self.stamper:
+            print(f"  采集时间戳: 已启用 (SEI，用 latency.py 测量端到端延迟)")
+        if self.snapshot:
+            print(f"  快照: {describe_snapshot(self.snapshot.settings)}")
         print(f"  输入: {cam.get('input_width', 1920)}x{cam.get('input_height', 1080)} "
               f"{cam.get('input_format', 'mjpeg').upper()} @ {cam.get('framerate', 30)}fps")
 
-        # 构建并启动主 pipeline
-        pipeline_str = self._build_main_pipeline()
-        print(f"\n主 Pipeline:")
-        # 打印格式化的 pipeline（每个分支一行）
-        parts = pipeline_str.split(' t. !')
-        print(f"  {parts[0]}")
-        for part in parts[1:]:
-            print(f"  t. !{part}")
+        # 扇出规划
+        print(f"\n编码规划:")
+        for line in self.plan.describe():
+            print(f"  {line}")
 
+        # 主 pipeline 只包含源部分，缩放器和编码器作为子 bin 挂到 tee 上
         try:
-            self.main_pipeline = Gst.parse_launch(pipeline_str)
-        except GLib.Error as e:
-            print(f"\n错误: 无法创建 pipeline: {e.message}")
-            sys.exit(1)
-
-        # 设置 bus 消息处理
-        bus = self.main_pipeline.get_bus()
-        bus.add_signal_watch()
-        bus.connect("message", self._on_bus_message)
-
-        # 启动主 pipeline
-        ret = self.main_pipeline.set_state(Gst.State.PLAYING)
-        if ret == Gst.StateChangeReturn.FAILURE:
-            print("错误: 无法启动主 pipeline")
+            source_graph = self._build_main_graph()
+            branch_lines = self._describe_branches()
+        except PipelineBuildError as e:
+            print(f"\n错误: 无法创建 pipeline: {e}")
             sys.exit(1)
-
-        # 显示优化信息
-        print(f"\n编码器优化:")
-        print(f"  总流数: {len(self.stream_configs)} 路")
-        print(f"  编码器数: {len(self.resolution_groups)} 个 (按分辨率共享)")
-        for (w, h), streams in self.resolution_groups.items():
-            stream_names = [s[1]['name'] for s in streams]
-            print(f"    {w}x{h}: {len(streams)} 路 ({', '.join(stream_names)})")
+        print(f"\n主 Pipeline:")
+        print(f"  {source_graph.to_launch()}")
+        for line in branch_lines:
+            print(line)
+
+        if self.on_demand:
+            print(f"\n按需编码: 各编码器在首个客户端连接时启动，"
+                  f"最后一个客户端断开 {self.on_demand_grace}s 后释放")
+            # 录像的编码分支常驻，有快照时源 pipeline 常驻
+            if self.snapshot and not self._start_pipeline():
+                sys.exit(1)
+            for encoder_idx in sorted(self._recording_encoders()):
+                self._activate_encoder(encoder_idx)
+        else:
+            if not self._start_pipeline():
+                sys.exit(1)
+            for encoder in self.plan.encoders:
+                self._activate_encoder(encoder.index)
+            if len(self.encoder_branches) < len(self.plan.encoders):
+                print("错误: 无法启动全部编码分支")
+                sys.exit(1)
 
         print(f"\n输出流 ({len(self.stream_configs)} 路):")
 
         # 为每个流创建 RTSP 服务器
-        for i, stream_config in enumerate(self.stream_configs):
-            port = stream_config['port']
-            mount = stream_config['mount']
-            name = stream_config['name']
-
-            # 每个端口一个 RTSP 服务器
-            if port not in self.servers:
-                server = GstRtspServer.RTSPServer()
-                server.set_service(str(port))
-                self.servers[port] = server
-
-            server = self.servers[port]
-            mounts = server.get_mount_points()
-
-            # 创建并添加 factory
-            factory = self._create_rtsp_factory(i)
-            mounts.add_factory(mount, factory)
-
-            out_framerate = stream_config.get('framerate', self.camera_config.get('framerate', 30))
-            print(f"\n  [{name}]")
-            print(f"    分辨率: {stream_config['width']}x{stream_config['height']} @ {out_framerate}fps")
-            print(f"    比特率: {stream_config['bitrate']} kbps")
-            print(f"    端口: {port}")
-            print(f"    挂载点: {mount}")
-            print(f"    内部 UDP: 127.0.0.1:{self.udp_base_port + i}")
+        for i in range(len(self.stream_configs)):
+            self._mount_stream(i)
 
         # 启动所有 RTSP 服务器
-        for port, server in self.servers.items():
-            server.attach(None)
+        self.rtsp.start()
+        print(f"\nRTSP 监听: {self.rtsp.describe()}")
+
+        # /metrics、/snapshot、/api 默认共用 metrics_port，单独指定端口时各自监听
+        http_services = {}
+
+        def http_on(port):
+            if port not in http_services:
+                http_services[port] = HTTPService(port)
+            return http_services[port]
+
+        if self.metrics:
+            http_on(self.metrics_port).route('GET', '/metrics', self.metrics.handle)
+        snapshot_port = self.snapshot and (self.snapshot.settings['port'] or self.metrics_port)
+        if snapshot_port:
+            self.snapshots.register(http_on(snapshot_port))
+        api_port = control_port(self.config.get('control_api'), self.metrics_port)
+        if api_port:
+            ControlAPI(self).register(http_on(api_port))
+        elif self.config.get('control_api'):
+            print("\n警告: control_api 需要 metrics_port 或单独指定 port")
+        for http in http_services.values():
+            http.start()
+
+        # 配置文件热加载 (文件修改或 SIGHUP)
+        ConfigWatcher(self.config_path, self.reload,
+                      watch_file=self.config.get('watch_config', True)).start()
 
         # 获取所有 IP 地址
         ips = self._get_all_ips()
@@ -359,17 +1011,25 @@ class MultiResolutionRTSPServer:
         for iface, ip in ips:
             print(f"\n  [{iface}] {ip}")
             for stream_config in self.stream_configs:
-                name = stream_config['name']
-                port = stream_config['port']
-                mount = stream_config['mount']
-                print(f"    {name}: rtsp://{ip}:{port}{mount}")
+                url = self.rtsp.url(ip, stream_config['port'], stream_config['mount'])
+                print(f"    {stream_config['name']}: {url}")
 
         print("\n" + "=" * 60)
         print("验证命令:")
         for stream_config in self.stream_configs[:3]:  # 只显示前3个
-            print(f"  ffprobe rtsp://localhost:{stream_config['port']}{stream_config['mount']}")
+            print(f"  ffprobe {self.rtsp.url('localhost', stream_config['port'], stream_config['mount'])}")
         if len(self.stream_configs) > 3:
             print(f"  ...")
+        if self.metrics:
+            print(f"  curl http://localhost:{self.metrics_port}/metrics")
+        if snapshot_port:
+            print(f"  curl -o snap.jpg http://localhost:{snapshot_port}/snapshot/"
+                  f"{quote(self.stream_configs[0]['name'])}")
+        elif self.snapshot:
+            print("  (快照需要 metrics_port 或 snapshot.port 才能通过 HTTP 访问)")
+        if api_port:
+            print(f"  curl http://localhost:{api_port}/api/streams")
+        print(f"\n修改 {self.config_path} 或发送 SIGHUP 即可热加载配置")
         print("=" * 60)
         print("\n按 Ctrl+C 停止服务器")
 
@@ -381,9 +1041,334 @@ class MultiResolutionRTSPServer:
             pass
         finally:
             print("\n正在停止...")
-            self.main_pipeline.set_state(Gst.State.NULL)
+            self._finish_recordings()
+            if self.main_pipeline is not None:
+                self.main_pipeline.set_state(Gst.State.NULL)
             print("服务器已停止")
 
+    def _describe_branches(self) -> list:
+        """缩放器/编码器分支的 gst-launch 描述 (仅用于日志)"""
+        lines = []
+        for scaler in self.plan.scalers:
+            scaler_graph = PipelineGraph()
+            self._add_scaler_branch(scaler_graph, scaler.index)
+            lines.append(f"  t. ! {scaler_graph.to_launch()}")
+            for encoder in scaler.encoders:
+                encoder_graph = PipelineGraph()
+                self._add_encoder_branch(encoder_graph, encoder.index)
+                lines.append(f"    stee_{scaler.index}. ! {encoder_graph.to_launch()}")
+        return lines
+
+    def _mount_stream(self, stream_index: int):
+        """为一路输出流创建 factory 并添加挂载点"""
+        stream_config = self.stream_configs[stream_index]
+        # 每个端口一个 RTSP 服务器 (合并监听时为实际的端口和路径)
+        port, mount = self.rtsp.add_factory(stream_config['port'], stream_config['mount'],
+                                            self._create_rtsp_factory(stream_index))
+
+        encoder = self.plan.encoder_for_stream(stream_index)
+        print(f"\n  [{stream_config['name']}]")
+        print(f"    分辨率: {encoder.width}x{encoder.height} @ {encoder.profile.framerate}fps")
+        print(f"    编码: {encoder.profile.codec.upper()} {encoder.profile.bitrate} kbps")
+        print(f"    端口: {port}")
+        print(f"    挂载点: {mount}")
+        print(f"    编码分支: tee_{encoder.index} (进程内转发)")
+        multicast = self._multicast_of(stream_config)
+        if multicast:
+            print(f"    组播: {describe_multicast(multicast)}")
+        if stream_config['name'] in self.recorders:
+            recorder = self.recorders[stream_config['name']][0]
+            print(f"    录像: {describe_record(recorder.settings)}")
+
+    def _unmount_stream(self, stream_config: dict):
+        """删除一路输出流的挂载点并断开其上的会话"""
+        port, mount = stream_config['port'], stream_config['mount']
+        dropped = self.rtsp.remove_factory(port, mount)
+        print(f"[热加载] 已移除挂载点 {stream_config['name']} "
+              f"({self.rtsp.url('<ip>', port, mount)}，断开 {dropped} 个会话)")
+
+    def reload(self, config: dict):
+        """
+        热加载配置
+
+        - camera 变化: 重建源 pipeline 和其上的分支，转发器和挂载点保留，客户端只会短暂停顿
+        - 输出流按 (端口, 挂载点) 对比: 所用编码器不变的挂载点不做任何操作；
+          新增的挂载点添加 factory；删除或改用其他编码器的挂载点撤下 factory、断开会话后重建
+        - 编码器按 (分辨率, 编码参数) 对比: 不再使用的分支拆除，新的分支挂上，其余分支不受影响
+        """
+        streams = [s for s in config.get('streams', []) if s.get('enable', True)]
+        if not streams or 'camera' not in config:
+            print("[热加载] 新配置没有 camera 或启用的输出流，忽略")
+            return
+        if self.rebuilding_source:
+            print("[热加载] 源 pipeline 正在重建，新配置在重建完成后应用")
+            self.deferred_reload = config
+            return
+
+        for key, current in (('backend', self.backend.name), ('metrics_port', self.metrics_port),
+                             ('latency_stamp', self.stamper is not None),
+                             ('single_port', self.rtsp.single_port),
+                             ('snapshot', self.config.get('snapshot')),
+                             ('control_api', self.config.get('control_api'))):
+            value = config.get(key)
+            if value is not None and value != 'auto' and value != current:
+                print(f"[热加载] {key} 变化需要重启服务器才能生效，本次忽略")
+
+        camera_changed = config['camera'] != self.camera_config
+        old_plan = self.plan
+        old_configs = self.stream_configs
+        plan = compile_plan(streams, input_framerate=config['camera'].get('framerate', 30),
+                            default_gop=config.get('gop', 60), previous=old_plan)
+
+        def mounts_of(configs, p, c_all):
+            return {(c['port'], c['mount']): dict(c, _encoder=p.encoder_for_stream(i).index,
+                                                  _multicast=self._multicast_of(c, c_all))
+                    for i, c in enumerate(configs)}
+
+        old_mounts = mounts_of(old_configs, old_plan, self.config)
+        new_mounts = mounts_of(streams, plan, config)
+        # 只有所用编码器或传输方式变化才需要重建挂载点，名称等显示字段变化不影响客户端
+        added, removed, _ = diff_keyed(old_mounts, new_mounts)
+        changed = [k for k in new_mounts if k in old_mounts
+                   and (new_mounts[k]['_encoder'], new_mounts[k]['_multicast']) !=
+                   (old_mounts[k]['_encoder'], old_mounts[k]['_multicast'])]
+
+        old_encoders = {enc.index for enc in old_plan.encoders}
+        new_encoders = {enc.index for enc in plan.encoders}
+
+        # 先撤下挂载点，再拆除不再使用的编码分支
+        for key in removed + changed:
+            self._unmount_stream(old_mounts[key])
+
+        self.config = config
+        self.camera_config = config['camera']
+        self.stream_configs = streams
+        self.plan = plan
+        self.on_demand = config.get('on_demand', False)
+        self.on_demand_grace = config.get('on_demand_grace', 5)
+        self.gop_cache = config.get('gop_cache', True)
+        for relay in self.relays.values():
+            relay.gop_cache = self.gop_cache
+        self.abr_settings = abr_settings(config.get('adaptive_bitrate'))
+
+        # 录像: 撤下不再需要或配置变化的录像支路，新的在编码分支启动后挂上
+        recorders = self._plan_recorders()
+        for name in list(self.record_branches):
+            entry = recorders.get(name)
+            if entry is None or entry != self.recorders.get(name):
+                self._stop_recorder(name)
+        self.recorders = recorders
+
+        for encoder_idx in old_encoders - new_encoders:
+            timer = self.release_timers.pop(encoder_idx, None)
+            if timer is not None:
+                GLib.source_remove(timer)
+            self._teardown_encoder(encoder_idx)
+            del self.relays[encoder_idx]
+            del self.encoder_clients[encoder_idx]
+            self.bitrate_overrides.pop(encoder_idx, None)
+            self.framerate_overrides.pop(encoder_idx, None)
+        for encoder_idx in new_encoders - old_encoders:
+            self.relays[encoder_idx] = EncodedStreamRelay(f'tee_{encoder_idx}', self.gop_cache)
+            self.encoder_clients[encoder_idx] = 0
+
+        if camera_changed and self.main_pipeline is not None:
+            print("[热加载] 相机配置变化，重建源 pipeline")
+            self._rebuild_source()
+
+        # 常驻模式挂上所有编码分支；按需模式只保留有客户端或录像的分支
+        recording = self._recording_encoders()
+        for encoder in plan.encoders:
+            if not self.on_demand or encoder.index in recording:
+                self._activate_encoder(encoder.index)
+            elif self.encoder_clients[encoder.index] == 0 and encoder.index in self.encoder_branches \
+                    and encoder.index not in self.release_timers:
+                self.release_timers[encoder.index] = GLib.timeout_add_seconds(
+                    self.on_demand_grace, self._release_encoder, encoder.index)
+
+        # 自适应码率配置变化: 运行中的分支按新的上下限继续调节，关闭时恢复配置的码率
+        for encoder_idx in list(self.encoder_branches):
+            if self.abr_settings:
+                self._watch_bitrate(encoder_idx)
+            else:
+                self.abr.remove_branch(f'tee_{encoder_idx}', restore=True)
+
+        # 已在运行的编码分支上挂新的录像支路
+        for name in self.recorders:
+            self._start_recorder(name)
+        self._register_snapshots()
+
+        for key in added + changed:
+            self._mount_stream(next(i for i, c in enumerate(streams) if (c['port'], c['mount']) == key))
+
+        print(f"\n[热加载] 挂载点: 新增 {len(added)}，移除 {len(removed)}，重建 {len(changed)}，"
+              f"{len(new_mounts) - len(added) - len(changed)} 个不受影响；"
+              f"编码分支: 新增 {len(new_encoders - old_encoders)}，"
+              f"移除 {len(old_encoders - new_encoders)}")
+        for line in plan.describe():
+            print(f"  {line}")
+
+    def _rebuild_source(self):
+        """
+        相机配置变化后重建源 pipeline 和其上运行中的分支
+
+        录像支路先发送 EOS，当前分段封装完成后再停止 pipeline (否则 mp4 分段缺少 moov)，
+        等待期间不挂新的录像支路，收到的热加载推迟到重建完成后
+        """
+        for name in list(self.record_branches):
+            self._stop_recorder(name)
+        if self.finishing_recorders:
+            print(f"[录像] 等待 {self.finishing_recorders} 路录像的当前分段封装完成")
+            self.rebuilding_source = True
+        else:
+            self._restart_source()
+
+    def _restart_source(self):
+        """停止源 pipeline 后按当前规划重新挂上原来运行的编码分支 (录像支路随编码分支挂上)"""
+        running = list(self.encoder_branches)
+        scalers = list(self.scaler_branches)
+        self.rebuilding_source = False
+        self.encoder_branches.clear()
+        self.scaler_branches.clear()
+        self.encoder_elements.clear()
+        self._stop_pipeline()
+        encoders = {enc.index for enc in self.plan.encoders}
+        for encoder_idx in running:
+            if encoder_idx in encoders:
+                self._activate_encoder(encoder_idx)
+        # 重新挂上的分支沿用原来的 queue 统计，其余的停止监控
+        for encoder_idx in set(running) - set(self.encoder_branches):
+            self._uninstrument_encoder_branch(encoder_idx)
+            if encoder_idx in self.relays:
+                self.relays[encoder_idx].detach()
+        for scaler_idx in set(scalers) - set(self.scaler_branches):
+            self._uninstrument_scaler_branch(scaler_idx)
+        if self.snapshot:
+            self._start_pipeline()
+
+        config, self.deferred_reload = self.deferred_reload, None
+        if config is not None:
+            self.reload(config)
+
+    def _stream_by_name(self, name: str):
+        """按名称查找输出流配置 (含已禁用的流)"""
+        return next((c for c in self.config['streams'] if c.get('name') == name), None)
+
+    def _encoder_of(self, stream_config: dict):
+        """启用的输出流所用的编码器 (EncoderNode)，已禁用时抛出 ControlError"""
+        for i, config in enumerate(self.stream_configs):
+            if config is stream_config:
+                return self.plan.encoder_for_stream(i)
+        raise ControlError(f"输出流 {stream_config['name']} 已禁用")
+
+    def _describe_encoder(self, encoder) -> dict:
+        """编码分支的配置和运行时参数 (控制接口)"""
+        idx = encoder.index
+        profile = encoder.profile
+        info = {
+            'encoder': f'tee_{idx}',
+            'width': encoder.width,
+            'height': encoder.height,
+            'codec': profile.codec,
+            'bitrate_kbps': self.bitrate_overrides.get(idx, profile.bitrate),
+            'configured_bitrate_kbps': profile.bitrate,
+            'framerate': self.framerate_overrides.get(idx, profile.framerate),
+            'configured_framerate': profile.framerate,
+            'gop': profile.gop,
+            'running': idx in self.encoder_branches,
+            'active_mounts': self.encoder_clients.get(idx, 0),
+            'shared_with': encoder.stream_names,
+            'keyframe_requests': self.relays[idx].keyframe_requests if idx in self.relays else 0,
+            'keyframe_rejections': self.relays[idx].keyframe_rejections if idx in self.relays else 0,
+        }
+        branch = self.abr.branches.get(f'tee_{idx}')
+        if branch is not None:
+            info['adaptive_bitrate_kbps'] = branch.current
+        return info
+
+    def control_streams(self) -> list:
+        """控制接口: 所有输出流 (含已禁用的流)"""
+        streams = []
+        for config in self.config['streams']:
+            item = {'name': config['name'], 'enabled': config.get('enable', True),
+                    'url': self.rtsp.url('<ip>', config['port'], config['mount'])}
+            if item['enabled']:
+                item.update(self._describe_encoder(self._encoder_of(config)))
+            streams.append(item)
+        return streams
+
+    def control_set_bitrate(self, name: str, kbps: int):
+        """控制接口: 修改运行中编码器的码率 (共用该编码器的输出流一起变化)"""
+        config = self._stream_by_name(name)
+        if config is None:
+            return None
+        encoder = self._encoder_of(config)
+        idx = encoder.index
+        self.bitrate_overrides[idx] = kbps
+        if idx in self.encoder_elements:
+            if self.abr_settings:
+                # 自适应码率以新码率为上限，当前码率超出时立即下调
+                self._watch_bitrate(idx)
+            else:
+                self.backend.set_bitrate(self.encoder_elements[idx], kbps * 1000)
+        print(f"[控制] tee_{idx} ({', '.join(encoder.stream_names)}): 码率 -> {kbps} kbps")
+        return self._describe_encoder(encoder)
+
+    def control_set_framerate(self, name: str, fps: int):
+        """控制接口: 修改编码分支的输出帧率 (videorate 丢帧，不超过采集帧率)"""
+        config = self._stream_by_name(name)
+        if config is None:
+            return None
+        if fps > self.plan.input_framerate:
+            raise ControlError(f"帧率不能高于采集帧率 {self.plan.input_framerate}", 400)
+        encoder = self._encoder_of(config)
+        idx = encoder.index
+        self.framerate_overrides[idx] = fps
+        if idx in self.encoder_branches:
+            self.encoder_branches[idx][0].get_by_name(f'rate_{idx}').set_property('max-rate', fps)
+        print(f"[控制] tee_{idx} ({', '.join(encoder.stream_names)}): 帧率 -> {fps} fps")
+        return self._describe_encoder(encoder)
+
+    def control_set_enabled(self, name: str, enabled: bool):
+        """控制接口: 启用/禁用输出流 (按热加载处理，其他挂载点不受影响)"""
+        stream = self._stream_by_name(name)
+        if stream is None:
+            return None
+        if stream.get('enable', True) != enabled:
+            streams = [dict(s, enable=enabled) if s is stream else s for s in self.config['streams']]
+            if not any(s.get('enable', True) for s in streams):
+                raise ControlError("至少需要保留一路启用的输出流")
+            print(f"[控制] {'启用' if enabled else '禁用'} {name}")
+            self.reload(dict(self.config, streams=streams))
+        return next(s for s in self.control_streams() if s['name'] == name)
+
+    def control_keyframe(self, name: str):
+        """控制接口: 让该输出流所用的编码器立即出关键帧"""
+        config = self._stream_by_name(name)
+        if config is None:
+            return None
+        encoder = self._encoder_of(config)
+        if encoder.index not in self.encoder_branches:
+            raise ControlError(f"编码分支 tee_{encoder.index} 未运行")
+        result = self.relays[encoder.index].request_keyframe()
+        notes = {
+            EncodedStreamRelay.KEYFRAME_SENT: None,
+            EncodedStreamRelay.KEYFRAME_RATE_LIMITED: f'{EncodedStreamRelay.KEYFRAME_REQUEST_INTERVAL}s 内已请求过',
+            EncodedStreamRelay.KEYFRAME_REJECTED: '编码器未处理 force-key-unit 事件',
+            EncodedStreamRelay.KEYFRAME_DETACHED: '编码分支未连接',
+        }
+        return {'encoder': f'tee_{encoder.index}', 'requested': result == EncodedStreamRelay.KEYFRAME_SENT,
+                'result': result, 'note': notes[result]}
+
+    def control_sessions(self, name: str):
+        """控制接口: 输出流挂载点上的 RTSP 会话"""
+        config = self._stream_by_name(name)
+        if config is None:
+            return None
+        if not config.get('enable', True):
+            return []
+        return self.rtsp.sessions(config['port'], config['mount'])
+
     def _get_all_ips(self) -> list:
         """获取所有网卡的 IP 地址"""
         import socket
@@ -424,9 +1409,49 @@ def main():
   # 使用配置文件启动
   python3 multi_res_server.py --config multi_res_config.json
 
+  # 在没有 Jetson 硬件的主机上使用软件编解码运行同一份配置
+  python3 multi_res_server.py --config multi_res_config.json --backend software
+
 配置文件格式:
   {
+    "on_demand": true,          # 按需编码: 分辨率组有客户端时才启动编码器
+    "on_demand_grace": 5,       # 最后一个客户端断开后保留编码器的秒数
+    "backend": "auto",          # 编解码后端: auto / jetson / software
+    "latency_stamp": false,     # 在码流中嵌入采集时间戳 SEI (配合 latency.py 测量延迟)
+    "metrics_port": 9100,       # 可选: HTTP /metrics 运行指标端口 (Prometheus 格式)
+    "watch_config": true,       # 配置文件修改后自动热加载 (false 时只响应 SIGHUP)
+    "single_port": 8554,        # 可选: 所有挂载点合并到一个监听端口，其他端口的挂载点变为 /<端口>/<挂载点>
+    "rtsp_client_threads": 4,   # 可选: 每个监听端口处理客户端请求的线程数 (默认 1)
+    "rtsp_thread_per_port": true, # 每个监听端口独立的 GMainContext 和线程 (默认 true)
+    "gop": 60,                  # I 帧间隔 (帧)，各输出流可单独配置 gop 覆盖
+    "gop_cache": true,          # 缓存最近的 GOP，新客户端立即起播，不必等下一个 IDR (默认 true)
+    "adaptive_bitrate": {       # 可选: 按 RTCP 丢包/RTT 在 [min_kbps, bitrate] 间调节各编码分支码率 (true 使用默认值)
+      "min_kbps": 1000,
+      "loss_high": 0.05,        # 最差客户端丢包 >= 5% 降码率
+      "loss_low": 0.01,         # <= 1% 连续 up_after 次才回升
+      "rtt_high_ms": 300
+    },
+    "control_api": true,        # 可选: HTTP 控制接口 /api/streams (与 /metrics 共用端口，或 {"port": 9101})
+    "snapshot": {               # 可选: JPEG 快照 GET /snapshot/<name> (与 /metrics 共用 HTTP 端口)
+      "interval": 2,            # 取帧间隔 (秒)
+      "width": 320,
+      "quality": 75
+    },
+    "record": {                 # 可选: 分段录像 (从编码分支直接写盘，不重新编码)，各输出流可单独配置 record
+      "path": "/data/recordings", # 每路写入 <path>/<name>/
+      "format": "mp4",          # mp4 / mkv / ts
+      "segment_seconds": 300,   # 或 segment_mb 按大小切分
+      "max_files": 288,         # 保留策略: max_files / max_total_mb / max_age_hours
+      "max_total_mb": 20000
+    },
+    "multicast": {              # 可选: RTSP 组播，各输出流可单独配置 multicast 覆盖 (false 关闭)
+      "mode": "prefer",         # prefer 单播/组播由客户端选择，force 只允许组播
+      "address_range": ["239.255.42.1", "239.255.42.254"],
+      "port_range": [5000, 5999],
+      "ttl": 1
+    },
     "camera": {
+      "source": "usb",          # usb (默认) / test (videotestsrc 测试图案)
       "device": "/dev/video0",
       "input_format": "mjpeg",
       "input_width": 1920,
@@ -451,7 +1476,8 @@ def main():
         "width": 1280,
         "height": 720,
         "framerate": 15,
-        "bitrate": 4000
+        "bitrate": 4000,
+        "codec": "h265"       # 可选: h265 (默认) / h264
       }
     ]
   }
@@ -459,16 +1485,32 @@ def main():
 验证:
   ffprobe rtsp://<ip>:8554/stream
   ffprobe rtsp://<ip>:8555/stream
+
+热加载:
+  修改配置文件后自动生效，或手动触发: kill -HUP <pid>
+  只有参数变化的编码分支和挂载点会重建，其他挂载点上的客户端不断流；
+  camera 变化会重建源 pipeline (客户端短暂停顿)，backend / metrics_port / single_port 需要重启
         """
     )
 
     parser.add_argument("--config", "-c", type=str, default="multi_res_config.json",
                         help="配置文件路径 (默认: multi_res_config.json)")
+    parser.add_argument("--backend", choices=BACKEND_CHOICES, default=None,
+                        help="编解码后端: auto 自动探测 / jetson 硬件 / software 软件 (默认: 配置文件中的 backend 或 auto)")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="HTTP /metrics 运行指标端口 (默认: 配置文件中的 metrics_port，未配置则不启用)")
+    parser.add_argument("--single-port", type=int, default=None,
+                        help="所有挂载点合并到该监听端口 (默认: 配置文件中的 single_port，未配置则每个端口单独监听)")
+    parser.add_argument("--rtsp-threads", type=int, default=None,
+                        help="每个监听端口处理客户端请求的线程数 (默认: 配置文件中的 rtsp_client_threads 或 1)")
 
     args = parser.parse_args()
 
     try:
-        server = MultiResolutionRTSPServer(args.config)
+        server = MultiResolutionRTSPServer(args.config, backend=args.backend,
+                                           metrics_port=args.metrics_port,
+                                           single_port=args.single_port,
+                                           client_threads=args.rtsp_threads)
         server.start()
     except FileNotFoundError:
         print(f"错误: 配置文件不存在: {args.config}", file=sys.stderr)
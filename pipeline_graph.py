@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+类型化的 GStreamer pipeline 图
+
+直接创建并链接元素，替代拼接字符串再 Gst.parse_launch / factory.set_launch:
+  - 构建后保留每个元素的句柄 (编码器、queue、tee ...)，可在运行时修改属性、
+    增删分支，而不必拆掉整条 pipeline
+  - to_launch() 只用于日志输出，不再作为构建输入
+
+示例:
+    graph = PipelineGraph()
+    src, tee = graph.chain([element('videotestsrc', is_live=True), element('tee', name='t')])
+    first, last = graph.chain([element('queue'), element('fakesink')])
+    graph.link(tee, first)
+    pipeline = graph.build()
+    graph['t']  # -> Gst.Element
+"""
+
+from collections import namedtuple
+
+import gi
+
+gi.require_version('Gst', '1.0')
+gi.require_version('GstRtspServer', '1.0')
+from gi.repository import Gst, GstRtspServer
+
+
+# 一个 pipeline 元素: 工厂名 + 属性 (name 属性作为元素名)
+ElementSpec = namedtuple('ElementSpec', ['factory', 'props'])
+
+
+class PipelineBuildError(Exception):
+    """元素创建或链接失败"""
+
+
+def element(factory: str, **props) -> ElementSpec:
+    """创建元素描述，属性名中的下划线转为连字符 (末尾下划线用于避开关键字，如 async_)"""
+    return ElementSpec(factory, {k.rstrip('_').replace('_', '-'): v for k, v in props.items()})
+
+
+def caps(caps_str: str, name: str = None) -> ElementSpec:
+    """创建 capsfilter 描述"""
+    props = {'caps': caps_str}
+    if name:
+        props['name'] = name
+    return ElementSpec('capsfilter', props)
+
+
+def _format_value(value) -> str:
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def _quote(value: str) -> str:
+    if any(c in value for c in ' ,;()=!"'):
+        return '"' + value.replace('"', '\\"') + '"'
+    return value
+
+
+def to_launch(specs: list) -> str:
+    """
+    把元素描述列表转成 gst-launch 语法 (用 ! 串联，仅用于日志)
+
+    Args:
+        specs: [ElementSpec, ...]
+
+    Returns:
+        launch 字符串
+    """
+    return ' ! '.join(_render_spec(spec) for spec in specs)
+
+
+def _render_spec(spec: ElementSpec, show_name: bool = True) -> str:
+    props = dict(spec.props)
+    if not show_name:
+        props.pop('name', None)
+    if spec.factory == 'capsfilter' and list(props) == ['caps']:
+        return props['caps']
+    return spec.factory + ''.join(f' {k}={_quote(_format_value(v))}' for k, v in props.items())
+
+
+class Node:
+    """图中的一个元素"""
+
+    def __init__(self, name: str, spec: ElementSpec):
+        self.name = name
+        self.spec = spec
+        self.named = 'name' in spec.props  # 是否显式命名
+        self.element = None  # build() 之后的 Gst.Element
+
+    @property
+    def factory(self) -> str:
+        return self.spec.factory
+
+    def __repr__(self):
+        return f'Node({self.name}: {self.factory})'
+
+
+class PipelineGraph:
+    """pipeline 图: 节点 + 链接，build() 时一次性创建全部元素"""
+
+    def __init__(self):
+        self.nodes = []  # 按添加顺序
+        self.links = []  # [(src Node, sink Node), ...]
+        self._by_name = {}
+        self._counters = {}
+
+    def add(self, spec: ElementSpec) -> Node:
+        """添加一个元素"""
+        name = spec.props.get('name')
+        if name is None:
+            n = self._counters.get(spec.factory, 0)
+            self._counters[spec.factory] = n + 1
+            name = f'{spec.factory}{n}'
+            while name in self._by_name:
+                n += 1
+                self._counters[spec.factory] = n + 1
+                name = f'{spec.factory}{n}'
+        if name in self._by_name:
+            raise PipelineBuildError(f"元素名重复: {name}")
+
+        node = Node(name, spec)
+        self.nodes.append(node)
+        self._by_name[name] = node
+        return node
+
+    def link(self, src: Node, sink: Node):
+        """链接两个元素 (tee 等 request pad 由 Gst 自动申请)"""
+        self.links.append((src, sink))
+
+    def chain(self, specs: list) -> tuple:
+        """
+        顺序添加并链接一串元素
+
+        Returns:
+            (第一个 Node, 最后一个 Node)
+        """
+        if not specs:
+            raise PipelineBuildError("空的元素链")
+        nodes = [self.add(spec) for spec in specs]
+        for a, b in zip(nodes, nodes[1:]):
+            self.link(a, b)
+        return nodes[0], nodes[-1]
+
+    def node(self, name: str) -> Node:
+        return self._by_name[name]
+
+    def __getitem__(self, name: str):
+        """按名称取已创建的 Gst.Element"""
+        return self._by_name[name].element
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._by_name
+
+    def elements_of(self, *factories) -> list:
+        """按工厂名取已创建的元素 (如 'queue', 'tee')"""
+        return [n.element for n in self.nodes if n.factory in factories and n.element is not None]
+
+    def encoders(self) -> list:
+        """已创建的视频编码器元素"""
+        return [n.element for n in self.nodes
+                if n.element is not None and n.factory.endswith('enc')
+                and not n.factory.endswith('jpegenc')]
+
+    # ------------------------------------------------------------------
+    # 构建
+    # ------------------------------------------------------------------
+
+    def _make(self, node: Node) -> Gst.Element:
+        elem = Gst.ElementFactory.make(node.factory, node.name)
+        if elem is None:
+            raise PipelineBuildError(f"无法创建元素: {node.factory} (缺少插件?)")
+
+        for key, value in node.spec.props.items():
+            if key == 'name':
+                continue
+            if key == 'caps' and isinstance(value, str):
+                elem.set_property('caps', Gst.Caps.from_string(value))
+            elif isinstance(value, (Gst.Caps, Gst.Structure)):
+                elem.set_property(key, value)
+            else:
+                # 与 gst-launch 相同的字符串反序列化，支持枚举昵称、标志等
+                Gst.util_set_object_arg(elem, key, _format_value(value))
+        node.element = elem
+        return elem
+
+    @staticmethod
+    def _link_elements(src: Node, sink: Node):
+        if src.element.link(sink.element):
+            return
+
+        # 动态 pad (rtspsrc, qtdemux, decodebin ...): pad 出现后再链接
+        has_sometimes = any(t.direction == Gst.PadDirection.SRC and
+                            t.presence == Gst.PadPresence.SOMETIMES
+                            for t in src.element.get_pad_template_list())
+        if not has_sometimes:
+            raise PipelineBuildError(f"无法链接: {src.name} -> {sink.name}")
+
+        def on_pad_added(elem, pad):
+            sink_pad = sink.element.get_static_pad('sink')
+            if sink_pad is None or sink_pad.is_linked():
+                return
+            # 不兼容的 pad (如 qtdemux 的音频流) 忽略
+            pad.link(sink_pad)
+
+        src.element.connect('pad-added', on_pad_added)
+
+    def build(self, container: Gst.Bin = None) -> Gst.Bin:
+        """
+        创建全部元素并链接
+
+        Args:
+            container: 目标 bin/pipeline，None 表示新建 Gst.Pipeline
+
+        Returns:
+            container
+        """
+        if container is None:
+            container = Gst.Pipeline.new(None)
+        for node in self.nodes:
+            container.add(self._make(node))
+        for src, sink in self.links:
+            self._link_elements(src, sink)
+        return container
+
+    def build_bin(self) -> Gst.Bin:
+        """
+        构建为一个带 sink ghost pad 的 Gst.Bin (用于动态挂到运行中的 tee)
+
+        图中必须只有一个没有上游的节点，其 sink pad 成为 bin 的 sink pad
+        """
+        roots = self._roots()
+        if len(roots) != 1:
+            raise PipelineBuildError(f"分支需要唯一的入口元素, 实际: {roots}")
+        branch = self.build(Gst.Bin.new(None))
+        ghost = Gst.GhostPad.new('sink', roots[0].element.get_static_pad('sink'))
+        ghost.set_active(True)
+        branch.add_pad(ghost)
+        return branch
+
+    # ------------------------------------------------------------------
+    # 日志输出
+    # ------------------------------------------------------------------
+
+    def _roots(self) -> list:
+        targets = {id(sink) for _, sink in self.links}
+        return [n for n in self.nodes if id(n) not in targets]
+
+    def to_launch(self) -> str:
+        """序列化为 gst-launch 语法 (仅用于日志)"""
+        outs = {id(n): [] for n in self.nodes}
+        ins = {id(n): 0 for n in self.nodes}
+        for src, sink in self.links:
+            outs[id(src)].append(sink)
+            ins[id(sink)] += 1
+
+        def render(node):
+            show_name = node.named or len(outs[id(node)]) > 1 or ins[id(node)] > 1
+            spec = node.spec
+            if show_name and 'name' not in spec.props:
+                spec = ElementSpec(spec.factory, dict(spec.props, name=node.name))
+            return _render_spec(spec, show_name)
+
+        visited = set()
+        pending = []  # [(上游 Node, 下游 Node)]
+        chains = []
+
+        def walk(start, prefix):
+            text = prefix
+            node = start
+            while True:
+                if id(node) in visited:
+                    chains.append(f'{text}{node.name}.')
+                    return
+                visited.add(id(node))
+                text += render(node)
+                nexts = outs[id(node)]
+                for extra in nexts[1:]:
+                    pending.append((node, extra))
+                if not nexts:
+                    chains.append(text)
+                    return
+                node = nexts[0]
+                text += ' ! '
+
+        for root in self._roots():
+            walk(root, '')
+            while pending:
+                upstream, node = pending.pop(0)
+                walk(node, f'{upstream.name}. ! ')
+
+        return '  '.join(chains)
+
+
+class GraphMediaFactory(GstRtspServer.RTSPMediaFactory):
+    """
+    由 PipelineGraph 构建 media 的 RTSPMediaFactory
+
+    每次创建 media 时调用 graph_builder() 得到新图，payloader 需命名为 pay0
+    """
+
+    def __init__(self, graph_builder, on_built=None):
+        """
+        Args:
+            graph_builder: 无参函数，返回 PipelineGraph
+            on_built: 可选，元素创建完成后调用 on_built(graph) (如添加 pad 探针)
+        """
+        super().__init__()
+        self.graph_builder = graph_builder
+        self.on_built = on_built
+
+    def describe(self) -> str:
+        """media pipeline 的 launch 描述 (仅用于日志)"""
+        return f'( {self.graph_builder().to_launch()} )'
+
+    def do_create_element(self, url):
+        try:
+            graph = self.graph_builder()
+            media_bin = graph.build(Gst.Bin.new(None))
+            if self.on_built:
+                self.on_built(graph)
+            return media_bin
+        except PipelineBuildError as e:
+            print(f"错误: 无法创建 media pipeline: {e}")
+            return None
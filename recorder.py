@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+分段录像 (不重新编码)
+
+从已有的编码输出 (multi_res_server.py 的 tee_N、camera_rtsp_server.py 的编码器之后)
+分出一路写入 splitmuxsink:
+
+    ... enc ! parse ! tee ─┬─ (RTSP 转发)
+                           └─ queue (I/O 线程, leaky) ! parse ! splitmuxsink (按关键帧切分)
+
+- 分段在关键帧处切分，每个文件都能独立播放
+- 按时长 (segment_seconds) 或大小 (segment_mb) 切分，按文件数/总大小/保留时长删除旧文件
+- 写盘在 queue 之后的独立线程中进行，SD 卡写入慢时 queue 丢弃积压的帧 (之后丢到下一个关键帧)，
+  不会反压实时分支
+
+配置 (全局 record 或单路 record，true 表示全部使用默认值):
+
+    "record": {
+      "path": "recordings",      # 目录，每路写入 <path>/<名称>/
+      "format": "mp4",           # mp4 / mkv / ts (mkv/ts 进程异常退出时已写入的部分仍可播放)
+      "segment_seconds": 300,    # 每段时长，0 表示不按时长切分
+      "segment_mb": 0,           # 每段大小，0 表示不按大小切分
+      "max_files": 0,            # 最多保留的文件数，0 不限
+      "max_total_mb": 0,         # 最多占用的空间，0 不限
+      "max_age_hours": 0,        # 最长保留时间，0 不限
+      "queue_mb": 16             # 写盘队列大小
+    }
+"""
+
+import os
+import re
+import threading
+import time
+
+import gi
+
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from pipeline_graph import element
+
+
+RECORD_DEFAULTS = {
+    'path': 'recordings',
+    'format': 'mp4',
+    'segment_seconds': 300,
+    'segment_mb': 0,
+    'max_files': 0,
+    'max_total_mb': 0,
+    'max_age_hours': 0,
+    'queue_mb': 16,
+}
+
+# 格式 -> (扩展名, 封装元素，None 为 splitmuxsink 默认的 mp4mux)
+_FORMATS = {
+    'mp4': ('mp4', None),
+    'mkv': ('mkv', 'matroskamux'),
+    'ts': ('ts', 'mpegtsmux'),
+}
+
+
+def record_settings(*blocks):
+    """
+    合并录像配置 (后面的覆盖前面的，如 全局 -> 单路)
+
+    Args:
+        blocks: true / false / dict / None
+
+    Returns:
+        合并后的配置 dict，未启用时返回 None
+
+    Raises:
+        ValueError: 不支持的 format
+    """
+    merged = None
+    for block in blocks:
+        if block is None:
+            continue
+        if block is False or (isinstance(block, dict) and block.get('enable') is False):
+            merged = None
+            continue
+        merged = dict(merged or RECORD_DEFAULTS)
+        if isinstance(block, dict):
+            merged.update({k: v for k, v in block.items() if k != 'enable'})
+    if merged is not None and merged['format'] not in _FORMATS:
+        raise ValueError(f"不支持的录像格式: {merged['format']} (可选: {', '.join(_FORMATS)})")
+    return merged
+
+
+def describe_record(settings: dict) -> str:
+    """录像配置的可读描述"""
+    parts = [f"{settings['path']} ({settings['format']})"]
+    if settings['segment_seconds']:
+        parts.append(f"每段 {settings['segment_seconds']}s")
+    if settings['segment_mb']:
+        parts.append(f"每段 {settings['segment_mb']}MB")
+    limits = []
+    if settings['max_files']:
+        limits.append(f"{settings['max_files']} 个文件")
+    if settings['max_total_mb']:
+        limits.append(f"{settings['max_total_mb']}MB")
+    if settings['max_age_hours']:
+        limits.append(f"{settings['max_age_hours']} 小时")
+    if limits:
+        parts.append(f"保留 {' / '.join(limits)}")
+    return ', '.join(parts)
+
+
+class SegmentRecorder:
+    """
+    一路录像
+
+    elements() 生成录像支路的元素，元素创建后 (状态切换之前) 调用 attach(graph) 绑定。
+    同一个实例可在分支重建后再次 attach，计数累计。
+    """
+
+    # 停止录像时等待最后一段封装完成的最长时间 (秒)
+    FINISH_TIMEOUT = 5
+    # 收到 EOS 后确认没有开始新分段的等待时间 (秒)
+    FINISH_SETTLE = 0.3
+
+    def __init__(self, name: str, codec: str, settings: dict):
+        """
+        Args:
+            name: 流名称 (文件名前缀和子目录名)
+            codec: h264 或 h265
+            settings: record_settings() 的结果
+        """
+        self.name = name
+        self.codec = codec
+        self.settings = settings
+        self.label = re.sub(r'[^A-Za-z0-9_.-]', '_', name) or 'stream'
+        self.directory = os.path.join(os.path.abspath(settings['path']), self.label)
+        self.extension, self.muxer = _FORMATS[settings['format']]
+        self.current = None  # 正在写入的文件
+        self.segments = 0
+        self.deleted = 0
+        self.dropped = 0
+        self._resync = True  # 丢帧到下一个关键帧 (开始录像或写盘队列溢出后)
+        self._lock = threading.Lock()
+        self._finishing = None  # 停止录像时的完成回调
+        self._input_eos = False
+
+    def elements(self) -> list:
+        """录像支路: queue ! parse ! splitmuxsink"""
+        s = self.settings
+        props = {}
+        if s['segment_seconds']:
+            props['max_size_time'] = int(s['segment_seconds'] * Gst.SECOND)
+        if s['segment_mb']:
+            props['max_size_bytes'] = int(s['segment_mb'] * 1024 * 1024)
+        if s['segment_seconds'] and not s['segment_mb']:
+            # 到时长时请求编码器出关键帧，分段时长更准确
+            props['send_keyframe_requests'] = True
+        return [
+            element('queue', name='record_queue', max_size_buffers=0, max_size_time=0,
+                    max_size_bytes=int(s['queue_mb'] * 1024 * 1024), leaky='downstream'),
+            element(f'{self.codec}parse', name='record_parse'),
+            element('splitmuxsink', name='record_mux', **props),
+        ]
+
+    def attach(self, graph):
+        """绑定 elements() 创建的元素 (需在状态切换之前调用)"""
+        os.makedirs(self.directory, exist_ok=True)
+        self._resync = True
+        self._input_eos = False
+
+        queue = graph['record_queue']
+        queue.connect('overrun', self._on_overrun)
+        queue.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, self._on_queue_output)
+
+        splitmux = graph['record_mux']
+        if self.muxer:
+            splitmux.set_property('muxer', Gst.ElementFactory.make(self.muxer, None))
+        # 自己创建 filesink，以便观察每段的 EOS
+        sink = Gst.ElementFactory.make('filesink', None)
+        sink.get_static_pad('sink').add_probe(Gst.PadProbeType.EVENT_DOWNSTREAM, self._on_sink_event)
+        splitmux.set_property('sink', sink)
+        graph['record_parse'].get_static_pad('src').add_probe(Gst.PadProbeType.EVENT_DOWNSTREAM,
+                                                              self._on_input_event)
+        splitmux.connect('format-location', self._on_format_location)
+
+    def finish(self, on_done):
+        """
+        录像支路的输入即将收到 EOS (由调用方发送): 最后一段封装完成后调用 on_done()
+
+        on_done 在 GStreamer 或定时器线程中调用，超时 FINISH_TIMEOUT 秒后也会调用
+        """
+        with self._lock:
+            self._finishing = on_done
+        timer = threading.Timer(self.FINISH_TIMEOUT, self._done)
+        timer.daemon = True
+        timer.start()
+
+    def _done(self):
+        with self._lock:
+            on_done, self._finishing = self._finishing, None
+        if on_done is not None:
+            print(f"[录像] {self.name}: 已停止 ({self.current or '没有写入文件'})")
+            on_done()
+
+    def _on_overrun(self, queue):
+        if not self._resync:
+            print(f"[录像] {self.name}: 写盘跟不上，丢弃积压的帧直到下一个关键帧")
+        self._resync = True
+
+    def _on_queue_output(self, pad, info):
+        buf = info.get_buffer()
+        if self._resync:
+            if buf.has_flags(Gst.BufferFlags.DELTA_UNIT):
+                self.dropped += 1
+                return Gst.PadProbeReturn.DROP
+            self._resync = False
+        return Gst.PadProbeReturn.OK
+
+    def _on_input_event(self, pad, info):
+        if info.get_event().type == Gst.EventType.EOS:
+            self._input_eos = True
+        return Gst.PadProbeReturn.OK
+
+    def _on_sink_event(self, pad, info):
+        # 每段结束时 splitmuxsink 都会向 filesink 发 EOS；输入已 EOS 后稍等确认没有开始新分段
+        if info.get_event().type == Gst.EventType.EOS and self._finishing is not None \
+                and self._input_eos:
+            segments = self.segments
+            timer = threading.Timer(self.FINISH_SETTLE,
+                                    lambda: self._done() if self.segments == segments else None)
+            timer.daemon = True
+            timer.start()
+        return Gst.PadProbeReturn.OK
+
+    def _on_format_location(self, splitmux, fragment_id) -> str:
+        """新分段开始 (splitmuxsink 线程): 返回文件名，并按保留策略删除旧文件"""
+        self._enforce_retention()
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        self.current = os.path.join(self.directory, f'{self.label}_{stamp}_{fragment_id:05d}.{self.extension}')
+        self.segments += 1
+        return self.current
+
+    def files(self) -> list:
+        """已写入的文件，从旧到新"""
+        prefix = f'{self.label}_'
+        suffix = f'.{self.extension}'
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return sorted(os.path.join(self.directory, n) for n in names
+                      if n.startswith(prefix) and n.endswith(suffix))
+
+    def _enforce_retention(self):
+        """按文件数/总大小/保留时长删除最旧的文件 (为即将开始的分段留出一个文件)"""
+        s = self.settings
+        if not (s['max_files'] or s['max_total_mb'] or s['max_age_hours']):
+            return
+        files = []
+        for path in self.files():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((path, stat.st_size, stat.st_mtime))
+
+        total = sum(size for _, size, _ in files)
+        oldest_allowed = time.time() - s['max_age_hours'] * 3600
+        while files:
+            path, size, mtime = files[0]
+            if not ((s['max_files'] and len(files) >= s['max_files']) or
+                    (s['max_total_mb'] and total > s['max_total_mb'] * 1024 * 1024) or
+                    (s['max_age_hours'] and mtime < oldest_allowed)):
+                break
+            try:
+                os.remove(path)
+                self.deleted += 1
+            except OSError as e:
+                print(f"[录像] {self.name}: 无法删除 {path}: {e}")
+            files.pop(0)
+            total -= size
+
+
+def watch_recorders(metrics, recorders):
+    """
+    在 /metrics 中输出录像计数
+
+    Args:
+        metrics: ServerMetrics
+        recorders: 无参函数，返回当前的 SegmentRecorder 列表
+    """
+    r = metrics.registry
+    r.describe('record_segments_total', 'counter', 'Recording segments started')
+    r.describe('record_deleted_files_total', 'counter', 'Recording files removed by retention')
+    r.describe('record_dropped_buffers_total', 'counter', 'Buffers dropped because the disk writer fell behind')
+
+    def collect():
+        samples = []
+        for recorder in recorders():
+            labels = {'stream': recorder.name}
+            samples.append(('record_segments_total', labels, recorder.segments))
+            samples.append(('record_deleted_files_total', labels, recorder.deleted))
+            samples.append(('record_dropped_buffers_total', labels, recorder.dropped))
+        return samples
+
+    r.add_collector(collect)
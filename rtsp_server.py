@@ -2,6 +2,16 @@
 """
 Jetson Nano RTSP Server
 使用 GStreamer RTSP Server 推送视频文件，支持 H.265 硬件加速编码
+
+MP4/MOV 文件按 access unit 索引回放 (file_library.py): 只解析一次 sample table，
+循环播放时时间戳连续。参数为目录时，目录中的每个视频文件挂载为 /files/<name>。
+
+默认所有客户端共享同一个播放进度 (直播式回放)；--vod 为点播模式，每个客户端独立的
+播放会话，支持 RTSP Range seek，同一文件的会话共用索引和页缓存。
+
+每个文件先用 Discoverer 探测容器和编码 (按路径和修改时间缓存，media_probe.py)。
+H.264/H.265 输入在输出编码相同且码率不超过 --bitrate 时直接透传 (parse ! pay)，
+只有输出编码或码率确实不同时才解码再编码 (Jetson 硬件编解码，其他平台软件编解码)。
 """
 
 import sys
@@ -13,56 +23,192 @@ gi.require_version('Gst', '1.0')
 gi.require_version('GstRtspServer', '1.0')
 from gi.repository import Gst, GstRtspServer, GLib
 
+from http_service import HTTPService
+from metrics import ServerMetrics
+from file_library import (INDEXABLE_EXTENSIONS, VIDEO_EXTENSIONS, FileLibrary, IndexedFeeder,
+                          UnsupportedFileError, load_index)
+from gst_backend import BACKEND_CHOICES, select_backend
+from media_probe import StreamInfo, probe_file
+from pipeline_graph import GraphMediaFactory, PipelineGraph, element
+
+
+# 可直接 RTP 打包的编码
+PAYLOADABLE_CODECS = ('h264', 'h265')
+
+# 转码且未指定码率、输入码率未知时的输出码率 (bps)
+DEFAULT_BITRATE = 4000000
+
+# 容器 -> demux 元素 (None 为裸码流，不需要 demux)
+_DEMUXERS = {
+    'mp4': 'qtdemux',
+    'mkv': 'matroskademux',
+    'mpegts': 'tsdemux',
+    'flv': 'flvdemux',
+    'avi': 'avidemux',
+}
+
 
 class RTSPServer:
     def __init__(self, video_file: str, port: int = 8554, mount_point: str = "/stream",
-                 codec: str = "h265", bitrate: int = 4000000, loop: bool = True):
+                 codec: str = None, bitrate: int = None, loop: bool = True,
+                 metrics_port: int = None, vod: bool = False, backend: str = 'auto'):
         """
         初始化 RTSP 服务器
 
         Args:
-            video_file: 视频文件路径
+            video_file: 视频文件路径，或视频目录 (每个文件挂载为 /files/<name>)
             port: RTSP 端口号
-            mount_point: RTSP 挂载点
-            codec: 编码格式 (h264 或 h265)
-            bitrate: 编码比特率 (bps)
+            mount_point: RTSP 挂载点 (单个文件时)
+            codec: 输出编码 (h264 或 h265)，None 表示与输入相同
+            bitrate: 输出码率上限 (bps)，输入码率更高时转码；None 表示不限制
             loop: 是否循环播放
+            metrics_port: /metrics HTTP 端口 (None 表示不启用)
+            vod: 点播模式，每个客户端独立播放并可 seek (不循环)
+            backend: 转码使用的编解码后端 (auto/jetson/software)
         """
         self.video_file = os.path.abspath(video_file)
         self.port = port
         self.mount_point = mount_point
         self.codec = codec
         self.bitrate = bitrate
-        self.loop = loop
+        self.vod = vod
+        self.loop = loop and not vod
+        self.metrics_port = metrics_port
+        self.metrics = ServerMetrics() if metrics_port else None
 
         if not os.path.exists(self.video_file):
             raise FileNotFoundError(f"视频文件不存在: {self.video_file}")
+        self.library = FileLibrary(self.video_file) if os.path.isdir(self.video_file) else None
 
         Gst.init(None)
+        self.backend = select_backend(backend)
+
+    def _sources(self) -> list:
+        """[(挂载点, 文件路径)]"""
+        if self.library:
+            return [(self.library.mount(name), path) for name, path in self.library.files.items()]
+        return [(self.mount_point, self.video_file)]
+
+    @staticmethod
+    def _load_index(path: str):
+        """文件的 access unit 索引，不能建立索引时返回 None (回退到 demux 回放)"""
+        if not path.lower().endswith(INDEXABLE_EXTENSIONS):
+            return None
+        try:
+            return load_index(path)
+        except UnsupportedFileError as e:
+            print(f"[索引] {os.path.basename(path)}: {e}，使用 demux 回放")
+            return None
 
-    def _build_pipeline(self) -> str:
-        """构建 GStreamer pipeline 字符串 - H.265 透传模式"""
-
-        # H.265 输入直接透传，无需重新编码
-        pipeline = (
-            f"( filesrc location=\"{self.video_file}\" ! "
-            f"qtdemux ! h265parse ! "
-            f"rtph265pay name=pay0 pt=96 config-interval=1 )"
-        )
-
-        return pipeline
+    def _inspect(self, path: str):
+        """
+        探测文件 (Discoverer 结果按路径和修改时间缓存)
 
-    def _build_loop_pipeline(self) -> str:
-        """构建支持循环播放的 GStreamer pipeline 字符串"""
+        Returns:
+            (StreamInfo, SampleIndex 或 None)，不是视频文件时 StreamInfo 为 None
+        """
+        index = self._load_index(path)
+        info = probe_file(path)
+        if index is not None:
+            if info is None:
+                info = StreamInfo(index.codec, index.width, index.height, index.framerate, None, 'mp4')
+            # 索引按 sample 大小算出的平均码率比容器标签可靠
+            info = info._replace(bitrate=index.bitrate or info.bitrate)
+        return info, index
+
+    def _output_codec(self, info: StreamInfo) -> str:
+        if self.codec:
+            return self.codec
+        return info.codec if info.codec in PAYLOADABLE_CODECS else 'h265'
+
+    def _transcode_reason(self, info: StreamInfo):
+        """需要转码的原因，可以透传时返回 None"""
+        output = self._output_codec(info)
+        if info.codec not in PAYLOADABLE_CODECS:
+            return f"输入编码 {info.codec} 不能直接 RTP 打包"
+        if info.codec != output:
+            return f"输入 {info.codec} 与输出 {output} 编码不同"
+        if self.bitrate and info.bitrate and info.bitrate > self.bitrate:
+            return f"输入码率 {info.bitrate // 1000} kbps 高于 {self.bitrate // 1000} kbps"
+        return None
+
+    def _build_graph(self, path: str, info: StreamInfo, index=None,
+                     transcode: bool = False) -> PipelineGraph:
+        """
+        构建文件回放 pipeline 图
 
-        # H.265 输入循环播放，透传模式
-        pipeline = (
-            f"( multifilesrc location=\"{self.video_file}\" loop=true ! "
-            f"qtdemux ! h265parse ! "
-            f"rtph265pay name=pay0 pt=96 config-interval=1 )"
-        )
+            索引:  appsrc ! parse [! 解码 ! 编码 ! parse] ! pay
+            demux: (multi)filesrc ! demux ! parse [! 解码 ! 编码 ! parse] ! pay
+        """
+        parsable = info.codec in PAYLOADABLE_CODECS
+        if index is not None:
+            specs = [element('appsrc', name='filesrc_in', format='time')]
+        else:
+            # 不能建立索引的文件循环播放时 multifilesrc 在文件末尾重新打开
+            if self.loop:
+                specs = [element('multifilesrc', location=path, loop=True)]
+            else:
+                specs = [element('filesrc', location=path)]
+            if not parsable:
+                specs.append(element('decodebin'))
+            elif info.container is not None:
+                specs.append(element(_DEMUXERS.get(info.container, 'parsebin')))
+        if parsable:
+            specs.append(element(f'{info.codec}parse', name='inparse' if transcode else 'parse'))
+
+        output = self._output_codec(info)
+        if transcode:
+            if parsable:
+                specs += self.backend.decoder(info.codec)
+            specs += self.backend.upload()
+            # I 帧间隔约 1 秒，便于点播 seek
+            gop = max(1, round(info.framerate or 30))
+            specs += self.backend.encoder(output, self.bitrate or info.bitrate or DEFAULT_BITRATE,
+                                          iframeinterval=gop, name='encoder')
+            specs.append(element(f'{output}parse', name='parse'))
+        specs.append(element(f'rtp{output}pay', name='pay0', pt=96, config_interval=1))
+
+        graph = PipelineGraph()
+        graph.chain(specs)
+        return graph
+
+    def _on_media_built(self, mount: str, index, graph: PipelineGraph):
+        """按索引推送 access unit，统计透传码流的 fps/比特率"""
+        if index is not None:
+            IndexedFeeder(index, graph['filesrc_in'], self.loop, seekable=self.vod)
+        if self.metrics:
+            self.metrics.watch_flow(mount, graph['parse'].get_static_pad('src'))
+
+    def _create_factory(self, mount: str, path: str) -> GraphMediaFactory:
+        """
+        一个文件的 MediaFactory: 能建立索引时按索引回放，否则 demux 回放；
+        能透传时不解码，否则转码
 
-        return pipeline
+        Returns:
+            GraphMediaFactory，不是视频文件时返回 None
+        """
+        info, index = self._inspect(path)
+        if info is None:
+            print(f"[探测] {os.path.basename(path)}: 没有视频流，跳过")
+            return None
+        reason = self._transcode_reason(info)
+        transcode = reason is not None
+        if transcode:
+            print(f"[转码] {mount}: {reason}，使用 {self.backend.name} 后端转码为 "
+                  f"{self._output_codec(info).upper()}")
+
+        builder = lambda: self._build_graph(path, info, index, transcode)
+        factory = GraphMediaFactory(builder, lambda graph: self._on_media_built(mount, index, graph))
+        # 点播: 每个客户端一个 media (同一文件共用 index)
+        factory.set_shared(not self.vod)
+        factory.index = index
+        factory.info = info
+        factory.transcode = transcode
+
+        if self.metrics:
+            factory.connect('media-configure',
+                            lambda f, media: self.metrics.watch_media(mount, media))
+        return factory
 
     def start(self):
         """启动 RTSP 服务器"""
@@ -70,35 +216,55 @@ class RTSPServer:
         server = GstRtspServer.RTSPServer()
         server.set_service(str(self.port))
 
-        factory = GstRtspServer.RTSPMediaFactory()
-
-        if self.loop:
-            pipeline = self._build_loop_pipeline()
-        else:
-            pipeline = self._build_pipeline()
-
-        print(f"Pipeline: {pipeline}")
-        factory.set_launch(pipeline)
-        factory.set_shared(True)
-
         mounts = server.get_mount_points()
-        mounts.add_factory(self.mount_point, factory)
+        factories = []
+        for mount, path in self._sources():
+            factory = self._create_factory(mount, path)
+            if factory is None:
+                continue
+            mounts.add_factory(mount, factory)
+            factories.append((mount, path, factory))
+        if not factories:
+            raise FileNotFoundError(f"没有可播放的视频文件 ({', '.join(VIDEO_EXTENSIONS)}): {self.video_file}")
+        print(f"Pipeline: {factories[0][2].describe()}")
+
+        if self.metrics:
+            self.metrics.watch_server(server, self.port)
 
         server.attach(None)
 
+        if self.metrics:
+            http = HTTPService(self.metrics_port)
+            http.route('GET', '/metrics', self.metrics.handle)
+            http.start()
+
         # 获取所有网卡 IP
         ips = self._get_all_ips()
 
         print("=" * 50)
         print(f"RTSP 服务器已启动")
-        print(f"视频文件: {self.video_file}")
-        print(f"编码格式: {self.codec.upper()}")
-        print(f"比特率: {self.bitrate // 1000} kbps")
+        print(f"{'视频目录' if self.library else '视频文件'}: {self.video_file}")
+        print(f"编码格式: {self.codec.upper() if self.codec else '与输入相同'}")
+        print(f"码率上限: {f'{self.bitrate // 1000} kbps' if self.bitrate else '不限制'}")
+        print(f"转码后端: {self.backend.name}")
+        print(f"播放模式: {'点播 (每个客户端独立, 可 seek)' if self.vod else '共享'}")
         print(f"循环播放: {'是' if self.loop else '否'}")
+        if self.metrics:
+            print(f"运行指标: http://<ip>:{self.metrics_port}/metrics")
         print("=" * 50)
         print("RTSP 地址:")
-        for iface, ip in ips:
-            print(f"  [{iface}] rtsp://{ip}:{self.port}{self.mount_point}")
+        for mount, path, factory in factories:
+            if self.library:
+                print(f"  {os.path.basename(path)}")
+            info = factory.info
+            print(f"    输入: {info.container or '裸码流'} {info.codec.upper()} "
+                  f"{info.width or '?'}x{info.height or '?'}"
+                  f"{f', {info.bitrate // 1000} kbps' if info.bitrate else ''}"
+                  f" -> {'转码' if factory.transcode else '透传'}")
+            if factory.index is not None:
+                print(f"    索引: {factory.index.describe()}")
+            for iface, ip in ips:
+                print(f"    [{iface}] rtsp://{ip}:{self.port}{mount}")
         print("=" * 50)
         print("按 Ctrl+C 停止服务器")
 
@@ -149,15 +315,31 @@ def main():
   # 使用默认设置 (H.265, 端口 8554)
   python3 rtsp_server.py video.mp4
 
-  # 使用 H.264 编码
+  # 输出 H.264 (输入是 H.264 时透传，否则转码)
   python3 rtsp_server.py video.mp4 --codec h264
 
-  # 指定端口和比特率
+  # 指定端口和码率上限 (输入码率更高时转码到 8000 kbps)
   python3 rtsp_server.py video.mp4 --port 8555 --bitrate 8000
 
+  # MKV / TS / 裸 H.264 码流同样支持
+  python3 rtsp_server.py video.mkv
+
   # 不循环播放
   python3 rtsp_server.py video.mp4 --no-loop
 
+  # 目录中的每个视频文件挂载为 /files/<文件名去掉扩展名>
+  python3 rtsp_server.py /data/videos
+  # -> rtsp://<jetson-ip>:8554/files/cam01 (cam01.mp4), /files/cam02 ...
+
+  # 点播: 每个客户端独立播放，可拖动进度 (RTSP Range)
+  python3 rtsp_server.py /data/recordings --vod
+  ffplay -ss 120 rtsp://<jetson-ip>:8554/files/cam01
+
+  # 作为下游解码器的稳定回放源做压测 (循环点时间戳连续)
+  for i in $(seq 8); do
+    gst-launch-1.0 -q rtspsrc location=rtsp://<jetson-ip>:8554/stream ! decodebin ! fakesink sync=true &
+  done
+
 播放:
   # VLC
   vlc rtsp://<jetson-ip>:8554/stream
@@ -170,17 +352,23 @@ def main():
         """
     )
 
-    parser.add_argument("video", help="视频文件路径")
+    parser.add_argument("video", help="视频文件路径，或视频目录 (挂载为 /files/<name>)")
     parser.add_argument("--port", "-p", type=int, default=8554,
                         help="RTSP 端口号 (默认: 8554)")
     parser.add_argument("--mount", "-m", default="/stream",
                         help="RTSP 挂载点 (默认: /stream)")
-    parser.add_argument("--codec", "-c", choices=["h264", "h265"], default="h265",
-                        help="编码格式 (默认: h265)")
-    parser.add_argument("--bitrate", "-b", type=int, default=4000,
-                        help="编码比特率 kbps (默认: 4000)")
+    parser.add_argument("--codec", "-c", choices=["h264", "h265"], default=None,
+                        help="输出编码，与输入不同时转码 (默认: 与输入相同)")
+    parser.add_argument("--bitrate", "-b", type=int, default=None,
+                        help="输出码率上限 kbps，输入码率更高时转码 (默认: 不限制，转码时 4000)")
+    parser.add_argument("--backend", choices=BACKEND_CHOICES, default="auto",
+                        help="转码使用的编解码后端 (默认: auto)")
     parser.add_argument("--no-loop", action="store_true",
                         help="不循环播放视频")
+    parser.add_argument("--vod", action="store_true",
+                        help="点播模式: 每个客户端独立播放会话，支持 seek (不循环)")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="在该端口提供 HTTP /metrics 运行指标 (默认不启用)")
 
     args = parser.parse_args()
 
@@ -190,8 +378,11 @@ def main():
             port=args.port,
             mount_point=args.mount,
             codec=args.codec,
-            bitrate=args.bitrate * 1000,  # 转换为 bps
-            loop=not args.no_loop
+            bitrate=args.bitrate * 1000 if args.bitrate else None,  # 转换为 bps
+            loop=not args.no_loop,
+            metrics_port=args.metrics_port,
+            vod=args.vod,
+            backend=args.backend
         )
         server.start()
     except FileNotFoundError as e:
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+RTSP 监听端口管理
+
+把多路服务器中 "每个端口一个 RTSPServer" 的逻辑集中到这里，并提供:
+  - single_port: 所有挂载点合并到一个监听端口 (一个 RTSPServer)。
+    配置在其他端口上的挂载点加上 /<端口> 前缀，如 8555 的 /stream -> 8554 的 /8555/stream
+  - client_threads: 每个 RTSPServer 的 RTSPThreadPool 最大线程数。
+    客户端连接轮流分配到这些线程处理 RTSP 请求；每个 media 另有自己的线程 (GstRtspServer 默认行为)
+  - thread_per_port: 每个监听端口 attach 到独立的 GMainContext，由专门的线程运行，
+    某个端口上的 DESCRIBE/SETUP 突发不会拖慢其他端口和主循环 (pipeline 管理、HTTP、热加载)
+
+注意: 开启 thread_per_port 或 client_threads > 1 后，factory / media / client 的信号
+在这些线程中发出，回调中修改共享状态需要自己加锁或用 GLib.idle_add 切回主循环。
+
+组播 (configure_multicast): 共享 factory 可以用 RTSP 组播传输，同一 VLAN 上 N 个客户端
+只占用一路码流的出口带宽。配置 (全局 multicast 或单路 multicast，true 表示全部用默认值):
+
+    "multicast": {
+      "mode": "prefer",                 # prefer: 单播/组播都可，由客户端选择; force: 只允许组播
+      "address_range": ["239.255.42.1", "239.255.42.254"],
+      "port_range": [5000, 5999],
+      "ttl": 1,                         # 1 只在本网段; 跨路由器时调大
+      "iface": "eth0"                   # 可选: 发送组播的网卡
+    }
+"""
+
+import threading
+
+import gi
+
+gi.require_version('GstRtsp', '1.0')
+from gi.repository import GLib, GstRtsp, GstRtspServer
+
+from config_reload import drop_mount_sessions
+
+
+MULTICAST_DEFAULTS = {
+    'mode': 'prefer',
+    'address_range': ['239.255.42.1', '239.255.42.254'],
+    'port_range': [5000, 5999],
+    'ttl': 1,
+    'iface': None,
+}
+
+# 地址范围 -> RTSPAddressPool，进程内所有 factory 共用，不同挂载点不会分到相同的组播地址/端口
+_address_pools = {}
+_pool_lock = threading.Lock()
+
+
+def multicast_settings(*blocks):
+    """
+    合并组播配置 (后面的覆盖前面的，如 全局 -> 单路)
+
+    Args:
+        blocks: true / false / dict / None
+
+    Returns:
+        合并后的配置 dict，未启用时返回 None
+    """
+    merged = None
+    for block in blocks:
+        if block is None:
+            continue
+        if block is False or (isinstance(block, dict) and block.get('enable') is False):
+            merged = None
+            continue
+        merged = dict(merged or MULTICAST_DEFAULTS)
+        if isinstance(block, dict):
+            merged.update({k: v for k, v in block.items() if k != 'enable'})
+    if merged is not None and merged['mode'] not in ('prefer', 'force'):
+        raise ValueError(f"multicast mode 只能是 prefer 或 force: {merged['mode']}")
+    return merged
+
+
+def _address_pool(settings: dict) -> GstRtspServer.RTSPAddressPool:
+    first, last = settings['address_range']
+    port_min, port_max = settings['port_range']
+    key = (first, last, port_min, port_max)
+    with _pool_lock:
+        pool = _address_pools.get(key)
+        if pool is None:
+            pool = GstRtspServer.RTSPAddressPool()
+            if not pool.add_range(first, last, port_min, port_max, settings['ttl']):
+                raise ValueError(f"无效的组播地址范围: {first}-{last} 端口 {port_min}-{port_max}")
+            _address_pools[key] = pool
+        return pool
+
+
+def configure_multicast(factory, settings: dict):
+    """
+    让共享 factory 支持组播传输
+
+    prefer: 允许 UDP/TCP 单播和组播，请求组播的客户端 (如 VLC --rtsp-mcast,
+    ffplay -rtsp_transport udp_multicast) 共用一路组播流；force: 只接受组播
+    """
+    factory.set_address_pool(_address_pool(settings))
+    protocols = GstRtsp.RTSPLowerTrans.UDP_MCAST
+    if settings['mode'] == 'prefer':
+        protocols |= GstRtsp.RTSPLowerTrans.UDP | GstRtsp.RTSPLowerTrans.TCP
+    factory.set_protocols(protocols)
+    if settings.get('iface'):
+        factory.set_multicast_iface(settings['iface'])
+
+
+def describe_multicast(settings: dict) -> str:
+    """组播配置的可读描述"""
+    first, last = settings['address_range']
+    port_min, port_max = settings['port_range']
+    mode = '仅组播' if settings['mode'] == 'force' else '组播 (也接受单播，由客户端选择)'
+    return f"{mode} {first}-{last}:{port_min}-{port_max} TTL {settings['ttl']}"
+
+
+class RTSPService:
+    """一个进程内的全部 RTSP 监听端口和挂载点"""
+
+    def __init__(self, single_port: int = None, client_threads: int = None,
+                 thread_per_port: bool = True, metrics=None):
+        """
+        Args:
+            single_port: 合并后的监听端口，None 表示每个配置端口单独监听
+            client_threads: RTSPThreadPool 最大线程数，None 使用 GstRtspServer 默认值 (1)
+            thread_per_port: 每个监听端口使用独立的 GMainContext 和线程
+            metrics: ServerMetrics，统计各端口的客户端
+        """
+        self.single_port = single_port
+        self.client_threads = client_threads
+        self.thread_per_port = thread_per_port
+        self.metrics = metrics
+        self.servers = {}  # 监听端口 -> RTSPServer
+        self._loops = {}  # 监听端口 -> GLib.MainLoop (thread_per_port)
+        self._play_handlers = []
+        self._started = False
+
+    @classmethod
+    def from_config(cls, config: dict, single_port: int = None, client_threads: int = None,
+                    metrics=None) -> 'RTSPService':
+        """
+        按配置文件中的 single_port / rtsp_client_threads / rtsp_thread_per_port 创建，
+        参数非 None 时覆盖配置文件
+        """
+        return cls(single_port=single_port or config.get('single_port'),
+                   client_threads=client_threads or config.get('rtsp_client_threads'),
+                   thread_per_port=config.get('rtsp_thread_per_port', True),
+                   metrics=metrics)
+
+    def endpoint(self, port: int, mount: str) -> tuple:
+        """
+        配置的 (端口, 挂载点) 实际对应的 (监听端口, 路径)
+        """
+        if self.single_port is None or port == self.single_port:
+            return port, mount
+        return self.single_port, f'/{port}{mount}'
+
+    def server(self, port: int) -> GstRtspServer.RTSPServer:
+        """配置端口对应的 RTSPServer (不存在时创建，已 start 时立即开始监听)"""
+        listen_port, _ = self.endpoint(port, '/')
+        server = self.servers.get(listen_port)
+        if server is None:
+            server = GstRtspServer.RTSPServer()
+            server.set_service(str(listen_port))
+            if self.client_threads:
+                server.get_thread_pool().set_max_threads(self.client_threads)
+            if self.metrics:
+                self.metrics.watch_server(server, listen_port)
+            server.connect('client-connected', self._on_client_connected)
+            self.servers[listen_port] = server
+            if self._started:
+                self._attach(listen_port, server)
+        return server
+
+    def on_play(self, handler):
+        """
+        注册客户端 PLAY 回调 handler(ctx)，ctx.media 为客户端所播放的 media
+
+        在 RTSP 监听线程中调用
+        """
+        self._play_handlers.append(handler)
+
+    def _on_client_connected(self, server, client):
+        if self._play_handlers:
+            client.connect('play-request', self._on_play_request)
+
+    def _on_play_request(self, client, ctx):
+        for handler in self._play_handlers:
+            handler(ctx)
+
+    def add_factory(self, port: int, mount: str, factory) -> tuple:
+        """
+        添加挂载点
+
+        Returns:
+            (监听端口, 路径)
+        """
+        server = self.server(port)
+        listen_port, path = self.endpoint(port, mount)
+        server.get_mount_points().add_factory(path, factory)
+        return listen_port, path
+
+    def remove_factory(self, port: int, mount: str) -> int:
+        """
+        删除挂载点并断开其上的会话
+
+        Returns:
+            断开的会话数
+        """
+        listen_port, path = self.endpoint(port, mount)
+        server = self.servers.get(listen_port)
+        if server is None:
+            return 0
+        server.get_mount_points().remove_factory(path)
+        return drop_mount_sessions(server, path)
+
+    def sessions(self, port: int, mount: str) -> list:
+        """
+        挂载点上的 RTSP 会话 (会话 ID、超时、各流的传输方式和客户端地址)
+        """
+        listen_port, path = self.endpoint(port, mount)
+        server = self.servers.get(listen_port)
+        if server is None:
+            return []
+        sessions = []
+
+        def session_filter(pool, session, user_data):
+            session_media, matched = session.get_media(path)
+            if session_media is not None and matched == len(path):
+                transports = []
+                for i in range(session_media.get_media().n_streams()):
+                    stream_transport = session_media.get_transport(i)
+                    if stream_transport is None:
+                        continue
+                    transport = stream_transport.get_transport()
+                    lower = transport.lower_transport
+                    if lower & GstRtsp.RTSPLowerTrans.TCP:
+                        protocol = 'tcp'
+                    elif lower & GstRtsp.RTSPLowerTrans.UDP_MCAST:
+                        protocol = 'udp-multicast'
+                    else:
+                        protocol = 'udp'
+                    transports.append({'protocol': protocol, 'destination': transport.destination,
+                                       'client_port': [transport.client_port.min, transport.client_port.max]})
+                sessions.append({'id': session.get_sessionid(), 'timeout': session.get_timeout(),
+                                 'transports': transports})
+            return GstRtspServer.RTSPFilterResult.KEEP
+
+        server.get_session_pool().filter(session_filter, None)
+        return sessions
+
+    def url(self, host: str, port: int, mount: str) -> str:
+        listen_port, path = self.endpoint(port, mount)
+        return f'rtsp://{host}:{listen_port}{path}'
+
+    def start(self):
+        """所有已创建的 RTSPServer 开始监听，之后创建的在创建时开始监听"""
+        for port, server in self.servers.items():
+            self._attach(port, server)
+        self._started = True
+
+    def stop(self):
+        for loop in self._loops.values():
+            loop.quit()
+        self._loops.clear()
+
+    def _attach(self, port: int, server):
+        if not self.thread_per_port:
+            server.attach(None)
+            return
+
+        context = GLib.MainContext.new()
+        loop = GLib.MainLoop.new(context, False)
+        server.attach(context)
+        threading.Thread(target=loop.run, name=f'rtsp-{port}', daemon=True).start()
+        self._loops[port] = loop
+
+    def describe(self) -> str:
+        """监听方式的可读描述"""
+        ports = ', '.join(str(p) for p in sorted(self.servers)) or '-'
+        threads = self.client_threads or 1
+        mode = '每端口独立线程' if self.thread_per_port else '主循环'
+        if self.single_port is not None:
+            return f"单端口 {self.single_port} (所有挂载点)，客户端线程 {threads}，监听: {mode}"
+        return f"端口 {ports}，每端口客户端线程 {threads}，监听: {mode}"
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+JPEG 快照 (HTTP /snapshot/<流名称>)
+
+从已解码的帧 (multi_res_server.py 的主 tee t、camera_rtsp_server.py 的编码器之前)
+分出一路低频取帧的支路，缩放后 JPEG 编码 (Jetson 上为 nvjpegenc)，只在内存中保留最新一张:
+
+    ... ! t ─┬─ (缩放/编码分支)
+             └─ queue (leaky, 1 帧) ! 缩放 ! jpegenc ! appsink
+
+- 取帧在 queue 入口按间隔丢帧，两次取帧之间的帧不进入缩放和编码
+- HTTP 请求直接返回缓存的 JPEG，并发请求不触发任何 pipeline 操作，也不建立 RTSP 会话
+
+配置 (全局 snapshot，true 表示全部使用默认值):
+
+    "snapshot": {
+      "interval": 2,             # 取帧间隔 (秒)
+      "width": 320,              # 缩略图宽度，高度按源的宽高比计算
+      "quality": 75,             # JPEG 质量 (1-100)
+      "port": null               # HTTP 端口，默认与 /metrics 共用 metrics_port
+    }
+"""
+
+import time
+from urllib.parse import unquote
+
+import gi
+
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from http_service import json_response
+from pipeline_graph import element
+
+
+SNAPSHOT_DEFAULTS = {
+    'interval': 2,
+    'width': 320,
+    'quality': 75,
+    'port': None,
+}
+
+
+def snapshot_settings(*blocks):
+    """
+    合并快照配置 (后面的覆盖前面的，如 全局 -> 单路)
+
+    Args:
+        blocks: true / false / dict / None
+
+    Returns:
+        合并后的配置 dict，未启用时返回 None
+    """
+    merged = None
+    for block in blocks:
+        if block is None:
+            continue
+        if block is False or (isinstance(block, dict) and block.get('enable') is False):
+            merged = None
+            continue
+        merged = dict(merged or SNAPSHOT_DEFAULTS)
+        if isinstance(block, dict):
+            merged.update({k: v for k, v in block.items() if k != 'enable'})
+    return merged
+
+
+def describe_snapshot(settings: dict) -> str:
+    """快照配置的可读描述"""
+    return f"每 {settings['interval']}s 一张，宽 {settings['width']}，质量 {settings['quality']}"
+
+
+class SnapshotTap:
+    """
+    一路快照
+
+    elements() 生成快照支路的元素，元素创建后 (状态切换之前) 调用 attach(graph) 绑定。
+    同一个实例可在 pipeline 重建后再次 attach，缓存的图片保留到新的一张到来。
+    """
+
+    def __init__(self, backend, settings: dict):
+        """
+        Args:
+            backend: gst_backend.Backend
+            settings: snapshot_settings() 的结果
+        """
+        self.backend = backend
+        self.settings = settings
+        self.jpeg = None  # 最新一张 JPEG
+        self.captured_at = None  # 最新一张的墙上时间
+        self.size = None  # (宽, 高)
+        self.captures = 0
+        self._last = None  # 上次放行的时刻 (monotonic)
+
+    def elements(self, source_width: int, source_height: int) -> list:
+        """快照支路: queue ! 缩放 ! JPEG 编码 ! appsink (高度按源的宽高比，取偶数)"""
+        width = min(self.settings['width'], source_width) // 2 * 2
+        height = max(2, int(round(width * source_height / source_width / 2)) * 2)
+        self.size = (width, height)
+        return ([element('queue', name='snapshot_queue', max_size_buffers=1, max_size_time=0,
+                         max_size_bytes=0, leaky='downstream')] +
+                self.backend.scaler(width, height, format='I420') +
+                self.backend.jpeg_encoder(self.settings['quality']) +
+                [element('appsink', name='snapshot_sink', emit_signals=True, sync=False, async_=False,
+                         max_buffers=1, drop=True)])
+
+    def attach(self, graph):
+        """绑定 elements() 创建的元素 (需在状态切换之前调用)"""
+        self._last = None
+        graph['snapshot_queue'].get_static_pad('sink').add_probe(Gst.PadProbeType.BUFFER, self._on_frame)
+        graph['snapshot_sink'].connect('new-sample', self._on_new_sample)
+
+    def _on_frame(self, pad, info):
+        # 未到取帧时间的帧在进入 queue 之前丢弃，不做缩放和编码
+        now = time.monotonic()
+        if self._last is not None and now - self._last < self.settings['interval']:
+            return Gst.PadProbeReturn.DROP
+        self._last = now
+        return Gst.PadProbeReturn.OK
+
+    def _on_new_sample(self, appsink):
+        sample = appsink.emit('pull-sample')
+        if sample is None:
+            return Gst.FlowReturn.OK
+        buf = sample.get_buffer()
+        ok, info = buf.map(Gst.MapFlags.READ)
+        if ok:
+            try:
+                # 整体替换引用，HTTP 处理 (主循环) 读到的总是完整的一张
+                self.jpeg = bytes(info.data)
+            finally:
+                buf.unmap(info)
+            self.captured_at = time.time()
+            self.captures += 1
+        return Gst.FlowReturn.OK
+
+    def describe(self) -> dict:
+        """/snapshot 列表中的一项"""
+        age = None if self.captured_at is None else round(time.time() - self.captured_at, 1)
+        return {'size': list(self.size) if self.size else None, 'age': age, 'captures': self.captures,
+                'interval': self.settings['interval']}
+
+
+class SnapshotService:
+    """
+    /snapshot HTTP 接口 (在主循环中处理)
+
+    GET /snapshot          各流的快照状态 (JSON)
+    GET /snapshot/<流名称>  最新一张 JPEG，还没有取到帧时返回 503
+    """
+
+    def __init__(self):
+        self.taps = {}  # 流名称 -> SnapshotTap (多个流可共用一个)
+
+    def register(self, http):
+        """在 HTTPService 上注册 /snapshot 路由"""
+        http.route('GET', '/snapshot', self.handle, prefix=True)
+
+    def handle(self, request) -> tuple:
+        if not request.params:
+            return json_response({name: tap.describe() for name, tap in self.taps.items()})
+        name = unquote('/'.join(request.params))
+        tap = self.taps.get(name)
+        if tap is None:
+            return 404, 'text/plain', f'unknown stream: {name}'
+        jpeg = tap.jpeg
+        if jpeg is None:
+            return 503, 'text/plain', 'no frame captured yet'
+        return 200, 'image/jpeg', jpeg
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+源级故障恢复
+
+把 "源 + 解码 + 缩放" 放到独立的 source pipeline 中，经 appsink -> appsrc 送入 RTSP media:
+
+    [source pipeline]  rtspsrc/v4l2src ... ! 解码 ! 缩放 ! appsink
+                                                           | 帧交接 (重新打时间戳)
+    [RTSP media]                                appsrc ! queue ! 编码 ! parse ! pay0
+
+上游 RTSP 断开、USB 相机报 "Device or resource busy"、解码器出错或长时间没有新帧时，
+只拆掉并按退避间隔重建 source pipeline；期间以帧率重复最后一帧 (还没有收到过帧时
+用黑帧占位)，编码器和 media 持续运行，客户端会话不断开。
+
+重试策略与下游消费者 (rtsp_streams_test_jetson.json) 的 recovery 配置块字段一致:
+
+    "recovery": {
+      "rtsp_max_retries": -1,            # 源元素错误/断流的重试次数，-1 为不限
+      "decoder_max_retries": 3,          # 解码器错误的重试次数，-1 为不限
+      "rtsp_retry_interval_ms": 1000,    # 首次重试间隔，之后逐次加倍
+      "decoder_retry_interval_ms": 1000,
+      "transition_timeout_ms": 10000     # 重建后多久没有出帧视为本次重试失败
+    }
+
+另外支持 stall_timeout_ms (运行中多久没有新帧视为断流，默认 3000) 和
+max_retry_interval_ms (退避上限，默认 30000)。rtsp_* 字段对 USB/CSI 源同样适用，
+表示源元素本身的故障。重试次数耗尽后向 media 发送 EOS，由客户端决定是否重连。
+"""
+
+import threading
+import time
+from collections import namedtuple
+
+import gi
+
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+from pipeline_graph import PipelineBuildError, PipelineGraph, element
+
+
+FAULT_SOURCE = 'source'
+FAULT_DECODER = 'decoder'
+
+
+class RecoveryPolicy(namedtuple('RecoveryPolicy', [
+        'source_max_retries', 'decoder_max_retries',
+        'source_retry_interval_ms', 'decoder_retry_interval_ms',
+        'transition_timeout_ms', 'stall_timeout_ms', 'max_retry_interval_ms'])):
+    """源恢复的重试策略 (max_retries 为 -1 表示不限次数)"""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_config(cls, *blocks) -> 'RecoveryPolicy':
+        """
+        由 recovery 配置块创建，后面的块覆盖前面的 (如 全局 -> 单路)
+
+        Args:
+            blocks: recovery 字典，None 跳过
+        """
+        merged = {}
+        for block in blocks:
+            if block:
+                merged.update(block)
+        return cls(
+            source_max_retries=merged.get('rtsp_max_retries', -1),
+            decoder_max_retries=merged.get('decoder_max_retries', -1),
+            source_retry_interval_ms=merged.get('rtsp_retry_interval_ms', 1000),
+            decoder_retry_interval_ms=merged.get('decoder_retry_interval_ms', 1000),
+            transition_timeout_ms=merged.get('transition_timeout_ms', 10000),
+            stall_timeout_ms=merged.get('stall_timeout_ms', 3000),
+            max_retry_interval_ms=merged.get('max_retry_interval_ms', 30000),
+        )
+
+    def max_retries(self, fault: str) -> int:
+        return self.decoder_max_retries if fault == FAULT_DECODER else self.source_max_retries
+
+    def delay_ms(self, fault: str, attempt: int) -> int:
+        """第 attempt 次重试前的等待时间 (毫秒)，指数退避"""
+        base = self.decoder_retry_interval_ms if fault == FAULT_DECODER else self.source_retry_interval_ms
+        return min(base * 2 ** (attempt - 1), max(base, self.max_retry_interval_ms))
+
+    def describe(self) -> str:
+        def limit(n):
+            return '不限' if n < 0 else str(n)
+        return (f"源重试 {limit(self.source_max_retries)} 次 / 解码重试 {limit(self.decoder_max_retries)} 次，"
+                f"断流判定 {self.stall_timeout_ms}ms")
+
+
+def _is_decoder(elem) -> bool:
+    """错误是否来自解码器元素 (按元素工厂分类判断)"""
+    factory = elem.get_factory() if isinstance(elem, Gst.Element) else None
+    if factory is None:
+        return False
+    klass = factory.get_metadata(Gst.ELEMENT_METADATA_KLASS) or ''
+    return 'Decoder' in klass
+
+
+class RecoverableSource:
+    """
+    一个 media 的可恢复视频源
+
+    由 media-configure 创建并 start()，media unprepared 时 stop()。
+    source pipeline 的状态切换都在主循环中进行 (bus watch、定时器)，
+    appsink 回调在 source 的 streaming 线程中只做帧交接。
+    """
+
+    SINK_NAME = 'source_sink'
+
+    def __init__(self, name: str, graph_builder, appsrc: Gst.Element, framerate: int,
+                 policy: RecoveryPolicy, placeholder_builder=None, on_built=None, stamper=None):
+        """
+        Args:
+            name: 日志中的名称 (如 :8554/stream)
+            graph_builder: 无参函数，返回 source pipeline 的 PipelineGraph
+                (源 + 解码 + 缩放，输出格式与 appsrc caps 一致，末尾不含 appsink)
+            appsrc: media 中的 appsrc
+            framerate: 中断期间重复帧的帧率
+            policy: 重试策略
+            placeholder_builder: 无参函数，返回只产生一帧黑帧的元素列表 (与 appsrc caps 一致)
+            on_built: 可选，每次 source pipeline 创建后调用 on_built(graph)
+            stamper: CaptureStamper，交接时把采集时间戳关联到新的 pts
+        """
+        self.name = name
+        self.graph_builder = graph_builder
+        self.appsrc = appsrc
+        self.framerate = max(1, framerate)
+        self.policy = policy
+        self.placeholder_builder = placeholder_builder
+        self.on_built = on_built
+        self.stamper = stamper
+
+        self._lock = threading.Lock()
+        self._last_buffer = None  # 最后一帧 (中断期间重复)
+        self._last_frame_at = None  # 最后一帧的 time.monotonic()
+        self._last_pts = None  # 最后推给 appsrc 的 pts
+        self._placeholder = None
+
+        self.pipeline = None
+        self.restarts = 0  # 累计重建次数
+        self._attempts = {FAULT_SOURCE: 0, FAULT_DECODER: 0}
+        self._outage_at = None  # 本次中断开始时间，None 表示正常出帧
+        self._started_at = None  # 本次 source pipeline 启动时间
+        self._retry_timer = None
+        self._repeat_timer = None
+        self._watch_timer = None
+        self._stopped = False
+
+    # ------------------------------------------------------------------
+    # 生命周期 (主循环)
+    # ------------------------------------------------------------------
+
+    def start(self):
+        self._stopped = False
+        self._launch()
+        interval = max(200, min(1000, self.policy.stall_timeout_ms // 2))
+        self._watch_timer = GLib.timeout_add(interval, self._on_watch)
+        return False
+
+    def stop(self):
+        """停止 source pipeline 和所有定时器"""
+        self._stopped = True
+        for attr in ('_retry_timer', '_repeat_timer', '_watch_timer'):
+            timer = getattr(self, attr)
+            if timer is not None:
+                GLib.source_remove(timer)
+                setattr(self, attr, None)
+        self._teardown()
+        with self._lock:
+            self._last_buffer = None
+        return False
+
+    def _launch(self):
+        """创建并启动 source pipeline"""
+        self._retry_timer = None
+        if self._stopped:
+            return False
+        try:
+            graph = self.graph_builder()
+            last = graph.nodes[-1]
+            sink = graph.add(element('appsink', name=self.SINK_NAME, emit_signals=True, sync=False,
+                                     max_buffers=2, drop=True))
+            graph.link(last, sink)
+            pipeline = graph.build()
+        except (PipelineBuildError, ValueError) as e:
+            self._fail(FAULT_SOURCE, f"无法创建 source pipeline: {e}")
+            return False
+        if self.on_built:
+            self.on_built(graph)
+
+        graph[self.SINK_NAME].connect('new-sample', self._on_new_sample)
+        bus = pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect('message::error', self._on_error)
+        bus.connect('message::eos', self._on_eos)
+
+        self.pipeline = pipeline
+        self._started_at = time.monotonic()
+        if pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+            self._fail(FAULT_SOURCE, "source pipeline 无法启动")
+        return False
+
+    def _teardown(self):
+        pipeline, self.pipeline = self.pipeline, None
+        if pipeline is not None:
+            pipeline.get_bus().remove_signal_watch()
+            pipeline.set_state(Gst.State.NULL)
+
+    # ------------------------------------------------------------------
+    # 故障处理 (主循环)
+    # ------------------------------------------------------------------
+
+    def _on_error(self, bus, message):
+        if message.src is None or self.pipeline is None:
+            return
+        err, debug = message.parse_error()
+        fault = FAULT_DECODER if _is_decoder(message.src) else FAULT_SOURCE
+        self._fail(fault, f"{message.src.get_name()}: {err.message}")
+
+    def _on_eos(self, bus, message):
+        if self.pipeline is not None:
+            self._fail(FAULT_SOURCE, "上游结束 (EOS)")
+
+    def _on_watch(self):
+        """断流检测: 运行中超过 stall_timeout 或重建后超过 transition_timeout 没有新帧"""
+        if self.pipeline is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            last = self._last_frame_at
+        if last is not None and last >= self._started_at:
+            if (now - last) * 1000 > self.policy.stall_timeout_ms:
+                self._fail(FAULT_SOURCE, f"{(now - last):.1f}s 没有新帧")
+        elif (now - self._started_at) * 1000 > self.policy.transition_timeout_ms:
+            self._fail(FAULT_SOURCE, f"启动后 {self.policy.transition_timeout_ms}ms 内没有出帧")
+        return True
+
+    def _fail(self, fault: str, reason: str):
+        """拆掉 source pipeline，开始补帧并安排重试 (重试次数耗尽则结束 media)"""
+        if self._stopped or self._retry_timer is not None:
+            return
+        self._teardown()
+
+        if self._outage_at is None:
+            self._outage_at = time.monotonic()
+        if self._repeat_timer is None:
+            self._repeat_timer = GLib.timeout_add(max(1, 1000 // self.framerate), self._on_repeat)
+
+        self._attempts[fault] += 1
+        attempt = self._attempts[fault]
+        limit = self.policy.max_retries(fault)
+        kind = '解码' if fault == FAULT_DECODER else '源'
+        if 0 <= limit < attempt:
+            print(f"[源恢复] {self.name}: {kind}故障 ({reason})，已重试 {limit} 次，放弃并结束该挂载点的流")
+            self.stop()
+            self.appsrc.emit('end-of-stream')
+            return
+
+        delay = self.policy.delay_ms(fault, attempt)
+        print(f"[源恢复] {self.name}: {kind}故障 ({reason})，{delay}ms 后第 {attempt} 次重建，"
+              f"期间重复最后一帧，客户端不断开")
+        self.restarts += 1
+        self._retry_timer = GLib.timeout_add(delay, self._launch)
+
+    def _on_recovered(self):
+        if self._outage_at is None:
+            return False
+        outage = time.monotonic() - self._outage_at
+        self._outage_at = None
+        self._attempts = {FAULT_SOURCE: 0, FAULT_DECODER: 0}
+        if self._repeat_timer is not None:
+            GLib.source_remove(self._repeat_timer)
+            self._repeat_timer = None
+        print(f"[源恢复] {self.name}: 已恢复出帧 (中断 {outage:.1f}s)")
+        return False
+
+    # ------------------------------------------------------------------
+    # 帧交接
+    # ------------------------------------------------------------------
+
+    def _on_new_sample(self, appsink):
+        """appsink 回调 (source streaming 线程)"""
+        sample = appsink.emit('pull-sample')
+        if sample is None:
+            return Gst.FlowReturn.OK
+        buf = sample.get_buffer()
+        with self._lock:
+            self._last_buffer = buf
+            self._last_frame_at = time.monotonic()
+        if self._outage_at is not None:
+            GLib.idle_add(self._on_recovered)
+        else:
+            self._push(buf)
+        return Gst.FlowReturn.OK
+
+    def _on_repeat(self):
+        """中断期间按帧率补帧 (主循环)"""
+        with self._lock:
+            buf = self._last_buffer
+        if buf is None:
+            buf = self._placeholder_buffer()
+        if buf is not None:
+            self._push(buf, repeat=True)
+        return True
+
+    def _push(self, buf: Gst.Buffer, repeat: bool = False):
+        """以 media 的运行时间作为 pts 推入 appsrc (media 未 PLAYING 时丢弃)"""
+        clock = self.appsrc.get_clock()
+        if clock is None:
+            return
+        pts = clock.get_time() - self.appsrc.get_base_time()
+        with self._lock:
+            if self._last_pts is not None and pts <= self._last_pts:
+                pts = self._last_pts + 1
+            self._last_pts = pts
+
+        # 浅拷贝: 只复制 buffer 元数据，帧内存共享
+        out = buf.copy()
+        if self.stamper and not repeat:
+            self.stamper.carry(buf.pts, pts)
+        out.pts = pts
+        out.dts = Gst.CLOCK_TIME_NONE
+        out.duration = Gst.SECOND // self.framerate
+        self.appsrc.emit('push-buffer', out)
+
+    def _placeholder_buffer(self):
+        """黑帧占位 (首次需要时渲染一次)"""
+        if self._placeholder is not None or self.placeholder_builder is None:
+            return self._placeholder
+        graph = PipelineGraph()
+        try:
+            graph.chain(self.placeholder_builder() + [element('appsink', name='placeholder_sink', sync=False)])
+            pipeline = graph.build()
+        except PipelineBuildError as e:
+            print(f"[源恢复] {self.name}: 无法生成占位帧: {e}")
+            self.placeholder_builder = None
+            return None
+        pipeline.set_state(Gst.State.PLAYING)
+        sample = graph['placeholder_sink'].emit('try-pull-sample', 2 * Gst.SECOND)
+        pipeline.set_state(Gst.State.NULL)
+        if sample is None:
+            self.placeholder_builder = None
+            return None
+        self._placeholder = sample.get_buffer()
+        return self._placeholder
@@ -0,0 +1,611 @@
+#!/usr/bin/env python3
+"""
+多进程监督模式
+
+把配置拆分成多个工作进程运行，单个相机出错 (pipeline ERROR 退出主循环、驱动卡死、
+段错误) 只影响它自己的流，多路流也能用上多个 CPU 核的 Python/GLib:
+
+  - camera_config.json: 每个相机一个工作进程 (camera_rtsp_server.py)。
+    共用同一个 RTSP 端口的相机必须由同一个进程监听，会合并到一个工作进程
+  - multi_res_config.json: 每个配置文件一个工作进程 (multi_res_server.py)。
+    同一个摄像头只能被一个进程打开，不按分辨率拆分
+
+监督进程负责:
+  - 把工作进程分配到不同的 CPU 核 (sched_setaffinity)
+  - 工作进程退出后按指数退避重启 (稳定运行一段时间后退避清零)
+  - 汇总 /metrics (每个样本加 worker 标签) 和 /health
+  - 配置文件修改或 SIGHUP 时重新拆分: 新增/删除工作进程，其余进程通过各自的热加载生效
+
+工作进程的配置写在 --state-dir 中 (默认临时目录)，不要直接修改。
+"""
+
+import sys
+import os
+import argparse
+import ctypes
+import json
+import shutil
+import signal
+import subprocess
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+
+import gi
+
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib
+
+from config_reload import ConfigWatcher
+from http_service import HTTPService, json_response
+from metrics import MetricsRegistry, merge_metrics
+from rtsp_service import multicast_settings
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# prctl: 监督进程退出时工作进程收到 SIGTERM
+PR_SET_PDEATHSIG = 1
+
+
+def parse_cpus(text: str) -> list:
+    """解析 CPU 列表，如 "0-3" 或 "0,2,3" """
+    cpus = set()
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def assign_cpus(count: int, cpus: list) -> list:
+    """
+    把 CPU 核分配给 count 个工作进程
+
+    工作进程少于核数时每个进程分到连续的几个核 (GStreamer 的 streaming 线程可以并行)，
+    否则每个进程一个核，轮流分配
+
+    Returns:
+        [[cpu, ...], ...]
+    """
+    if not cpus or count <= 0:
+        return [[] for _ in range(count)]
+    if count >= len(cpus):
+        return [[cpus[i % len(cpus)]] for i in range(count)]
+    result = []
+    for i in range(count):
+        start = i * len(cpus) // count
+        end = (i + 1) * len(cpus) // count
+        result.append(cpus[start:end])
+    return result
+
+
+def camera_key(stream: dict, position: int) -> str:
+    """相机的唯一标识 (用作工作进程名称)"""
+    source = stream.get('source', 'test')
+    if source == 'usb':
+        return 'usb-' + os.path.basename(stream.get('device', '/dev/video0'))
+    if source == 'rtsp':
+        return 'rtsp-' + (urlsplit(stream.get('url') or '').hostname or f'stream{position + 1}')
+    if source == 'csi':
+        return 'csi'
+    return 'test-' + (stream.get('mount', f'/stream{position + 1}').strip('/').replace('/', '-') or 'root')
+
+
+def shard_camera_config(config: dict) -> OrderedDict:
+    """
+    把 camera_rtsp_server 的多路配置按相机拆分
+
+    共用监听端口的相机合并到一个分片 (配置了 single_port 时全部合并)。
+    name/mount 的默认值依赖流在原配置中的序号，拆分前先补全。
+
+    Returns:
+        {分片名称: 分片配置}
+    """
+    default_port = config.get('port', 8554)
+    single_port = config.get('single_port')
+
+    groups = OrderedDict()  # camera key -> [stream, ...]
+    for i, stream in enumerate(config.get('streams', [])):
+        if not stream.get('enable', True):
+            continue
+        stream = dict(stream)
+        stream.setdefault('name', f'Stream {i + 1}')
+        stream.setdefault('mount', f'/stream{i + 1}')
+        stream.setdefault('port', default_port)
+        groups.setdefault(camera_key(stream, i), []).append(stream)
+
+    # 合并共用监听端口的相机
+    shards = []  # [(keys, streams, ports)]
+    for key, streams in groups.items():
+        ports = {single_port or s['port'] for s in streams}
+        merged = ([key], list(streams), set(ports))
+        for shard in [s for s in shards if s[2] & ports]:
+            shards.remove(shard)
+            merged = (shard[0] + merged[0], shard[1] + merged[1], shard[2] | merged[2])
+        shards.append(merged)
+
+    base = {k: v for k, v in config.items() if k != 'streams'}
+    result = OrderedDict()
+    for i, (keys, streams, _) in enumerate(shards):
+        shard = dict(base, streams=streams)
+        multicast = split_multicast(config.get('multicast'), len(shards), i)
+        if multicast is not None:
+            shard['multicast'] = multicast
+        result['+'.join(keys)] = shard
+    return result
+
+
+def split_multicast(multicast, count: int, index: int):
+    """
+    全局组播端口范围按分片均分
+
+    每个工作进程有自己的 RTSPAddressPool，共用同一范围会分到相同的组播地址和端口。
+    单路配置的 multicast 范围不拆分，需要自己保证不重叠。
+
+    Returns:
+        第 index 个分片的组播配置，未启用组播时返回 None
+    """
+    settings = multicast_settings(multicast)
+    if settings is None or count <= 1:
+        return settings
+    port_min, port_max = settings['port_range']
+    # 每段保持偶数起点 (RTP/RTCP 端口对)
+    size = ((port_max - port_min + 1) // count) & ~1
+    if size < 2:
+        raise ValueError(f"组播端口范围 {port_min}-{port_max} 不够分给 {count} 个工作进程")
+    first = port_min + index * size
+    return dict(settings, port_range=[first, first + size - 1])
+
+
+def shard_config(config: dict, config_path: str) -> OrderedDict:
+    """
+    按配置类型拆分
+
+    Returns:
+        {分片名称: (脚本, 分片配置)}
+    """
+    if 'camera' in config:
+        # multi_res: 一个摄像头一个进程
+        name = os.path.splitext(os.path.basename(config_path))[0]
+        return OrderedDict([(name, ('multi_res_server.py', dict(config)))])
+    return OrderedDict((name, ('camera_rtsp_server.py', shard))
+                       for name, shard in shard_camera_config(config).items())
+
+
+def shard_ports(config: dict) -> set:
+    """分片监听的 RTSP 端口"""
+    if config.get('single_port'):
+        return {config['single_port']}
+    default_port = config.get('port', 8554)
+    return {s.get('port', default_port) for s in config.get('streams', []) if s.get('enable', True)}
+
+
+class Worker:
+    """一个工作进程"""
+
+    def __init__(self, name: str, source: str, script: str, config_path: str, metrics_port: int):
+        """
+        Args:
+            name: 工作进程名称 (metrics 的 worker 标签)
+            source: 生成该分片的原始配置文件
+            script: 运行的服务器脚本
+            config_path: 分片配置文件
+            metrics_port: 工作进程的 /metrics 端口 (只供监督进程抓取)
+        """
+        self.name = name
+        self.source = source
+        self.script = script
+        self.config_path = config_path
+        self.metrics_port = metrics_port
+        self.config = None
+        self.cpus = []
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.failures = 0  # 连续失败次数 (决定退避时间)
+        self.retry_timer = None
+        self.stopping = False
+        self.last_exit = None
+
+    @property
+    def running(self) -> bool:
+        return self.process is not None
+
+    @property
+    def uptime(self) -> float:
+        return time.time() - self.started_at if self.running else 0.0
+
+    @property
+    def streams(self) -> list:
+        config = self.config or {}
+        default_port = config.get('port', 8554)
+        return [f"{s.get('port', default_port)}{s.get('mount', '')}"
+                for s in config.get('streams', []) if s.get('enable', True)]
+
+    def write_config(self, config: dict) -> bool:
+        """
+        写入分片配置 (原子替换，运行中的工作进程通过热加载生效)
+
+        Returns:
+            True 表示内容有变化
+        """
+        config = dict(config, metrics_port=self.metrics_port, watch_config=True)
+        if config == self.config:
+            return False
+        self.config = config
+        tmp_path = self.config_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(config, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.config_path)
+        return True
+
+    def start(self, on_exit):
+        """
+        启动工作进程
+
+        Args:
+            on_exit: on_exit(worker, 退出描述)，在主循环中调用
+        """
+        self.retry_timer = None
+        cmd = [sys.executable, '-u', os.path.join(SCRIPT_DIR, self.script), '--config', self.config_path]
+        cpus = self.cpus
+
+        def preexec():
+            if cpus:
+                os.sched_setaffinity(0, cpus)
+            try:
+                ctypes.CDLL('libc.so.6').prctl(PR_SET_PDEATHSIG, signal.SIGTERM)
+            except OSError:
+                pass
+
+        # 独立进程组: 终端 Ctrl+C 只发给监督进程，由它按顺序停止工作进程
+        self.process = subprocess.Popen(cmd, cwd=SCRIPT_DIR, preexec_fn=preexec, start_new_session=True)
+        self.started_at = time.time()
+        cpu_text = ','.join(str(c) for c in cpus) if cpus else '不限'
+        print(f"[监督] 启动 {self.name} (pid {self.process.pid}, CPU {cpu_text}): {', '.join(self.streams)}")
+
+        def on_child_exit(pid, status):
+            if os.WIFSIGNALED(status):
+                reason = f"信号 {signal.Signals(os.WTERMSIG(status)).name}"
+            else:
+                reason = f"退出码 {os.WEXITSTATUS(status)}"
+            # 已由 GLib 回收，避免 Popen 再次 wait
+            self.process.returncode = status
+            self.process = None
+            self.last_exit = reason
+            on_exit(self, reason)
+
+        GLib.child_watch_add(GLib.PRIORITY_DEFAULT, self.process.pid, on_child_exit)
+
+    def stop(self, wait: bool = False, timeout: float = 5.0):
+        """
+        停止工作进程 (先 SIGINT 让其清理 pipeline，超时后 SIGKILL)
+
+        Args:
+            wait: True 表示阻塞等待退出 (主循环已停止时使用)，
+                  False 表示由主循环的子进程回调回收
+        """
+        self.stopping = True
+        if self.retry_timer is not None:
+            GLib.source_remove(self.retry_timer)
+            self.retry_timer = None
+        process = self.process
+        if process is None:
+            return
+        process.send_signal(signal.SIGINT)
+
+        if not wait:
+            def force_kill():
+                if self.process is process:
+                    print(f"[监督] {self.name} 未在 {timeout:.0f}s 内退出，强制结束")
+                    process.kill()
+                return False
+            GLib.timeout_add(int(timeout * 1000), force_kill)
+            return
+
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            print(f"[监督] {self.name} 未在 {timeout:.0f}s 内退出，强制结束")
+            process.kill()
+            process.wait()
+
+
+class Supervisor:
+    """多进程监督"""
+
+    # 运行超过该秒数后退出视为偶发故障，退避从头计算
+    STABLE_SECONDS = 60
+    MAX_BACKOFF = 120
+    # 汇总 /metrics 时抓取所有工作进程的总时限 (秒)，超时的工作进程记为 worker_scrape_ok 0
+    SCRAPE_TIMEOUT = 1.0
+    SCRAPE_THREADS = 8
+
+    def __init__(self, config_paths: list, metrics_port: int = 9100, worker_metrics_base: int = 9200,
+                 cpus: list = None, backoff: float = 2, state_dir: str = None):
+        """
+        Args:
+            config_paths: camera_config.json / multi_res_config.json 配置文件
+            metrics_port: 汇总的 /metrics 和 /health 端口
+            worker_metrics_base: 工作进程 /metrics 端口的起始值 (依次递增)
+            cpus: 可用的 CPU 核，None 表示不设置亲和性
+            backoff: 首次重启的等待秒数，之后逐次加倍，上限 MAX_BACKOFF
+            state_dir: 分片配置目录，None 表示使用临时目录 (退出时删除)
+        """
+        self.config_paths = [os.path.abspath(p) for p in config_paths]
+        self.metrics_port = metrics_port
+        self.cpus = cpus
+        self.backoff = backoff
+        self._next_metrics_port = worker_metrics_base
+        self._own_state_dir = state_dir is None
+        self.state_dir = state_dir or tempfile.mkdtemp(prefix='jet_rtsp_supervisor_')
+        os.makedirs(self.state_dir, exist_ok=True)
+        self.workers = OrderedDict()  # name -> Worker
+        self.loop = None
+
+        self.registry = MetricsRegistry()
+        r = self.registry
+        r.describe('worker_up', 'gauge', 'Worker process running (1) or waiting for restart (0)')
+        r.describe('worker_restarts_total', 'counter', 'Times the worker process was restarted')
+        r.describe('worker_uptime_seconds', 'gauge', 'Seconds since the worker process started')
+        r.describe('worker_scrape_ok', 'gauge', 'Whether the last /metrics scrape of the worker succeeded')
+        r.add_collector(self._collect)
+        self._scrape_ok = {}
+        # 并行抓取工作进程的 /metrics，卡住的进程不会逐个阻塞主循环
+        self._scrape_pool = ThreadPoolExecutor(max_workers=self.SCRAPE_THREADS)
+
+    # ------------------------------------------------------------------
+    # 分片
+    # ------------------------------------------------------------------
+
+    def _apply_config(self, path: str, config: dict):
+        """按一个原始配置文件的内容增删/更新工作进程"""
+        shards = shard_config(config, path)
+        current = {name: w for name, w in self.workers.items() if w.source == path}
+
+        for name, worker in current.items():
+            if name not in shards:
+                print(f"[监督] 配置中已没有 {name}，停止工作进程")
+                worker.stop()
+                del self.workers[name]
+
+        for name, (script, shard) in shards.items():
+            worker = self.workers.get(name)
+            if worker is not None and worker.source != path:
+                print(f"[监督] 错误: {name} 同时出现在 {worker.source} 和 {path} 中，忽略后者")
+                continue
+            if worker is None:
+                worker = Worker(name, path, script, os.path.join(self.state_dir, f'{name}.json'),
+                                self._next_metrics_port)
+                self._next_metrics_port += 1
+                worker.write_config(shard)
+                self.workers[name] = worker
+            elif worker.write_config(shard):
+                print(f"[监督] {name} 的配置已更新 (工作进程热加载)")
+
+        self._check_ports()
+
+    def _check_ports(self):
+        owners = {}
+        for worker in self.workers.values():
+            for port in shard_ports(worker.config):
+                if port in owners:
+                    print(f"[监督] 警告: {owners[port]} 和 {worker.name} 都监听端口 {port}，"
+                          f"后启动的进程会失败，请为不同配置文件中的相机分配不同端口")
+                owners[port] = worker.name
+
+    def _assign_cpus(self):
+        for worker, cpus in zip(self.workers.values(), assign_cpus(len(self.workers), self.cpus or [])):
+            worker.cpus = cpus
+
+    def _start_pending(self):
+        """启动还没有运行 (也不在等待重启) 的工作进程"""
+        self._assign_cpus()
+        for worker in self.workers.values():
+            if not worker.running and worker.retry_timer is None and not worker.stopping:
+                worker.start(self._on_worker_exit)
+
+    def _reload(self, path: str, config: dict):
+        self._apply_config(path, config)
+        self._start_pending()
+
+    # ------------------------------------------------------------------
+    # 重启
+    # ------------------------------------------------------------------
+
+    def _on_worker_exit(self, worker: Worker, reason: str):
+        if worker.stopping or self.workers.get(worker.name) is not worker:
+            print(f"[监督] {worker.name} 已停止 ({reason})")
+            return
+
+        if time.time() - worker.started_at >= self.STABLE_SECONDS:
+            worker.failures = 0
+        worker.failures += 1
+        delay = min(self.backoff * 2 ** (worker.failures - 1), self.MAX_BACKOFF)
+        print(f"[监督] {worker.name} 异常退出 ({reason})，{delay:.0f}s 后重启 "
+              f"(连续第 {worker.failures} 次)", file=sys.stderr)
+        worker.retry_timer = GLib.timeout_add(int(delay * 1000), self._restart, worker)
+
+    def _restart(self, worker: Worker):
+        worker.retry_timer = None
+        if self.workers.get(worker.name) is worker and not worker.stopping:
+            worker.restarts += 1
+            worker.start(self._on_worker_exit)
+        return False
+
+    # ------------------------------------------------------------------
+    # 汇总的 /metrics 和 /health
+    # ------------------------------------------------------------------
+
+    def _collect(self) -> list:
+        samples = []
+        for worker in self.workers.values():
+            labels = {'worker': worker.name}
+            samples.append(('worker_up', labels, 1 if worker.running else 0))
+            samples.append(('worker_restarts_total', labels, worker.restarts))
+            samples.append(('worker_uptime_seconds', labels, round(worker.uptime, 1)))
+            samples.append(('worker_scrape_ok', labels, self._scrape_ok.get(worker.name, 0)))
+        return samples
+
+    def _scrape(self, port: int) -> str:
+        """抓取线程: 读取一个工作进程的 /metrics，失败返回 None"""
+        try:
+            with urlopen(f'http://127.0.0.1:{port}/metrics', timeout=self.SCRAPE_TIMEOUT) as resp:
+                return resp.read().decode('utf-8')
+        except (OSError, ValueError):
+            return None
+
+    def handle_metrics(self, request) -> tuple:
+        futures = OrderedDict((worker.name, self._scrape_pool.submit(self._scrape, worker.metrics_port))
+                              for worker in self.workers.values() if worker.running)
+        # 所有工作进程共用一个时限，主循环最多阻塞 SCRAPE_TIMEOUT 秒
+        done, pending = wait(futures.values(), timeout=self.SCRAPE_TIMEOUT)
+        for future in pending:
+            future.cancel()
+
+        texts = OrderedDict()
+        for worker in self.workers.values():
+            future = futures.get(worker.name)
+            text = future.result() if future in done and future.exception() is None else None
+            self._scrape_ok[worker.name] = 1 if text is not None else 0
+            if text:
+                texts[worker.name] = text
+        return 200, 'text/plain; version=0.0.4', self.registry.render() + merge_metrics(texts)
+
+    def handle_health(self, request) -> tuple:
+        workers = []
+        for worker in self.workers.values():
+            if worker.running:
+                state = 'running'
+            elif worker.retry_timer is not None:
+                state = 'restarting'
+            else:
+                state = 'stopped'
+            workers.append({
+                'name': worker.name,
+                'state': state,
+                'pid': worker.process.pid if worker.running else None,
+                'uptime_s': round(worker.uptime, 1),
+                'restarts': worker.restarts,
+                'last_exit': worker.last_exit,
+                'cpus': worker.cpus,
+                'streams': worker.streams,
+            })
+        healthy = all(w['state'] == 'running' for w in workers)
+        return json_response({'status': 'ok' if healthy else 'degraded', 'workers': workers},
+                             200 if healthy else 503)
+
+    # ------------------------------------------------------------------
+    # 运行
+    # ------------------------------------------------------------------
+
+    def start(self):
+        for path in self.config_paths:
+            with open(path, 'r', encoding='utf-8') as f:
+                self._apply_config(path, json.load(f))
+        if not self.workers:
+            print("错误: 配置中没有启用的流", file=sys.stderr)
+            sys.exit(1)
+
+        print("=" * 60)
+        print(f"多进程监督模式: {len(self.workers)} 个工作进程")
+        print("=" * 60)
+        self._start_pending()
+
+        for path in self.config_paths:
+            ConfigWatcher(path, lambda config, path=path: self._reload(path, config)).start()
+
+        http = HTTPService(self.metrics_port)
+        http.route('GET', '/metrics', self.handle_metrics)
+        http.route('GET', '/health', self.handle_health)
+        http.start()
+
+        print(f"\n汇总指标: http://<ip>:{self.metrics_port}/metrics")
+        print(f"健康检查: http://<ip>:{self.metrics_port}/health")
+        print("按 Ctrl+C 停止所有工作进程")
+
+        self.loop = GLib.MainLoop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signum, self._on_stop_signal)
+        try:
+            self.loop.run()
+        finally:
+            print("\n[监督] 正在停止工作进程...")
+            for worker in self.workers.values():
+                worker.stop(wait=True)
+            self._scrape_pool.shutdown(wait=False)
+            if self._own_state_dir:
+                shutil.rmtree(self.state_dir, ignore_errors=True)
+            print("[监督] 已停止")
+
+    def _on_stop_signal(self):
+        self.loop.quit()
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="RTSP 服务器多进程监督 - 按相机拆分工作进程，崩溃自动重启",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例:
+  # 多路相机配置: 每个相机 (或共用端口的一组相机) 一个工作进程
+  python3 supervisor.py camera_config.json
+
+  # 多个单摄像头多分辨率配置，各自一个工作进程，只使用 CPU 1-3
+  python3 supervisor.py cam_front.json cam_rear.json --cpus 1-3
+
+  # 汇总指标和健康检查
+  curl http://localhost:9100/metrics
+  curl http://localhost:9100/health
+
+说明:
+  - 为了隔离故障，camera_config.json 中的相机应使用不同的端口；共用端口的相机
+    只能由同一个进程监听，会合并到一个工作进程
+  - 修改原始配置文件或 kill -HUP <监督进程 pid> 会重新拆分，
+    只有新增/删除的工作进程会启停，其余进程热加载自己的配置
+        """
+    )
+    parser.add_argument("configs", nargs="+", help="camera_config.json / multi_res_config.json")
+    parser.add_argument("--metrics-port", type=int, default=9100,
+                        help="汇总 /metrics 和 /health 的端口 (默认: 9100)")
+    parser.add_argument("--worker-metrics-base", type=int, default=9200,
+                        help="工作进程 /metrics 端口起始值 (默认: 9200)")
+    parser.add_argument("--cpus", type=str, default=None,
+                        help="工作进程可用的 CPU 核，如 0-3 或 1,2,3 (默认: 当前进程可用的所有核)")
+    parser.add_argument("--no-affinity", action="store_true", help="不设置 CPU 亲和性")
+    parser.add_argument("--backoff", type=float, default=2,
+                        help="工作进程首次重启的等待秒数，之后逐次加倍 (默认: 2)")
+    parser.add_argument("--state-dir", type=str, default=None,
+                        help="分片配置目录 (默认: 临时目录)")
+
+    args = parser.parse_args()
+
+    if args.no_affinity:
+        cpus = None
+    elif args.cpus:
+        cpus = parse_cpus(args.cpus)
+    else:
+        cpus = sorted(os.sched_getaffinity(0))
+
+    try:
+        supervisor = Supervisor(args.configs, metrics_port=args.metrics_port,
+                                worker_metrics_base=args.worker_metrics_base,
+                                cpus=cpus, backoff=args.backoff, state_dir=args.state_dir)
+        supervisor.start()
+    except (OSError, ValueError) as e:
+        print(f"错误: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
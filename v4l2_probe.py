@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+V4L2 摄像头能力探测
+
+直接通过 fcntl.ioctl 查询 VIDIOC_QUERYCAP / VIDIOC_ENUM_FMT /
+VIDIOC_ENUM_FRAMESIZES / VIDIOC_ENUM_FRAMEINTERVALS，不再为每个设备启动
+v4l2-ctl 子进程或 v4l2src 元素。
+
+USB 摄像头的结果按 厂商ID:产品ID:序列号:固件版本:节点序号 缓存到磁盘
+(~/.cache/jet_rtsp/v4l2_probe.json)，同一型号的摄像头重新插拔、换 /dev/videoN
+编号后仍然命中缓存，多路启动时探测只需几毫秒。
+
+命令行:
+    python3 v4l2_probe.py                 # 列出所有摄像头
+    python3 v4l2_probe.py /dev/video0     # 列出格式/分辨率/帧率
+    python3 v4l2_probe.py --refresh       # 忽略缓存重新探测
+"""
+
+import os
+import sys
+import fcntl
+import glob
+import json
+import struct
+import threading
+import argparse
+from collections import namedtuple
+
+
+# ----------------------------------------------------------------------
+# ioctl 定义 (linux/videodev2.h)
+# ----------------------------------------------------------------------
+
+def _ioc(direction: int, nr: int, size: int) -> int:
+    return (direction << 30) | (size << 16) | (ord('V') << 8) | nr
+
+
+_IOC_READ = 2
+_IOC_WRITE = 1
+
+# struct v4l2_capability: driver[16] card[32] bus_info[32] version capabilities device_caps reserved[3]
+_CAPABILITY = struct.Struct('16s32s32sIII12x')
+# struct v4l2_fmtdesc: index type flags description[32] pixelformat reserved[4]
+_FMTDESC = struct.Struct('III32sI16x')
+# struct v4l2_frmsizeenum: index pixel_format type union[6 x u32] reserved[2]
+_FRMSIZE = struct.Struct('III6I8x')
+# struct v4l2_frmivalenum: index pixel_format width height type union[6 x u32] reserved[2]
+_FRMIVAL = struct.Struct('IIIII6I8x')
+
+VIDIOC_QUERYCAP = _ioc(_IOC_READ, 0, _CAPABILITY.size)
+VIDIOC_ENUM_FMT = _ioc(_IOC_READ | _IOC_WRITE, 2, _FMTDESC.size)
+VIDIOC_ENUM_FRAMESIZES = _ioc(_IOC_READ | _IOC_WRITE, 74, _FRMSIZE.size)
+VIDIOC_ENUM_FRAMEINTERVALS = _ioc(_IOC_READ | _IOC_WRITE, 75, _FRMIVAL.size)
+
+V4L2_BUF_TYPE_VIDEO_CAPTURE = 1
+V4L2_CAP_VIDEO_CAPTURE = 0x00000001
+V4L2_CAP_DEVICE_CAPS = 0x80000000
+V4L2_FRMSIZE_TYPE_DISCRETE = 1
+V4L2_FRMIVAL_TYPE_DISCRETE = 1
+
+# 配置中的 input_format -> V4L2 fourcc
+INPUT_FORMAT_FOURCC = {
+    'mjpeg': 'MJPG',
+    'yuyv': 'YUYV',
+    'nv12': 'NV12',
+    'h264': 'H264',
+}
+
+# 探测结果格式版本，结构变化时旧缓存自动失效
+_CACHE_VERSION = 1
+CACHE_PATH = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+                          'jet_rtsp', 'v4l2_probe.json')
+
+# 一个设备的探测结果: formats 为 {fourcc: [[width, height, [fps, ...]], ...]}
+DeviceInfo = namedtuple('DeviceInfo', ['device', 'driver', 'card', 'bus_info', 'capture', 'formats'])
+
+_cache_lock = threading.Lock()
+
+
+def _cstr(raw: bytes) -> str:
+    return raw.split(b'\0', 1)[0].decode('utf-8', 'replace')
+
+
+def _fourcc(value: int) -> str:
+    return struct.pack('<I', value).decode('ascii', 'replace').strip()
+
+
+def _enum(fd: int, request: int, layout: struct.Struct, fields: tuple):
+    """依次递增 index 调用枚举 ioctl，直到驱动返回 EINVAL"""
+    count = len(layout.unpack(bytes(layout.size)))
+    index = 0
+    while True:
+        values = (index,) + fields + (0,) * (count - 1 - len(fields))
+        buf = bytearray(layout.pack(*values))
+        try:
+            fcntl.ioctl(fd, request, buf)
+        except OSError:
+            return
+        yield layout.unpack(buf)
+        index += 1
+
+
+def _query_capability(fd: int) -> tuple:
+    buf = bytearray(_CAPABILITY.size)
+    fcntl.ioctl(fd, VIDIOC_QUERYCAP, buf)
+    driver, card, bus_info, _, caps, device_caps = _CAPABILITY.unpack(buf)
+    if caps & V4L2_CAP_DEVICE_CAPS:
+        caps = device_caps
+    return _cstr(driver), _cstr(card), _cstr(bus_info), bool(caps & V4L2_CAP_VIDEO_CAPTURE)
+
+
+def _frame_rates(fd: int, pixelformat: int, width: int, height: int) -> list:
+    rates = set()
+    for item in _enum(fd, VIDIOC_ENUM_FRAMEINTERVALS, _FRMIVAL, (pixelformat, width, height)):
+        ival_type = item[4]
+        # discrete: numerator/denominator 是帧间隔; stepwise: 取最小间隔 (最高帧率)
+        num, den = item[5], item[6]
+        if num:
+            rates.add(round(den / num, 2))
+        if ival_type != V4L2_FRMIVAL_TYPE_DISCRETE:
+            break
+    return sorted(rates, reverse=True)
+
+
+def _frame_sizes(fd: int, pixelformat: int) -> list:
+    sizes = []
+    for item in _enum(fd, VIDIOC_ENUM_FRAMESIZES, _FRMSIZE, (pixelformat,)):
+        size_type = item[2]
+        if size_type == V4L2_FRMSIZE_TYPE_DISCRETE:
+            candidates = [(item[3], item[4])]
+        else:
+            # stepwise/continuous: min_width max_width step_width min_height max_height step_height
+            candidates = [(item[4], item[7]), (item[3], item[6])]
+        for width, height in candidates:
+            sizes.append([width, height, _frame_rates(fd, pixelformat, width, height)])
+        if size_type != V4L2_FRMSIZE_TYPE_DISCRETE:
+            break
+    return sizes
+
+
+def _probe_ioctl(device: str) -> DeviceInfo:
+    fd = os.open(device, os.O_RDWR | os.O_NONBLOCK)
+    try:
+        driver, card, bus_info, capture = _query_capability(fd)
+        formats = {}
+        if capture:
+            for item in _enum(fd, VIDIOC_ENUM_FMT, _FMTDESC, (V4L2_BUF_TYPE_VIDEO_CAPTURE,)):
+                pixelformat = item[4]
+                formats[_fourcc(pixelformat)] = _frame_sizes(fd, pixelformat)
+        return DeviceInfo(device, driver, card, bus_info, capture, formats)
+    finally:
+        os.close(fd)
+
+
+def usb_identity(device: str):
+    """
+    USB 摄像头的稳定标识 (sysfs)
+
+    Returns:
+        'vid:pid:serial:bcdDevice:index'，非 USB 设备返回 None
+    """
+    node = os.path.basename(device)
+    sys_dir = f'/sys/class/video4linux/{node}'
+
+    def read(path):
+        try:
+            with open(path) as f:
+                return f.read().strip()
+        except OSError:
+            return ''
+
+    # device -> USB 接口目录，上一级是 USB 设备目录
+    usb_dir = os.path.dirname(os.path.realpath(os.path.join(sys_dir, 'device')))
+    vid = read(os.path.join(usb_dir, 'idVendor'))
+    pid = read(os.path.join(usb_dir, 'idProduct'))
+    if not vid or not pid:
+        return None
+    serial = read(os.path.join(usb_dir, 'serial'))
+    bcd = read(os.path.join(usb_dir, 'bcdDevice'))
+    index = read(os.path.join(sys_dir, 'index')) or '0'
+    return f'{vid}:{pid}:{serial}:{bcd}:{index}'
+
+
+def _load_cache() -> dict:
+    try:
+        with open(CACHE_PATH, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache if cache.get('version') == _CACHE_VERSION else {}
+
+
+def _save_cache(cache: dict):
+    cache['version'] = _CACHE_VERSION
+    try:
+        os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+        tmp = f'{CACHE_PATH}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, indent=1)
+        os.replace(tmp, CACHE_PATH)
+    except OSError:
+        pass  # 缓存只是加速，写入失败不影响探测结果
+
+
+def probe_device(device: str, refresh: bool = False):
+    """
+    探测一个 V4L2 设备
+
+    Args:
+        device: 设备路径 (如 /dev/video0)
+        refresh: 忽略缓存重新探测
+
+    Returns:
+        DeviceInfo，设备不存在或不是 V4L2 设备时返回 None
+    """
+    key = usb_identity(device)
+    if key and not refresh:
+        with _cache_lock:
+            entry = _load_cache().get('devices', {}).get(key)
+        if entry:
+            return DeviceInfo(device=device, **entry)
+
+    try:
+        info = _probe_ioctl(device)
+    except OSError:
+        return None
+
+    if key:
+        entry = info._asdict()
+        entry.pop('device')
+        with _cache_lock:
+            cache = _load_cache()
+            cache.setdefault('devices', {})[key] = entry
+            _save_cache(cache)
+    return info
+
+
+def list_resolutions(info: DeviceInfo, input_format: str = None) -> list:
+    """
+    设备支持的分辨率
+
+    Args:
+        info: probe_device() 的结果
+        input_format: 只看某种输入格式 (mjpeg/yuyv/nv12/h264)，None 表示所有格式
+
+    Returns:
+        [(width, height, max_fps), ...] 按像素数降序，每个分辨率保留最高帧率
+    """
+    fourcc = INPUT_FORMAT_FOURCC.get((input_format or '').lower())
+    best = {}
+    for fmt, sizes in info.formats.items():
+        if fourcc and fmt != fourcc:
+            continue
+        for width, height, rates in sizes:
+            fps = int(rates[0]) if rates else 0
+            if fps > best.get((width, height), -1):
+                best[(width, height)] = fps
+    return [(w, h, fps) for (w, h), fps in sorted(best.items(), key=lambda x: x[0][0] * x[0][1],
+                                                 reverse=True)]
+
+
+def list_devices(refresh: bool = False) -> list:
+    """
+    所有 /dev/video* 设备的探测结果 (按设备号排序)
+
+    Returns:
+        [DeviceInfo, ...]
+    """
+    def number(path):
+        digits = path[len('/dev/video'):]
+        return int(digits) if digits.isdigit() else 0
+
+    result = []
+    for device in sorted(glob.glob('/dev/video*'), key=number):
+        info = probe_device(device, refresh=refresh)
+        if info is not None:
+            result.append(info)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="V4L2 摄像头能力探测 (ioctl + 磁盘缓存)",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=f"""
+示例:
+  python3 v4l2_probe.py                  # 列出所有摄像头
+  python3 v4l2_probe.py /dev/video0      # 列出格式/分辨率/帧率
+  python3 v4l2_probe.py --refresh        # 忽略缓存重新探测
+
+缓存文件: {CACHE_PATH}
+        """
+    )
+    parser.add_argument("device", nargs="?", help="设备路径，如 /dev/video0")
+    parser.add_argument("--refresh", action="store_true", help="忽略缓存重新探测")
+    args = parser.parse_args()
+
+    if not args.device:
+        devices = list_devices(refresh=args.refresh)
+        for info in devices:
+            tag = '' if info.capture else '  (非采集节点)'
+            print(f"{info.device}: {info.card} [{info.driver}, {info.bus_info}]{tag}")
+        if not devices:
+            print("未找到摄像头设备")
+        return
+
+    info = probe_device(args.device, refresh=args.refresh)
+    if info is None:
+        print(f"错误: 无法打开设备 {args.device}", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"{info.device}: {info.card} [{info.driver}, {info.bus_info}]")
+    key = usb_identity(args.device)
+    if key:
+        print(f"USB 标识: {key}")
+    for fmt, sizes in info.formats.items():
+        print(f"\n格式: {fmt}")
+        for width, height, rates in sorted(sizes, key=lambda s: s[0] * s[1], reverse=True):
+            print(f"  - {width}x{height} @ {', '.join(f'{r:g}' for r in rates)} fps")
+
+
+if __name__ == "__main__":
+    main()